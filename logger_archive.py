@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# Python 3.6.3
+# logger_archive.py
+
+"""
+logger_archive.py:
+Block compressed, seekable archives of log files for days that are closed, written by logger_collector.py
+and read transparently by logger_resource.py through open_log() and log_size().
+
+An archive /srv/logger/archive/YYYYMMDD-LL-facility holds the same lines as the log file it replaces, in blocks of about
+block_bytes compressed separately with zlib, or lzma, each block ending at the end of a line.
+Blocks are followed by the block table, a fixed width entry (raw offset, archive offset) for each block,
+then a footer (table offset, number of blocks, raw size, magic) where magic names the compression.
+Offsets into an archive are the offsets into the original log file, so the offset indexes, catalogs and postings
+of the log file still apply, and a read only decompresses the blocks holding the range of lines wanted.
+
+Log files of days beyond the retention period, or up to a day requested by DELETE through logger_httpd.py,
+are removed along with their archives and index files by logger_collector.py. Requests are recorded in the expire file.
+
+An archive is written beside the log file and renamed into place before the log file is removed,
+so one or the other can always be read. A late message for an archived day restores the log file before it is appended to.
+
+Anil Gulati
+01/09/2018
+"""
+
+import os
+import lzma
+import zlib
+import bisect
+import struct
+
+log_path = '/srv/logger'
+log_directory = os.path.join(log_path, 'logs') # Log files still open for appending.
+archive_directory = os.path.join(log_path, 'archive') # Archives of log files for closed days.
+block_bytes = 256 * 1024 # Uncompressed bytes in each block, rounded up to the end of a line.
+archive_codec = 'zlib' # Compression for new archives, 'zlib' or 'lzma'.
+codecs = { 'zlib': (b'LGZ1', zlib.compress, zlib.decompress), 'lzma': (b'LGX1', lzma.compress, lzma.decompress) }
+table_entry = struct.Struct('>QQ') # Block table entry: raw offset, archive offset.
+footer = struct.Struct('>QQQ4s') # Table offset, number of blocks, raw size, magic.
+expiry_path = os.path.join(log_path, 'expire') # Latest day requested to be expired, YYYYMMDD.
+
+def archive_path(log_name):
+    return os.path.join(archive_directory, log_name)
+
+def list_archives():
+    """
+    Return the names of the archived log files.
+    """
+    try: return [name for name in os.listdir(archive_directory) if not name.endswith('.tmp')]
+    except FileNotFoundError: return []
+
+def open_log(path):
+    """
+    Return a binary file object for the log file at path, reading its archive if the log file has been archived.
+    """
+    try: return open(path, mode='rb')
+    except FileNotFoundError:
+        return ArchiveFile(archive_path(os.path.basename(path)))
+
+def log_size(path):
+    """
+    Return the size of the log file at path, the uncompressed size if it has been archived.
+    """
+    try: return os.path.getsize(path)
+    except FileNotFoundError:
+        with ArchiveFile(archive_path(os.path.basename(path))) as archive:
+            return archive.size
+
+def requested_expiry():
+    """
+    Return the latest day (YYYYMMDD) requested to be expired, or ''.
+    """
+    try:
+        with open(expiry_path, mode='r') as infile:
+            return infile.read().strip()
+    except FileNotFoundError:
+        return ''
+
+def request_expiry(day):
+    """
+    Request log files of days up to and including day (YYYYMMDD) to be removed. Returns the latest day requested,
+    as a request never brings back days already requested.
+    """
+    day = max(day, requested_expiry())
+    temporary = expiry_path + '.{0}.tmp'.format(os.getpid())
+    with open(temporary, mode='w') as outfile:
+        outfile.write(day + '\n')
+    os.replace(temporary, expiry_path)
+    return day
+
+def archive_log(log_name, codec=None):
+    """
+    Compress log file log_name into its archive with codec, by default archive_codec, then remove the log file. Returns the archive size.
+    """
+    (magic, compress, decompress) = codecs[codec or archive_codec]
+    (path, temporary) = (os.path.join(log_directory, log_name), archive_path(log_name) + '.tmp')
+    os.makedirs(archive_directory, exist_ok=True)
+    (table, raw_offset, archive_offset) = ([], 0, 0)
+    with open(path, mode='rb') as infile, open(temporary, mode='wb') as outfile:
+        while True:
+            data = infile.read(block_bytes)
+            data += infile.readline() # Every block ends at the end of a line.
+            if not data: break
+            block = compress(data)
+            outfile.write(block)
+            table.append(table_entry.pack(raw_offset, archive_offset))
+            (raw_offset, archive_offset) = (raw_offset + len(data), archive_offset + len(block))
+        outfile.write(b''.join(table) + footer.pack(archive_offset, len(table), raw_offset, magic))
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(temporary, archive_path(log_name))
+    os.remove(path)
+    return archive_offset + len(table) * table_entry.size + footer.size
+
+def restore_log(log_name):
+    """
+    Decompress the archive of log_name back into its log file, so it can be appended to again, then remove the archive.
+    """
+    (path, temporary) = (os.path.join(log_directory, log_name), archive_path(log_name) + '.tmp')
+    with ArchiveFile(archive_path(log_name)) as archive, open(temporary, mode='wb') as outfile:
+        for block in range(len(archive.offsets)):
+            outfile.write(archive.block(block))
+    os.replace(temporary, path)
+    os.remove(archive_path(log_name))
+
+
+class ArchiveFile():
+    """
+    Read only binary file object over an archive, with seek(), tell(), read() and readline() at raw offsets.
+    Only the blocks read are decompressed, the last block read is kept.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, mode='rb')
+        self.file.seek(-footer.size, os.SEEK_END)
+        (table_offset, blocks, self.size, magic) = footer.unpack(self.file.read(footer.size))
+        self.decompress = [decompress for (name, (code, compress, decompress)) in codecs.items() if code == magic][0]
+        self.file.seek(table_offset)
+        table = self.file.read(blocks * table_entry.size)
+        entries = [table_entry.unpack_from(table, index * table_entry.size) for index in range(blocks)]
+        self.offsets = [raw_offset for (raw_offset, archive_offset) in entries] # Raw offset of each block, for bisect.
+        self.locations = [archive_offset for (raw_offset, archive_offset) in entries] + [table_offset]
+        (self.position, self.cached, self.data) = (0, None, b'')
+
+    def block(self, index):
+        """
+        Return the decompressed content of block number index.
+        """
+        if self.cached != index:
+            self.file.seek(self.locations[index])
+            self.data = self.decompress(self.file.read(self.locations[index + 1] - self.locations[index]))
+            self.cached = index
+        return self.data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self.position = offset if whence == os.SEEK_SET else (self.position if whence == os.SEEK_CUR else self.size) + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        stop = self.size if size is None or size < 0 else min(self.size, self.position + size)
+        parts = []
+        while self.position < stop:
+            index = bisect.bisect_right(self.offsets, self.position) - 1
+            start = self.position - self.offsets[index]
+            part = self.block(index)[start:start + stop - self.position]
+            parts.append(part)
+            self.position += len(part)
+        return b''.join(parts)
+
+    def readline(self):
+        parts = []
+        while self.position < self.size:
+            index = bisect.bisect_right(self.offsets, self.position) - 1
+            start = self.position - self.offsets[index]
+            data = self.block(index)
+            end = data.find(b'\n', start) + 1 or len(data)
+            parts.append(data[start:end])
+            self.position += end - start
+            if data[end - 1:end] == b'\n': break
+        return b''.join(parts)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
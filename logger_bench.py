@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+# Python 3.6.3
+# logger_bench.py
+
+"""
+logger_bench.py:
+Benchmarks of ingest and queries, run entirely on localhost, with results saved as JSON to track regressions between versions.
+
+generate: Write a synthetic dataset of log files, with their index files (and column stores with --columns),
+          under a root directory in place of /srv/logger, for the given days, facilities and messages per day.
+query:    Time typical counts, messages and ranges queries over the dataset under a root directory, in this process through logger_resource.py.
+          The query cache is cleared before each run, so every run does the work of a new query.
+ingest:   Drive a running logger_httpd.py with concurrent clients, each on one keep-alive connection, at a total rate of messages per second,
+          posting single messages or bulk batches, and report throughput and latency percentiles.
+          With a rate, latency is measured from when each request was due, so time spent falling behind is counted too.
+          With --lag, probe messages are also sent and watched for in the log files under the root directory.
+lag:      Measure collector lag: the time from posting a probe message until it is appended to its log file by logger_collector.py.
+compare:  Compare two results files and report measurements worse by more than a tolerance. Exits with status 1 if any are.
+
+Results are written as JSON: { "benchmark": name, "started": "YYYYMMDD-HHMMSS", "host": ..., "parameters": {...}, "results": {...} }.
+Latencies are in milliseconds as { "p50", "p90", "p99", "p999", "max", "mean" }, query times in seconds.
+
+Usage:
+python logger_bench.py generate --root /tmp/logger_bench --days 7 --facilities 50 --per-day 200000
+python logger_bench.py query --root /tmp/logger_bench --output query.json
+python logger_httpd.py & python logger_collector.py &
+python logger_bench.py ingest --clients 16 --rate 2000 --duration 30 --bulk 0 --lag --output ingest.json
+python logger_bench.py compare baseline.json query.json
+
+Synthetic messages are logged under facilities named bench_NN, and lag probes under bench_lag, so they are easily told apart and removed.
+
+Anil Gulati
+01/09/2018
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import platform
+import datetime
+import threading
+import http.client
+import urllib.parse
+
+import logger_index
+import logger_search
+import logger_archive
+import logger_columns
+import logger_resource
+
+log_path = '/srv/logger'
+levels = ((20, 50), (25, 10), (30, 20), (40, 12), (50, 5), (60, 2), (70, 1)) # Synthetic log levels, with relative frequency.
+messages = ('Request completed.', 'Request timed out.', 'Cache miss.', 'Connection reset by peer.', 'Disk usage high.',
+            'Retrying after failure.', 'User logged in.', 'User logged out.', 'Payment declined.', 'Queue backlog growing.') # Synthetic msg strings.
+users = 1000 # Distinct userid values in synthetic messages.
+
+def use_root(root):
+    """
+    Point the modules reading and writing log files at root in place of /srv/logger, as for a generated dataset.
+    """
+    for module in (logger_index, logger_archive, logger_columns, logger_resource):
+        for name in ('log_directory', 'index_directory', 'archive_directory', 'column_directory', 'expiry_path'):
+            if hasattr(module, name):
+                setattr(module, name, os.path.join(root, os.path.relpath(getattr(module, name), module.log_path)))
+        module.log_path = root
+    logger_resource.log_catalog.clear()
+    logger_resource.query_cache.clear()
+
+def percentiles(values):
+    """
+    Return a summary { 'p50', 'p90', 'p99', 'p999', 'max', 'mean' } of values, by nearest rank, or {} if there are none.
+    """
+    if not values:
+        return {}
+    values = sorted(values)
+    summary = dict(('p' + name, values[min(len(values) - 1, int(len(values) * fraction))]) for (name, fraction) in (('50', 0.5), ('90', 0.9), ('99', 0.99), ('999', 0.999)))
+    summary.update(max=values[-1], mean=sum(values) / len(values))
+    return dict((name, round(value, 3)) for (name, value) in summary.items())
+
+def synthetic_record(facility, levelno, created, rand):
+    """
+    Return a url-encoded message as logging.handlers.HTTPHandler would POST it, with a few extra name/values.
+    """
+    return urllib.parse.urlencode({ 'name': facility, 'levelno': levelno, 'msg': rand.choice(messages), 'created': '{0:.6f}'.format(created),
+                                    'userid': 'u{0}'.format(rand.randrange(users)), 'request': rand.randrange(1000000) })
+
+def generate(root, days=3, facilities=20, per_day=100000, columns=False, seed=1):
+    """
+    Write log files of synthetic messages for days ending today, per_day messages a day over facilities facilities,
+    weighted so a few facilities and lower levels are much busier than the rest. Then index them as logger_collector.py would.
+    Returns a summary of the dataset written and the seconds taken.
+    """
+    use_root(root)
+    for directory in (logger_index.log_directory, logger_index.index_directory):
+        os.makedirs(directory, exist_ok=True)
+    rand = random.Random(seed)
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    names = ['bench_{0:02d}'.format(facility) for facility in range(facilities)]
+    weights = [1 / (facility + 1) for facility in range(facilities)] # Zipf, the first facility the busiest.
+    (files, lines_written, size, write_seconds, index_seconds) = (0, 0, 0, 0.0, 0.0)
+    for offset in range(days - 1, -1, -1):
+        day = today - datetime.timedelta(offset)
+        start = datetime.datetime(day.year, day.month, day.day, tzinfo=datetime.timezone.utc).timestamp()
+        logs = dict() # Log file name to list of (created, logline).
+        began = time.monotonic()
+        for (facility, (levelno, frequency)) in zip(rand.choices(names, weights, k=per_day), rand.choices(levels, [frequency for (levelno, frequency) in levels], k=per_day)):
+            created = start + rand.random() * 86400
+            stamp = datetime.datetime.fromtimestamp(created, tz=datetime.timezone.utc)
+            prefix = '{0:%Y%m%d-%H%M%S}.{1:06d}-{2}-{3}'.format(stamp, stamp.microsecond, levelno, facility)
+            content = synthetic_record(facility, levelno, created, rand)
+            logs.setdefault(prefix[:8] + prefix[22:], []).append((created, '{0}:{1}:{2}\n'.format(prefix, urllib.parse.parse_qs(content)['msg'][0], content)))
+        for (log_name, entries) in logs.items():
+            lines = [bytes(line, 'utf-8') for (created, line) in sorted(entries)]
+            with open(os.path.join(logger_index.log_directory, log_name), mode='wb') as outfile:
+                outfile.write(b''.join(lines))
+            logs[log_name] = lines
+            (files, lines_written, size) = (files + 1, lines_written + len(lines), size + sum(len(line) for line in lines))
+        write_seconds += time.monotonic() - began
+        began = time.monotonic()
+        (index, store) = (logger_index.IndexWriter(), columns and logger_columns.ColumnIndex() or None)
+        for (log_name, lines) in sorted(logs.items()):
+            index.update(log_name, lines, 0)
+            if store: store.update(log_name, lines, 0)
+        index.save()
+        if store: store.save()
+        index_seconds += time.monotonic() - began
+    return { 'files': files, 'lines': lines_written, 'bytes': size, 'write_seconds': round(write_seconds, 3), 'index_seconds': round(index_seconds, 3) }
+
+def typical_queries(root):
+    """
+    Return a list of (name, url) of typical queries over the log files under root, chosen from the days, facilities and values found.
+    """
+    use_root(root)
+    logger_resource.log_catalog.refresh()
+    days = logger_resource.log_catalog.days
+    if not days:
+        return []
+    (first, last) = (days[0], days[-1])
+    ranges = logger_resource.GetFilter('/api/v1/ranges/{0}/{0}'.format(last)).get_ranges()
+    facility = max(ranges['facilities'], key=ranges['facilities'].get)
+    message = max(ranges['msg'], key=ranges['msg'].get, default='')
+    keys = dict((key, values) for (key, values) in ranges['keys'].items() if values)
+    key = keys and max(keys, key=lambda key: sum(keys[key].values())) or 'msg'
+    value = keys and max(keys[key], key=keys[key].get) or message
+    word = message.split(' ')[0] or 'a'
+    quote = urllib.parse.quote
+    return [('counts_all', '/api/v1/counts'),
+            ('counts_day', '/api/v1/counts/{0}/{0}'.format(last)),
+            ('counts_hour', '/api/v1/counts/{0}-120000/{0}-125959'.format(last)),
+            ('counts_window', '/api/v1/counts/{0}-063012/{1}-174545'.format(first, last)),
+            ('counts_levels', '/api/v1/counts/{0}/{1}/40-70'.format(first, last)),
+            ('counts_facility', '/api/v1/counts/{0}/{1}//{2}'.format(first, last, facility)),
+            ('counts_histogram', '/api/v1/counts/{0}/{0}?histogram=hour'.format(last)),
+            ('counts_predicate', '/api/v1/counts/{0}/{0}//{1}={2}'.format(last, quote(key, safe=''), quote(value, safe=''))),
+            ('counts_search', '/api/v1/counts/{0}/{0}//msg~{1}'.format(last, quote(word + '.*', safe=''))),
+            ('messages_page', '/api/v1/messages/{0}-120000/{0}?limit=1000'.format(last)),
+            ('messages_levels', '/api/v1/messages/{0}/{1}/50-70?limit=1000&mode=full'.format(first, last)),
+            ('ranges_day', '/api/v1/ranges/{0}/{0}'.format(last))]
+
+def run_query(url):
+    """
+    Answer the query url as logger_httpd.py would. Returns the count of all lines, the rows of messages, or the facilities of ranges.
+    """
+    filtered = logger_resource.GetFilter(url)
+    if filtered.resource == 'counts':
+        filtered.get_counts()
+        return filtered.counts['all']
+    if filtered.resource == 'messages':
+        return sum(1 for row in filtered.get_messages()) - 1 # Less the cursor row.
+    return len(filtered.get_ranges()['facilities'])
+
+def query(root, repeat=5, names=None):
+    """
+    Time each typical query over the log files under root repeat times, clearing the query cache before each run,
+    then once more from the cache for counts. Returns { name: { 'url', 'result', 'seconds': {first, min, median, max}, 'cached' } }.
+    """
+    results = dict()
+    for (name, url) in typical_queries(root):
+        if names and name not in names: continue
+        times = []
+        for run in range(repeat):
+            logger_resource.query_cache.clear()
+            began = time.perf_counter()
+            result = run_query(url)
+            times.append(time.perf_counter() - began)
+        results[name] = { 'url': url, 'result': result, 'seconds': { 'first': round(times[0], 6), 'min': round(min(times), 6),
+                          'median': round(sorted(times)[len(times) // 2], 6), 'max': round(max(times), 6) } }
+        if name.startswith('counts'):
+            began = time.perf_counter()
+            run_query(url)
+            results[name]['cached'] = round(time.perf_counter() - began, 6)
+    return results
+
+def post(connection, bulk, records):
+    """
+    POST records (url-encoded messages) on connection, one to /api/v1/messages or many to /api/v1/messages/bulk. Returns True if all were accepted.
+    """
+    if bulk:
+        connection.request('POST', '/api/v1/messages/bulk', '\n'.join(records).encode(), { 'Content-Type': 'text/plain' })
+    else:
+        connection.request('POST', '/api/v1/messages', records[0].encode(), { 'Content-Type': 'application/x-www-form-urlencoded' })
+    response = connection.getresponse()
+    content = response.read()
+    if response.status != 201:
+        return False
+    return not bulk or json.loads(content.decode())['accepted'] == len(records)
+
+def ingest(host='localhost:8080', clients=8, rate=0, duration=10.0, bulk=0, facilities=20, seed=1):
+    """
+    POST synthetic messages to logger_httpd.py at host from clients threads for duration seconds, at rate messages per second in total (0 for as fast as possible).
+    With bulk, each request is a batch of bulk messages to /api/v1/messages/bulk, otherwise one message to /api/v1/messages.
+    Returns throughput and latency percentiles in milliseconds.
+    """
+    per_request = max(bulk, 1)
+    interval = rate and clients * per_request / rate # Seconds between requests from each client.
+    (latencies, lock) = ([], threading.Lock())
+    totals = { 'requests': 0, 'messages': 0, 'errors': 0 }
+    began = time.monotonic()
+    deadline = began + duration
+
+    def client(number):
+        rand = random.Random(seed + number)
+        (connection, times, counts) = (None, [], { 'requests': 0, 'messages': 0, 'errors': 0 })
+        due = began + (interval * number / clients if interval else 0) # Clients staggered across the interval.
+        while True:
+            if interval:
+                due += interval
+                if due >= deadline: break
+                time.sleep(max(0, due - time.monotonic()))
+            elif time.monotonic() >= deadline: break
+            sent = time.monotonic()
+            records = []
+            for index in range(per_request):
+                levelno = rand.choices(levels, [frequency for (levelno, frequency) in levels])[0][0]
+                records.append(synthetic_record('bench_{0:02d}'.format(rand.randrange(facilities)), levelno, time.time(), rand))
+            try:
+                if connection is None:
+                    connection = http.client.HTTPConnection(host, timeout=10)
+                accepted = post(connection, bulk, records)
+            except (OSError, http.client.HTTPException):
+                if connection is not None:
+                    connection.close()
+                (connection, accepted) = (None, False) # Reconnect for the next request.
+            times.append(1000 * (time.monotonic() - (due if interval else sent)))
+            counts['requests'] += 1
+            counts['messages' if accepted else 'errors'] += accepted and per_request or 1
+        if connection is not None:
+            connection.close()
+        with lock:
+            latencies.extend(times)
+            for (name, count) in counts.items():
+                totals[name] += count
+
+    threads = [threading.Thread(target=client, args=(number,), daemon=True) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - began
+    totals.update(seconds=round(elapsed, 3), requests_per_second=round(totals['requests'] / elapsed, 1),
+                  messages_per_second=round(totals['messages'] / elapsed, 1), latency_ms=percentiles(latencies))
+    return totals
+
+def lag(host='localhost:8080', root=log_path, probes=20, interval=0.5, timeout=30.0, stop=None):
+    """
+    Post probes probe messages to logger_httpd.py at host, interval seconds apart, and time each until it is appended to its log file under root.
+    Stops early once stop (a threading.Event) is set. Returns lag percentiles in milliseconds and the number of probes not seen within timeout seconds.
+    """
+    log_directory = os.path.join(root, 'logs')
+    (pending, seen, offsets) = (dict(), [], dict()) # Probe token to (log_name, sent), lags, and log file name to bytes read.
+    connection = http.client.HTTPConnection(host, timeout=10)
+    (sent_probes, next_probe) = (0, time.monotonic())
+    while sent_probes < probes and not (stop and stop.is_set()) or pending:
+        now = time.monotonic()
+        if sent_probes < probes and now >= next_probe and not (stop and stop.is_set()):
+            token = uuid.uuid4().hex
+            created = time.time()
+            log_name = '{0:%Y%m%d}-20-bench_lag'.format(datetime.datetime.fromtimestamp(created, tz=datetime.timezone.utc))
+            if log_name not in offsets: # Only appended lines count.
+                try: offsets[log_name] = os.path.getsize(os.path.join(log_directory, log_name))
+                except FileNotFoundError: offsets[log_name] = 0
+            record = urllib.parse.urlencode({ 'name': 'bench_lag', 'levelno': 20, 'msg': 'Lag probe.', 'created': '{0:.6f}'.format(created), 'probe': token })
+            try:
+                post(connection, 0, [record])
+                pending[token] = (log_name, now)
+            except (OSError, http.client.HTTPException):
+                connection.close()
+            (sent_probes, next_probe) = (sent_probes + 1, next_probe + interval)
+        for log_name in set(log_name for (log_name, sent) in pending.values()):
+            try:
+                with open(os.path.join(log_directory, log_name), mode='rb') as infile:
+                    infile.seek(offsets[log_name])
+                    data = infile.read()
+            except FileNotFoundError:
+                continue
+            data = data[:data.rfind(b'\n') + 1] # Complete lines only.
+            offsets[log_name] += len(data)
+            found = time.monotonic()
+            for line in data.split(b'\n'):
+                token = line[line.rfind(b'probe=') + 6:].decode() if b'probe=' in line else None
+                if token in pending:
+                    seen.append(1000 * (found - pending.pop(token)[1]))
+        for (token, (log_name, sent)) in list(pending.items()):
+            if time.monotonic() - sent > timeout:
+                del pending[token]
+        time.sleep(0.005)
+    connection.close()
+    return { 'probes': sent_probes, 'lost': sent_probes - len(seen), 'lag_ms': percentiles(seen) }
+
+def compare(baseline, result, tolerance=0.2):
+    """
+    Return a list of (path, baseline value, result value) for measurements in result (a results dict) worse than in baseline by more than tolerance.
+    Rates (per_second) are worse when lower, times and latencies (seconds, _ms, cached) worse when higher. Other values are not compared.
+    """
+    worse = []
+    def walk(path, before, after):
+        if isinstance(before, dict) and isinstance(after, dict):
+            for key in sorted(set(before) & set(after)):
+                walk(path + [key], before[key], after[key])
+            return
+        if not isinstance(before, (int, float)) or not isinstance(after, (int, float)) or isinstance(before, bool):
+            return
+        names = '/'.join(str(part) for part in path)
+        if names.endswith('per_second'):
+            if after < before * (1 - tolerance): worse.append((names, before, after))
+        elif '_ms' in names or 'seconds' in names or names.endswith('cached'):
+            if after > before * (1 + tolerance): worse.append((names, before, after))
+    walk([], baseline.get('results', {}), result.get('results', {}))
+    return worse
+
+def write_results(path, benchmark, parameters, results):
+    """
+    Write results as JSON to the file at path, or to stdout if path is '-'.
+    """
+    content = { 'benchmark': benchmark, 'started': '{0:%Y%m%d-%H%M%S}'.format(datetime.datetime.now(datetime.timezone.utc)),
+                'host': { 'node': platform.node(), 'python': platform.python_version(), 'cpus': os.cpu_count() },
+                'parameters': parameters, 'results': results }
+    if path == '-':
+        print(json.dumps(content, indent=2))
+        return
+    with open(path, mode='w') as outfile:
+        json.dump(content, outfile, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest and query benchmarks, on localhost.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    command = commands.add_parser('generate', help='Write a synthetic dataset of log files and index files.')
+    command.add_argument('--root', required=True, help='Directory to write the dataset to, in place of {0}.'.format(log_path))
+    command.add_argument('--days', type=int, default=3, help='Days of log files, ending today.')
+    command.add_argument('--facilities', type=int, default=20, help='Facilities logging.')
+    command.add_argument('--per-day', type=int, default=100000, help='Messages a day.')
+    command.add_argument('--columns', action='store_true', help='Also write column stores.')
+    command.add_argument('--seed', type=int, default=1, help='Random seed, the same seed writes the same messages.')
+    command = commands.add_parser('query', help='Time typical queries over log files.')
+    command.add_argument('--root', default=log_path, help='Directory holding the log files.')
+    command.add_argument('--repeat', type=int, default=5, help='Runs of each query.')
+    command.add_argument('--only', nargs='*', help='Names of the queries to run, by default all.')
+    command = commands.add_parser('ingest', help='Post messages to a running logger_httpd.py.')
+    command.add_argument('--host', default='localhost:8080', help='Server host:port.')
+    command.add_argument('--clients', type=int, default=8, help='Concurrent clients, each with one connection.')
+    command.add_argument('--rate', type=float, default=0, help='Messages per second in total, 0 for as fast as possible.')
+    command.add_argument('--duration', type=float, default=10.0, help='Seconds to post for.')
+    command.add_argument('--bulk', type=int, default=0, help='Messages per bulk request, 0 posts messages singly.')
+    command.add_argument('--facilities', type=int, default=20, help='Facilities logging.')
+    command.add_argument('--lag', action='store_true', help='Also measure collector lag while posting.')
+    command.add_argument('--root', default=log_path, help='Directory the collector writes log files to, for --lag.')
+    command = commands.add_parser('lag', help='Measure time from posting a message until it is in its log file.')
+    command.add_argument('--host', default='localhost:8080', help='Server host:port.')
+    command.add_argument('--root', default=log_path, help='Directory the collector writes log files to.')
+    command.add_argument('--probes', type=int, default=20, help='Probe messages sent.')
+    command.add_argument('--interval', type=float, default=0.5, help='Seconds between probes.')
+    command = commands.add_parser('compare', help='Report measurements worse than a baseline.')
+    command.add_argument('baseline', help='Baseline results file.')
+    command.add_argument('result', help='Results file to compare.')
+    command.add_argument('--tolerance', type=float, default=0.2, help='Fraction worse allowed.')
+    for command in commands.choices.values():
+        if command.prog.split()[-1] != 'compare':
+            command.add_argument('--output', default='-', help='Results file, - for stdout.')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        results = generate(args.root, args.days, args.facilities, args.per_day, args.columns, args.seed)
+    elif args.command == 'query':
+        use_root(args.root)
+        results = query(args.root, args.repeat, args.only)
+    elif args.command == 'ingest':
+        stop = threading.Event()
+        probing = []
+        if args.lag:
+            thread = threading.Thread(target=lambda: probing.append(lag(args.host, args.root, probes=sys.maxsize, interval=0.5, stop=stop)), daemon=True)
+            thread.start()
+        results = ingest(args.host, args.clients, args.rate, args.duration, args.bulk, args.facilities)
+        if args.lag:
+            stop.set()
+            thread.join()
+            results['lag'] = probing and probing[0] or {}
+    elif args.command == 'lag':
+        results = lag(args.host, args.root, args.probes, args.interval)
+    else:
+        with open(args.baseline) as infile: baseline = json.load(infile)
+        with open(args.result) as infile: result = json.load(infile)
+        worse = compare(baseline, result, args.tolerance)
+        for (name, before, after) in worse:
+            print('{0}: {1} -> {2}'.format(name, before, after))
+        sys.exit(1 if worse else 0)
+    write_results(args.output, args.command, dict((name, value) for (name, value) in vars(args).items() if name not in ('command', 'output')), results)
+    if logger_search.pool is not None:
+        logger_search.pool.terminate()
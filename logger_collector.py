@@ -7,95 +7,432 @@ logger_collector.py:
 Remote logging cache collector adds cached messages onto the appropriate log files.
 This process runs separately on the server in addition to logger_httpd.py.
 
-Take individual message files dropped in /srv/logger/cache/ by logger_httpd.py.
-Move the message files to /srv/logger/pids/YYYYMMDD/pid_number/.
+Runs as a supervisor process and a pool of worker processes, python logger_collector.py --workers N.
+Each worker collects a share of the spool partitions (see logger_spool.py), and so a share of the facilities.
+Every log file is therefore only ever written by one worker, without locking, and keeps its time order.
+The supervisor restarts any worker that dies, after a delay doubling while it keeps dying, and the worker resumes from its committed positions.
+Interrupting or terminating the supervisor terminates the workers.
+
+Each worker reads message records appended to its spool partitions /srv/logger/spool/PP/ by logger_httpd.py.
 Add messages to log files /srv/logger/logs/YYYYMMDD-LL-facility_name.
+Update the index files of each log file appended to, see logger_index.py.
+Commit the spool position read once messages are added.
+A journal of log file sizes is written before adding each batch, so a collector killed part way through a batch
+truncates the log files back on restart and repeats the batch from the committed position, adding every message exactly once.
+
+Each worker also compacts and expires its own log files, so they still have only one writer.
+Log files of days closed for compact_days are archived to block compressed files (see logger_archive.py), one at a time while idle.
+A late message for an archived day restores its log file first. Log files older than retention_days, or up to the day
+requested by DELETE, are removed with their archives and index files at each housekeeping interval.
+With --columns, each worker also keeps the columnar store of the records it collects, see logger_columns.py.
+When idle the collector waits on inotify events for the spool directories (see logger_watch.py),
+so new messages are collected within milliseconds. Clean up runs on its own timer every housekeeping_interval seconds.
+Ingest to log latency, from receipt by logger_httpd.py to being added to the log file, is reported at the same interval.
+Batch sizes, durations, bytes appended and latency are also recorded by logger_metrics.py as collector-<worker>,
+served by logger_httpd.py on /api/v1/metrics. --profile-interval samples the stacks of each process, see logger_metrics.py.
+
+Message files left in the former primary cache /srv/logger/cache/, or the former unpartitioned spool, are still collected.
+The supervisor moves them into the spool partitions:
+Move the message files to /srv/logger/pids/YYYYMMDD/pid_number/.
+Append messages to the spool partition for their facility.
 
 Anil Gulati
 01/09/2018
 
-TODO: Expiry of finished log files and removal from the server at automated intervals.
-TODO: Can manage dedicated processes per log file to make use of more cores and achieve other efficiencies if throughput needs to be increased.
 TODO: Add protection from failure to open log file errors.
 """
 
 import os
+import sys
+import fcntl
+import signal
+import argparse
 import datetime
+import shutil
 import time
 
+from logger_spool import SpoolReader, PartitionedSpoolWriter, partition_directory, spool_directory, spool_partitions, facility_partition, valid_record
+from logger_watch import get_watcher
+from logger_index import IndexWriter, index_directory, index_path, catalog_name
+import logger_archive
+from logger_columns import ColumnIndex, column_path
+import logger_metrics
+from logger_supervise import Backoff, run_child
+
 log_path = '/srv/logger'
 cache_directory = os.path.join(log_path, 'cache') # Message files initially dropped in this directory by logger_httpd.py.
 pids_path = os.path.join(log_path, 'pids') # Secondary caches in here at /srv/logger/pids/<YYYYMMDD>/<pid>/.
 log_directory = os.path.join(log_path, 'logs') # Actual log files stored in this directory.
+housekeeping_interval = 60 # Seconds between clean ups of old secondary caches and checks for day rollover.
+idle_wait = 5 # Longest wait for new messages when idle, before checking again regardless.
+compact_days = 2 # Days after which a day is closed and its log files archived, 0 never archives.
+retention_days = 0 # Days of log files kept, including today, 0 keeps everything.
+column_store = False # Also keep the columnar store of records, see logger_columns.py.
+profile_interval = 0 # Seconds between stack samples of each process, 0 does not profile.
+stats = { 'messages': 0, 'batches': 0, 'latency_total': 0.0, 'latency_max': 0.0 } # Collection since last reported.
 
-if __name__ == '__main__': # Run python logger_collector.py in addition to python logger_httpd.py.
+def log_name_of(logline):
+    """
+    Return the log file name YYYYMMDD-levelno-facility for a logline (bytes) starting YYYYMMDD-HHMMSS.uuuuuu-levelno-facility:.
+    """
+    log_name = logline[:logline.index(b':')].decode().split('-') # Line prefix is the individual message name.
+    return '-'.join((log_name[0], log_name[2], log_name[3])) # Throw away the time when forming log filename YYYYMMDD-levelno-facility.
+
+
+def group_lines(loglines):
+    """
+    Return a dict of log file name to the list of loglines (bytes, each with trailing newline) to append to it, in date time order.
+    """
+    log_lines = dict() # Lines grouped by log file.
+    for logline in sorted(loglines): # Line prefix supports date time order sorting.
+        log_lines.setdefault(log_name_of(logline), []).append(logline)
+    return log_lines
+
+
+def append_lines(log_lines):
+    """
+    Append grouped loglines from group_lines() to their log files.
+    Each log file is opened only once and written with a single call.
+    """
+    for (log_name, lines) in log_lines.items():
+        with open(os.path.join(log_directory, log_name), mode='ab') as log_file: # TODO: Protection from open failure.
+            log_file.write(b''.join(lines)) # No need to decode, treat as binary is faster.
+
+
+def log_sizes(log_names):
+    """
+    Return a dict of the current size of each log file named, zero if not yet created.
+    Archived log files are restored first, so they can be appended to.
+    """
+    sizes = dict()
+    for log_name in log_names:
+        path = os.path.join(log_directory, log_name)
+        if not os.path.exists(path) and os.path.exists(logger_archive.archive_path(log_name)): # Late message for a closed day.
+            logger_archive.restore_log(log_name)
+        try: sizes[log_name] = os.path.getsize(path)
+        except FileNotFoundError: sizes[log_name] = 0
+    return sizes
+
+
+def recover(reader):
+    """
+    Undo a batch interrupted before its spool position was committed, by truncating its log files to their journalled sizes.
+    The batch is then collected again from the committed position.
+    """
+    sizes = reader.pending()
+    if sizes is None: # Last batch completed.
+        return
+    for (log_name, size) in sizes.items():
+        try: os.truncate(os.path.join(log_directory, log_name), size)
+        except FileNotFoundError: pass
+    reader.rollback()
+
+
+def collect_spool(reader, index, columns=None):
+    """
+    Add the next batch of spool records to the log files, update their index files with index, and column stores with columns if given,
+    and commit. Records that can not be collected are quarantined, see logger_spool.py. Returns the number of records taken from the spool.
+    """
+    (records, position) = reader.read()
+    if not records:
+        return 0
+    malformed = quarantine(reader, records)
+    if malformed:
+        records = [record for record in records if valid_record(record)]
+        if not records:
+            reader.commit(position)
+            return malformed
+    began = time.perf_counter()
+    log_lines = group_lines(record[record.index(b' ') + 1:] for record in records) # Strip receipt time from each record.
+    sizes = log_sizes(log_lines)
+    reader.begin(sizes) # Journal the sizes to truncate back to if interrupted.
+    with logger_metrics.timed('collect_append_seconds'):
+        append_lines(log_lines)
+    with logger_metrics.timed('collect_index_seconds'):
+        for (log_name, lines) in log_lines.items():
+            index.update(log_name, lines, sizes[log_name])
+            if columns: columns.update(log_name, lines, sizes[log_name])
+        index.save()
+        if columns: columns.save()
+    reader.commit(position)
+    record_latency([float(record[:record.index(b' ')]) for record in records])
+    logger_metrics.observe('collect_batch_seconds', time.perf_counter() - began)
+    logger_metrics.observe('collect_batch_messages', len(records), buckets=logger_metrics.size_buckets)
+    logger_metrics.count('collect_messages_total', len(records))
+    logger_metrics.count('collect_bytes_total', sum(len(line) for lines in log_lines.values() for line in lines))
+    return len(records) + malformed
+
+
+def migrate_spool(reader, writer):
+    """
+    Move the next batch of records from the former unpartitioned spool into the spool partitions. Returns the number of messages moved.
+    """
+    (records, position) = reader.read()
+    if not records:
+        return 0
+    quarantine(reader, records)
+    writer.append([record[record.index(b' ') + 1:].decode() for record in records if valid_record(record)])
+    reader.commit(position)
+    logger_metrics.count('migrate_messages_total', len(records))
+    return len(records)
+
+
+def quarantine(reader, records):
+    """
+    Move any of the records read by reader that can not be collected to its quarantine file, before they are committed.
+    Returns the number quarantined.
+    """
+    malformed = [record for record in records if not valid_record(record)]
+    if malformed:
+        reader.quarantine(malformed)
+        print('Quarantined {0} malformed records in {1}.'.format(len(malformed), reader.directory), flush=True)
+        logger_metrics.count('collect_quarantined_total', len(malformed))
+    return len(malformed)
+
+
+def closed_logs(partitions):
+    """
+    Return (closed, expired) where closed is the sorted list of log files of spool partitions partitions not yet archived
+    for days closed for compact_days, and expired is the list of log files, open or archived, to be removed.
+    """
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    closed_through = compact_days and '{0:%Y%m%d}'.format(today - datetime.timedelta(compact_days)) or ''
+    expired_through = max(retention_days and '{0:%Y%m%d}'.format(today - datetime.timedelta(retention_days)) or '', logger_archive.requested_expiry())
+    (closed, expired) = ([], [])
+    for log_name in set(os.listdir(log_directory)) | set(logger_archive.list_archives()):
+        (day, level, facility) = log_name.split('-')
+        if facility_partition(facility) not in partitions: continue # Another worker's log file.
+        if day <= expired_through: expired.append(log_name)
+        elif day <= closed_through and os.path.exists(os.path.join(log_directory, log_name)): closed.append(log_name)
+    return (sorted(closed), expired)
+
+
+def expire_logs(log_names):
+    """
+    Remove log files log_names, open or archived, with their index files, and the catalogs and postings of their days.
+    """
+    for log_name in log_names:
+        for path in (os.path.join(log_directory, log_name), logger_archive.archive_path(log_name), index_path(log_name, 'rollup'), index_path(log_name, 'offsets')):
+            try: os.remove(path)
+            except FileNotFoundError: pass
+    for name in set(catalog_name(log_name) for log_name in log_names): # Every log file of the day and partition is removed together.
+        try: os.remove(index_path(name, 'catalog'))
+        except FileNotFoundError: pass
+        shutil.rmtree(index_path(name, 'postings'), ignore_errors=True)
+        shutil.rmtree(column_path(name), ignore_errors=True)
+
+
+def record_latency(received):
+    """
+    Add ingest to log latency for messages with the receipt times in received, now they are in the log files.
+    """
+    now = time.time()
+    stats['messages'] += len(received)
+    stats['batches'] += 1
+    stats['latency_total'] += now * len(received) - sum(received)
+    stats['latency_max'] = max(stats['latency_max'], now - min(received))
+    logger_metrics.observe('collect_latency_seconds', now - min(received)) # Oldest in the batch, how far behind the collector is.
+
+
+def report_stats(worker):
+    """
+    Print and reset collection and latency statistics.
+    """
+    if stats['messages']:
+        print('{0:%Y%m%d-%H%M%S} worker {1} collected {2} messages in {3} batches, ingest to log latency mean {4:.1f}ms max {5:.1f}ms'.format(
+            datetime.datetime.now(datetime.timezone.utc), worker, stats['messages'], stats['batches'],
+            1000 * stats['latency_total'] / stats['messages'], 1000 * stats['latency_max']), flush=True)
+    stats.update(messages=0, batches=0, latency_total=0.0, latency_max=0.0)
+
+
+def housekeeping():
+    """
+    Create today's secondary cache directory for this process and clean up old ones. Returns today's directory.
+    Run at startup and every housekeeping_interval seconds, which also handles day rollover.
+    """
+    # Create day temporary directory for this process only.
+    # Will only create it if it hasn't already been created.
+    now = datetime.datetime.now(datetime.timezone.utc)
+    today = '{0:%Y%m%d}'.format(now) # Get an ISO order date string YYYYMMDD.
+    pid = str(os.getpid()) # Get this process ID as a string.
+    pid_directory = os.path.join(pids_path, today, pid) # Determine day/pid directory.
+    os.makedirs(pid_directory, exist_ok=True) # Make or remake /srv/logger/pids/<YYYYMMDD>/<pid>/.
+
+    # Clean up two days and older empty temporary directories.
+    # These old secondary cache directories should be empty and no longer used.
+    yesterday = '{0:%Y%m%d}'.format(now - datetime.timedelta(1)) # Date time 24 hours ago.
+    for day in os.listdir(pids_path): # Look for old temporary day directories.
+        if day < yesterday: # Two or more days old. These directories will now be static.
+            try: # Try to delete the old directories.
+                pids = os.listdir(os.path.join(pids_path, day)) # Pid directories inside the old day directory.
+                for pid in pids + ['']: # All the pid directories and an extra entry for the parent day directory.
+                    os.removedirs(os.path.join(pids_path, day, pid)) # Recursive delete won't delete files.
+            except Exception as e: # Won't remove directories if files still exist in them.
+                pass # Shouldn't be any files left. This should automatically remove all old pid directories.
+    return pid_directory
+
+
+def collect_cache(pid_directory, writer):
+    """
+    Collect message files from the former primary cache directory, isolating them in the per day, per process secondary cache first,
+    then appending their messages to the spool with writer. Returns the number of message files collected.
+    """
+    # Check for candidate messages in the primary cache.
+    try: message_list = [name for name in os.listdir(cache_directory) if not name.startswith('.')] # Hidden files are incomplete batches.
+    except FileNotFoundError: message_list = []
+
+    # Move messages from initial server cache to per day, per process secondary cache.
+    # On day rollover doesn't matter if yesterday's pid directory is used for some messages.
+    message_list.sort() # Get oldest messages first.
+    for message_name in message_list: # Message name format supports date order sorting: YYYYMMDD-HHMMSS.uuuuuu-levelno-facility
+        try:
+            os.rename(os.path.join(cache_directory, message_name), os.path.join(pid_directory, message_name))
+        except: # Any failure aborts further processing. Unprocessed messages will be re-attempted later.
+            break # Messages already isolated still need to be processed.
+
+    # Check for captured messages in secondary cache, if any.
+    message_list = os.listdir(pid_directory)
+    if not len(message_list): # Nothing in the cache or potentially another process took the messages.
+        return 0
+
+    # Append all isolated message content to the spool.
+    # Message files hold one line per message, or many lines for batch files from /api/v1/messages/bulk,
+    # so each line is routed to a spool partition by its own prefix.
+    loglines = list()
+    for message_name in message_list:
+        with open(os.path.join(pid_directory, message_name), mode='r', encoding='utf-8') as message_file: # Open, read and close message file.
+            loglines.extend(line + '\n' for line in message_file.read().rstrip('\n').split('\n'))
+    writer.append(loglines)
+
+    # Remove copied message files.
+    for message_name in message_list:
+        os.remove(os.path.join(pid_directory, message_name))
+    return len(message_list)
+
+
+def run_worker(worker, workers):
+    """
+    Collect the spool partitions belonging to worker number worker of workers, until terminated.
+    """
+    partitions = [partition for partition in range(spool_partitions) if partition % workers == worker]
+    readers = [SpoolReader(partition_directory(partition)) for partition in partitions] # Resume from committed positions.
+    for reader in readers:
+        recover(reader) # Undo any batch interrupted when last stopped.
+    watcher = get_watcher([reader.directory for reader in readers]) # Wakes on new messages.
+    index = IndexWriter()
+    columns = column_store and ColumnIndex() or None
+    (closed, expired) = closed_logs(partitions)
+    next_report = time.monotonic() + housekeeping_interval
+    while True:
+        if time.monotonic() >= next_report:
+            report_stats(worker)
+            (closed, expired) = closed_logs(partitions)
+            next_report = time.monotonic() + housekeeping_interval
+        if expired:
+            expire_logs(expired)
+            index.reset() # Rollups and catalogs held may be for removed files.
+            if columns: columns.reset()
+            expired = []
+        if sum(collect_spool(reader, index, columns) for reader in readers):
+            watcher.activity()
+        elif closed: # Quiet period, archive a closed log file unless a late message has been appended to it meanwhile.
+            log_name = closed.pop()
+            if os.path.exists(os.path.join(log_directory, log_name)):
+                logger_archive.archive_log(log_name)
+        else: # Must be a quiet period.
+            watcher.wait(min(idle_wait, max(0, next_report - time.monotonic())))
+
+
+def start_worker(worker, workers, lock=None):
+    """
+    Fork a process running run_worker() and return its process ID.
+    The worker closes its copy of the supervisor's lock file, so the lock is released when the supervisor goes.
+    """
+    pid = os.fork()
+    if pid: # Parent supervises.
+        return pid
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) # Interrupted batches are undone on restart.
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Supervisor handles interrupts and terminates the workers.
+    def work(): # Any failure is reported and exits the worker, see logger_supervise.py.
+        if lock: lock.close()
+        logger_metrics.start('collector-{0}'.format(worker), profile_interval)
+        run_worker(worker, workers)
+    run_child(work)
+
+
+def supervise(workers):
+    """
+    Start workers, restart any that die, and move messages from the former cache and unpartitioned spool into the spool partitions.
+    Workers that die are restarted after a delay, doubled while they keep dying soon after starting, see logger_supervise.py.
+    Returns when interrupted or terminated with SIGTERM, after terminating the workers.
+    """
+    os.makedirs(spool_directory, exist_ok=True)
+    os.makedirs(index_directory, exist_ok=True)
+    lock = open(os.path.join(spool_directory, 'lock'), mode='w') # Only one collector pool may run at once.
+    try: fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        sys.exit('Another logger_collector.py is already running.')
+    (children, restarts, backoff) = (dict(), dict(), Backoff()) # Process ID to worker number, worker to time due to restart.
+    def start(worker):
+        children[start_worker(worker, workers, lock)] = worker
+        backoff.start(worker)
+    terminate = signal.signal(signal.SIGTERM, signal.default_int_handler) # Terminated as when interrupted, so workers are not left behind.
     try:
+        for worker in range(workers):
+            start(worker)
+        logger_metrics.start('collector', profile_interval) # After forking, so workers do not inherit the threads.
+        writer = PartitionedSpoolWriter()
+        legacy = SpoolReader(spool_directory) # Segments written before the spool was partitioned.
+        watcher = get_watcher([spool_directory, cache_directory])
+        pid_directory = housekeeping()
+        next_housekeeping = time.monotonic() + housekeeping_interval
         while True: # Runs until manually interrupted.
 
-            # Create day temporary directory for this process only.
-            # Will only create it if it hasn't already been created.
-            now = datetime.datetime.now(datetime.timezone.utc)
-            today = '{0:%Y%m%d}'.format(now) # Get an ISO order date string YYYYMMDD.
-            pid = str(os.getpid()) # Get this process ID as a string.
-            pid_directory = os.path.join(pids_path, today, pid) # Determine day/pid directory.
-            os.makedirs(pid_directory, exist_ok=True) # Make or remake /srv/logger/pids/<YYYYMMDD>/<pid>/.
-
-            # Clean up two days and older empty temporary directories.
-            # These old secondary cache directories should be empty and no longer used.
-            yesterday = '{0:%Y%m%d}'.format(now - datetime.timedelta(1)) # Date time 24 hours ago.
-            for day in os.listdir(pids_path): # Look for old temporary day directories.
-                if day < yesterday: # Two or more days old. These directories will now be static.
-                    try: # Try to delete the old directories.
-                        pids = os.listdir(os.path.join(pids_path, day)) # Pid directories inside the old day directory.
-                        for pid in pids + ['']: # All the pid directories and an extra entry for the parent day directory.
-                            os.removedirs(os.path.join(pids_path, day, pid)) # Recursive delete won't delete files.
-                    except Exception as e: # Won't remove directories if files still exist in them.
-                        pass # Shouldn't be any files left. This should automatically remove all old pid directories.
-            
-            # Check for new candidate messages in the primary cache.
-            # Dares to sleep for 5 seconds if nothing there.
-            message_list = os.listdir(cache_directory)
-            if not len(message_list): # Nothing to do.
-                time.sleep(5) # Must be a quiet period. Use sleep(1 or 2) instead?
-                continue # Restart full process in order to handle day rollover.
-
-            # Move some messages from initial server cache to per day, per process secondary cache.
-            # On day rollover doesn't matter if yesterday's pid directory is used for some messages.
-            message_list.sort() # Get oldest messages first.
-            for message_name in message_list: # Message name format supports date order sorting: YYYYMMDD-HHMMSS.uuuuuu-levelno-facility
-                try:
-                    os.rename(os.path.join(cache_directory, message_name), os.path.join(pid_directory, message_name))
-                except: # Any failure aborts further processing. Unprocessed messages will be re-attempted later.
-                    break # Messages already isolated still need to be processed.
-
-            # Check for captured messages in secondary cache, if any.
-            message_list = os.listdir(pid_directory)
-            if not len(message_list): # Didn't actually take any messages this time for some reason.
-                continue # No need to pause, potentially another process took some messages.
-
-            # Catenate all isolated message content into the appropriate log file.
-            # Current implementation does not share log files out, only one process.
-            log_files = dict() # Open each log file only once on this iteration.
-            message_list.sort() # Log messages in date time order.
-            for message_name in message_list: # Append messages to a log file one at a time.
-
-                # Open or get previously opened log file according to constructed log filename.
-                log_name = message_name.split('-') # Message name is the individual message filename: YYYYMMDD-HHMMSS.uuuuuu-levelno-facility.
-                log_name = '-'.join((log_name[0], log_name[2], log_name[3])) # Throw away the time when forming log filename YYYYMMDD-levelno-facility.
-                log_file = log_files.setdefault(log_name, open(os.path.join(log_directory, log_name), mode='ab')) # dict.setdefault only opens if not already opened.
-                # TODO: Protection from open failure.
-
-                # Append message content from message file into the log file.
-                with open(os.path.join(pid_directory, message_name), mode='rb') as message_file: # Open, read and close message file.
-                    log_file.write(message_file.read()) # No need to decode, treat as binary is faster.
-
-                # Remove copied message file.
-                os.remove(os.path.join(pid_directory, message_name))
-
-            # Close all log files before next iteration.
-            for log_file in log_files:
-                log_files[log_file].close()
+            # Replace workers that have died, backing off while they keep dying.
+            (pid, status) = children and os.waitpid(-1, os.WNOHANG) or (0, 0)
+            while pid:
+                worker = children.pop(pid)
+                delay = backoff.delay(worker)
+                print('Worker {0} exited with status {1}, restarting in {2:g}s.'.format(worker, status, delay), flush=True)
+                restarts[worker] = time.monotonic() + delay
+                (pid, status) = children and os.waitpid(-1, os.WNOHANG) or (0, 0)
+            for (worker, due) in list(restarts.items()):
+                if time.monotonic() >= due:
+                    del restarts[worker]
+                    start(worker)
+
+            # Clean up and handle day rollover on a timer rather than every iteration.
+            if time.monotonic() >= next_housekeeping:
+                pid_directory = housekeeping()
+                next_housekeeping = time.monotonic() + housekeeping_interval
+
+            # Move messages from the former cache and unpartitioned spool, if any, into the spool partitions.
+            if collect_cache(pid_directory, writer) + migrate_spool(legacy, writer):
+                watcher.activity()
+            else:
+                watcher.wait(max(0, min([idle_wait, next_housekeeping - time.monotonic()] + [due - time.monotonic() for due in restarts.values()])))
 
     except KeyboardInterrupt:
         pass
+    finally:
+        signal.signal(signal.SIGTERM, terminate)
+        for pid in children:
+            try: os.kill(pid, signal.SIGTERM)
+            except OSError: pass
+        for pid in children:
+            try: os.waitpid(pid, 0)
+            except OSError: pass
+
 
+if __name__ == '__main__': # Run python logger_collector.py in addition to python logger_httpd.py.
+    parser = argparse.ArgumentParser(description='Remote logging collector.')
+    parser.add_argument('--workers', type=int, default=min(os.cpu_count(), spool_partitions), help='Worker processes, at most {0}.'.format(spool_partitions))
+    parser.add_argument('--compact-days', type=int, default=compact_days, help='Days after which log files are archived, 0 never archives.')
+    parser.add_argument('--retention-days', type=int, default=retention_days, help='Days of log files kept, 0 keeps everything.')
+    parser.add_argument('--columns', action='store_true', help='Also keep the columnar store of records.')
+    parser.add_argument('--codec', choices=sorted(logger_archive.codecs), default=logger_archive.archive_codec, help='Compression for archives.')
+    parser.add_argument('--profile-interval', type=float, default=profile_interval, help='Seconds between stack samples for the profiler, 0 does not profile.')
+    args = parser.parse_args()
+    (compact_days, retention_days, column_store, logger_archive.archive_codec) = (args.compact_days, args.retention_days, args.columns, args.codec) # Inherited by workers.
+    profile_interval = args.profile_interval
+    supervise(max(1, min(args.workers, spool_partitions)))
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# Python 3.6.3
+# logger_columns.py
+
+"""
+logger_columns.py:
+Optional columnar store of log records, written by logger_collector.py --columns alongside the log files,
+and used by logger_resource.py to count without splitting any text.
+
+One store per day and spool partition /srv/logger/columns/YYYYMMDD-PP/, so each has only one collector writing it,
+holding a row for every line of the log files of that day and partition in fixed width column files:
+time      int64 microseconds since the epoch, UTC.
+level     uint8 log level.
+facility  uint32 id of the facility name in the dictionary file facilities, one url-encoded name per line.
+msg       uint32 id of the msg string in the dictionary file msgs.
+extra     uint64 end offset of the row's url-encoded content in the side blob extra.blob.
+marks     int64 latest time of any row up to each mark_every'th row, so a time range is found by binary search, as for offset indexes.
+The state file, JSON {"rows": n, "sizes": {log_name: bytes}, "lengths": {file: bytes}, "latest": us, "lag": us, "previous": {...}},
+is replaced after each batch is appended: rows and lengths cover what is complete, sizes are the lengths of the log files stored,
+latest is the latest time of any row, and lag the most microseconds any row was behind the latest time before it.
+previous is the state before the last batch, restored if that batch is undone after a crash.
+
+Counts and histograms are taken over the columns mapped into memory through mmap, without reading or splitting any text.
+Counter counts a (level, facility) key tuple for each row, zipped from memoryviews of the columns and filtered by time with itertools.compress.
+The per row work is done inside zip, map, compress and Counter rather than Python statements, but it is still a tuple per row,
+so the cost grows with the rows counted. Only the rows between the marks bounding the time range, widened by lag, are counted.
+
+Anil Gulati
+01/09/2018
+"""
+
+import os
+import mmap
+import array
+import bisect
+import operator
+import calendar
+import datetime
+import itertools
+import collections
+from urllib.parse import quote, unquote
+
+import logger_metrics
+from logger_archive import log_size
+from logger_index import load_json, save_json, read_lines, catalog_name
+
+log_path = '/srv/logger'
+log_directory = os.path.join(log_path, 'logs') # Log files stored.
+column_directory = os.path.join(log_path, 'columns') # Column stores.
+columns = (('time', 'q'), ('level', 'B'), ('facility', 'I'), ('msg', 'I'), ('extra', 'Q')) # Column files and array type codes.
+dictionaries = ('facilities', 'msgs') # Dictionary files of the facility and msg columns.
+mark_every = 4096 # Rows between entries in the marks file.
+
+def column_path(name, file_name=''):
+    """
+    Return the path of file_name in the column store named name (YYYYMMDD-PP), or of the store.
+    """
+    return os.path.join(column_directory, name, file_name)
+
+def day_base(day):
+    """
+    Return microseconds since the epoch at the start of day (YYYYMMDD), UTC.
+    """
+    return calendar.timegm(datetime.datetime.strptime(day, '%Y%m%d').timetuple()) * 1000000
+
+def empty_state():
+    return { 'rows': 0, 'sizes': {}, 'lengths': dict((file_name, 0) for file_name in dictionaries + ('extra.blob',)), 'latest': 0, 'lag': 0 }
+
+def read_dictionary(name, file_name, length):
+    """
+    Return the list of values of dictionary file file_name of store name, up to length bytes.
+    """
+    try:
+        with open(column_path(name, file_name), mode='rb') as infile:
+            data = infile.read(length)
+    except FileNotFoundError:
+        return []
+    return [unquote(value.decode()) for value in data.split(b'\n')[:-1]]
+
+
+class ColumnWriter():
+    """
+    Append rows for lines added to the log files of one day and spool partition, then save them once per batch.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.base = day_base(name[:8])
+        os.makedirs(column_path(name), exist_ok=True)
+        self.state = load_json(column_path(name, 'state')) or empty_state()
+        if not self.consistent(self.state): # Last batch undone after a crash.
+            previous = self.state.get('previous')
+            self.state = previous if previous and self.consistent(previous) else empty_state()
+        self.truncate()
+        self.sizes = dict(self.state['sizes']) # Including rows not yet saved.
+        (self.latest, self.lag) = (self.state['latest'], self.state['lag'])
+        self.ids = dict((file_name, dict((value, index) for (index, value) in enumerate(read_dictionary(name, file_name, self.state['lengths'][file_name]))))
+                        for file_name in dictionaries)
+        self.clear()
+
+    def consistent(self, state):
+        """
+        True if no log file stored in state is shorter than state records.
+        """
+        for (log_name, size) in state['sizes'].items():
+            try: current = log_size(os.path.join(log_directory, log_name))
+            except FileNotFoundError: current = 0
+            if current < size:
+                return False
+        return True
+
+    def truncate(self):
+        """
+        Cut every file back to the length recorded in the state, dropping anything written for a batch not saved.
+        """
+        lengths = dict((file_name, self.state['rows'] * array.array(code).itemsize) for (file_name, code) in columns)
+        lengths['marks'] = -(-self.state['rows'] // mark_every) * 8
+        lengths.update(self.state['lengths'])
+        for (file_name, length) in lengths.items():
+            try: os.truncate(column_path(self.name, file_name), length)
+            except FileNotFoundError: pass
+
+    def clear(self):
+        self.buffers = dict((file_name, array.array(code)) for (file_name, code) in columns + (('marks', 'q'),))
+        self.blob = bytearray()
+        self.words = dict((file_name, []) for file_name in dictionaries) # New dictionary values.
+
+    def size(self, log_name):
+        """
+        Return the length of log file log_name stored, including rows not yet saved.
+        """
+        return self.sizes.get(log_name, 0)
+
+    def id_of(self, file_name, value):
+        ids = self.ids[file_name]
+        if value not in ids:
+            ids[value] = len(ids)
+            self.words[file_name].append(quote(value, safe=' ') + '\n')
+        return ids[value]
+
+    def add_lines(self, log_name, lines):
+        """
+        Add a row for each logline (bytes lines YYYYMMDD-HHMMSS.uuuuuu-LL-facility:msg:content) appended to log file log_name.
+        """
+        (buffers, extra) = (self.buffers, self.state['lengths']['extra.blob'] + len(self.blob))
+        for line in lines:
+            colon = line.index(b':', 26)
+            last = line.rindex(b':') # Content is url-encoded again by parse_message() in logger_httpd.py so contains no colons, msg may.
+            time = self.base + (int(line[9:11]) * 3600 + int(line[11:13]) * 60 + int(line[13:15])) * 1000000 + int(line[16:22])
+            self.latest = max(self.latest, time)
+            self.lag = max(self.lag, self.latest - time)
+            if (self.state['rows'] + len(buffers['time'])) % mark_every == 0:
+                buffers['marks'].append(self.latest)
+            buffers['time'].append(time)
+            buffers['level'].append(int(line[23:25]))
+            buffers['facility'].append(self.id_of('facilities', line[26:colon].decode()))
+            buffers['msg'].append(self.id_of('msgs', line[colon + 1:last].decode()))
+            self.blob += line[last + 1:-1]
+            extra += len(line) - last - 2
+            buffers['extra'].append(extra)
+        self.sizes[log_name] = self.size(log_name) + sum(len(line) for line in lines)
+
+    def save(self):
+        """
+        Append rows and dictionary values added since last saved, then replace the state.
+        """
+        rows = len(self.buffers['time'])
+        if not rows:
+            return
+        for file_name in self.buffers:
+            with open(column_path(self.name, file_name), mode='ab') as outfile:
+                outfile.write(self.buffers[file_name].tobytes())
+        lengths = dict(self.state['lengths'])
+        for (file_name, content) in [(file_name, ''.join(words).encode()) for (file_name, words) in self.words.items()] + [('extra.blob', bytes(self.blob))]:
+            with open(column_path(self.name, file_name), mode='ab') as outfile:
+                outfile.write(content)
+            lengths[file_name] += len(content)
+        previous = dict((key, value) for (key, value) in self.state.items() if key != 'previous')
+        self.state = { 'rows': self.state['rows'] + rows, 'sizes': dict(self.sizes), 'lengths': lengths, 'latest': self.latest, 'lag': self.lag, 'previous': previous }
+        save_json(column_path(self.name, 'state'), self.state)
+        self.clear()
+
+
+class ColumnStore():
+    """
+    Read the column store of one day and spool partition, as saved.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.state = load_json(column_path(name, 'state')) or empty_state()
+
+    def size(self, log_name):
+        """
+        Return the length of log file log_name covered by the store.
+        """
+        return self.state['sizes'].get(log_name, 0)
+
+    def count(self, start=None, stop=None, bucket=None):
+        """
+        Return a Counter of rows by (level, facility name), with time in microseconds from start to stop inclusive if given.
+        If bucket is given, rows are counted by (level, facility name, time // bucket) instead.
+        """
+        rows = self.state['rows']
+        if not rows:
+            return collections.Counter()
+        (maps, released) = ([], [])
+        try:
+            views = dict()
+            for (file_name, code, length) in [(file_name, code, rows) for (file_name, code) in columns[:3]] + [('marks', 'q', -(-rows // mark_every))]:
+                with open(column_path(self.name, file_name), mode='rb') as infile:
+                    maps.append(mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ))
+                views[file_name] = memoryview(maps[-1])[:length * array.array(code).itemsize].cast(code)
+                released.append(views[file_name])
+            (low, high) = (0, rows)
+            if start is not None: # Rows before the mark before start are all earlier.
+                low = max(bisect.bisect_left(views['marks'], start) - 1, 0) * mark_every
+            if stop is not None: # Rows from the first mark beyond stop, allowing for lag, are all later.
+                high = min(bisect.bisect_right(views['marks'], stop + self.state['lag']) * mark_every, rows)
+            logger_metrics.count('query_rows_scanned_total', high - low)
+            for file_name in ('time', 'level', 'facility'):
+                views[file_name] = views[file_name][low:high]
+                released.append(views[file_name])
+            keys = [views['level'], views['facility']]
+            if bucket:
+                keys.append(map(operator.floordiv, views['time'], itertools.repeat(bucket)))
+            keys = zip(*keys)
+            if start is not None or stop is not None:
+                selectors = map(operator.and_, map((start or 0).__le__, views['time']), map((stop if stop is not None else 2 ** 63).__ge__, views['time']))
+                keys = itertools.compress(keys, selectors)
+            counts = collections.Counter(keys)
+            del keys # Release the views before closing the maps.
+            for view in reversed(released):
+                view.release()
+        finally:
+            for data in maps:
+                data.close()
+        facilities = read_dictionary(self.name, 'facilities', self.state['lengths']['facilities'])
+        return collections.Counter(dict(((level, facilities[facility]) + tuple(rest), count) for ((level, facility, *rest), count) in counts.items()))
+
+
+class ColumnIndex():
+    """
+    Maintain column stores as logger_collector.py appends to log files, alongside the index files kept by IndexWriter.
+    Stores of recently appended days are held in memory, up to max_held. Lines of a log file not yet stored are added first.
+    """
+
+    max_held = 200 # Column stores held in memory.
+
+    def __init__(self):
+        self.writers = dict() # Store name to ColumnWriter.
+
+    def update(self, log_name, lines, size):
+        """
+        Add rows for lines (bytes loglines) just appended at byte offset size of log file log_name. Rows are only saved by save().
+        """
+        name = catalog_name(log_name) # Same day and partition as the catalog.
+        if name not in self.writers and len(self.writers) >= self.max_held:
+            self.reset()
+        writer = self.writers.get(name) or self.writers.setdefault(name, ColumnWriter(name))
+        if writer.size(log_name) < size: # Lines not yet stored.
+            writer.add_lines(log_name, read_lines(os.path.join(log_directory, log_name), writer.size(log_name), size))
+        writer.add_lines(log_name, lines)
+
+    def save(self):
+        for writer in self.writers.values():
+            writer.save()
+
+    def reset(self):
+        """
+        Save, then forget every store held, so they are loaded again when next needed.
+        """
+        self.save()
+        self.writers.clear()
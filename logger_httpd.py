@@ -4,25 +4,95 @@
 
 """
 logger_httpd.py:
-The remote logging server receives POST messages and drops them as individual files into the cache.
+The remote logging server receives POST messages and appends them to the spool, see logger_spool.py.
 Also responds to GET requests to retrieve logs and potentially other REST requests.
 This process runs separately in addition to logger_collector.py.
 
 Anil Gulati
 01/09/2018
 
+Serving modes, chosen at startup with --mode:
+thread:  Connections are handled on a bounded pool of worker threads (default).
+fork:    The listening socket is shared by a number of pre-forked processes, each running a pool of worker threads.
+asyncio: Connections are handled on a single event loop, with GET queries run on a separate pool of threads.
+All modes speak HTTP/1.1 keep-alive so clients can submit many messages over a single connection.
+GET queries are limited to a number of query slots, so slow queries can not hold up POST ingest.
+Request durations, responses, parse and spool write times are recorded by logger_metrics.py and served on /api/v1/metrics.
+
 TODO: Basic auth over SSL. Could use an HMAC of visible parameters and a secret but SSL basic auth sufficient.
-TODO: Forking to handle more requests (if required).
-TODO: Matching name/value pairs in GET requests e.g. userid=xyz.
 """
 
 import os
+import io
+import re
+import zlib
+import sys
+import signal
+import argparse
+import asyncio
+import threading
 import datetime
+import time
 import json
+from concurrent.futures import ThreadPoolExecutor
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.parse import parse_qs
+from urllib.parse import parse_qs, parse_qsl, urlencode
+
+from logger_resource import GetFilter, query_cache
+from logger_spool import PartitionedSpoolWriter
+from logger_archive import request_expiry
+import logger_metrics
+from logger_supervise import Backoff, run_child
+
+routes = ('messages', 'messages/bulk', 'counts', 'ranges', 'stats', 'metrics') # Routes named in metrics labels, any other is 'other'.
+facility_pattern = re.compile(r'[\w.]+\Z') # Facility names become part of file names so must be identifiers, with dots for module names.
+max_bulk_bytes = 16 * 1024 * 1024 # Largest bulk submission accepted, after decompression.
+
+
+def parse_message(content):
+    """
+    Validate a single url-encoded message and return the (filename, logline) pair used to spool it.
+    filename is of the form YYYYMMDD-HHMMSS.uuuuuu-levelno-facility and logline is filename:message:content with trailing newline.
+    content is url-encoded again as stored, so it holds no colons or newlines and the message is everything between the
+    first colon after the facility and the last colon of the logline, whatever colons the message itself contains.
+    Raises ValueError describing the problem if the message can not be logged.
+    """
+    # Decode url-encoded pairs.
+    pairs = parse_qs(content, keep_blank_values=True) # Extract from url-encoded string into lists of values.
+    (created, levelno, facility, message) = [pairs.get(key, '') for key in ('created', 'levelno', 'name', 'msg')] # Extracts as lists.
+
+    # Check and process supplied parameters.
+    created = created and float(created[0]) or 0.0 # Take first list element and convert to float timestamp.
+    try: created = datetime.datetime.fromtimestamp(created, tz=datetime.timezone.utc) # Convert epoch stamp to UTC datetime.
+    except (OverflowError, OSError, ValueError): # Infinite, not a number, or beyond the years a datetime can hold.
+        raise ValueError('created must be timestamp ssssssssss.uuuuuu')
+    created = '{0:%Y%m%d-%H%M%S}.{1:0<6d}'.format(created, created.microsecond) # And convert to string format required for storing.
+    if len(created) != 22: # Expecting YYYYMMDD-HHMMSS.uuuuuu.
+        raise ValueError('created must be timestamp ssssssssss.uuuuuu')
+
+    levelno = levelno and levelno[0] or '00' # Take first item in list or generate default: 00=LOG_UNSPECIFIED. Retain as string.
+    if len(levelno) != 2 or not levelno.isdigit(): # 70=LOG_EMERG, 60=LOG_ALERT, 50=LOG_CRIT, 40=LOG_ERR, 30=LOG_WARNING 25=LOG_NOTICE, 20=LOG_INFO, 10=LOG_DEBUG.
+        raise ValueError('levelno must be double digit numeric')
 
-from logger_resource import GetFilter
+    facility = facility and facility[0] or 'no_facility' # Convert from a list of values, possibly undefined, to a reliable scalar.
+    if not facility_pattern.match(facility): # Protects file names from separators and path traversal.
+        raise ValueError('name must be alphanumeric, underscore or dot')
+    message = message and message[0] or 'no_message' # Choosing not to complain if really useful parameters are not supplied.
+    message = message.replace('\r', ' ').replace('\n', ' ') # Newlines would split the log line.
+    content = urlencode(parse_qsl(content, keep_blank_values=True)) # Raw colons and newlines anywhere in the content are escaped, decoding the same.
+
+    # Construct cached message name and internal information.
+    filename ='{created}-{levelno}-{facility}'.format(created=created, levelno=levelno, facility=facility)
+    logline ='{filename}:{message}:{content}\n'.format(filename=filename, message=message, content=content)
+    return (filename, logline)
+
+def route_of(path):
+    """
+    Return the route of request path /api/v1/<route>..., as named in metrics labels.
+    """
+    route = path.partition('?')[0][8:] if path.startswith('/api/v1/') else ''
+    route = route if route == 'messages/bulk' else route.partition('/')[0]
+    return route if route in routes else 'other'
 
 
 class restHandler(BaseHTTPRequestHandler):
@@ -30,12 +100,32 @@ class restHandler(BaseHTTPRequestHandler):
     Handle POST and GET requests to REST API to log and retrieve messages.
     """
 
-    cache_path = '/srv/logger/cache' # This is the cache destination for all messages received.
+    spool = PartitionedSpoolWriter() # This is the destination for all messages received, shared by all threads in the process.
+    protocol_version = 'HTTP/1.1' # Keep connections alive between requests, every response must supply Content-length.
+    timeout = 10 # Seconds an idle keep-alive connection is held before closing to release its worker.
+    query_slots = threading.BoundedSemaphore(4) # Concurrent GET queries allowed, remaining workers are kept free for POST ingest.
+
+    def handle_one_request(self):
+        """
+        Handle a request as usual, then record its duration and route.
+        """
+        self.began = None
+        BaseHTTPRequestHandler.handle_one_request(self)
+        if self.began is not None:
+            logger_metrics.observe('request_seconds', time.perf_counter() - self.began, method=self.command, route=route_of(self.path))
+
+    def parse_request(self):
+        self.began = time.perf_counter() # Request line read, so the wait for it on a kept alive connection is not counted.
+        return BaseHTTPRequestHandler.parse_request(self)
+
+    def send_response(self, code, message=None):
+        logger_metrics.count('responses_total', method=self.command, status=str(code))
+        BaseHTTPRequestHandler.send_response(self, code, message)
 
     def do_POST(self):
         """
         Accept and store individual POSTed messages in url-encoded format, as sent by logging.handlers.HTTPHandler from logger_remote.py.
-        Messages are dropped in individual files in the primary cache directory.
+        Messages are appended to the spool.
         Messages must POST to /api/v1/messages with these parameters.
         Parameters align to those generated and used by standard library logging module.
 
@@ -49,106 +139,454 @@ class restHandler(BaseHTTPRequestHandler):
 
         POST equivalent:
         curl -i -d 'name=facility_name' -d 'levelno=40' -d 'msg=error message' -d 'created=1512386686.123456' -d 'additional_key=additional_value' http://localhost:8080/api/v1/messages
+
+        Many messages can be submitted in one request to /api/v1/messages/bulk, see post_bulk().
         """
+        if str(self.path) == '/api/v1/messages/bulk': # Batches of newline-delimited messages.
+            return self.post_bulk()
         if str(self.path) != '/api/v1/messages': # Only accept POST requests to this single API.
             return self.send_error(404, 'URI Not Allowed (Use /api/v1/messages)') # Descriptive error response.
         if self.headers['content-type'] != 'application/x-www-form-urlencoded': # Only accept url-encoded requests.
             return self.send_error(400, 'Bad Request (Requires application/x-www-form-urlencoded)') # Descriptive response.
         try:
-            content = self.rfile.read(int(self.headers['content-length'])) # Content arrives in unencoded bytes.
+            content = self.rfile.read(self.content_length()) # Content arrives in unencoded bytes.
             content = content.decode() # Decode to utf-8 string, and should contain url-encoded parameters.
-            self.log(content) # Write the message as an individual file in the primary cache.
+            self.log(content) # Append the message to the spool.
+        except ValueError as e: # Message failed validation.
+            return self.send_error(400, 'Bad Request ({0})'.format(e))
+        except Exception as e: # Something went wrong, send description back.
+            return self.send_error(500, 'Server error: ' + repr(e))
+        try:
             self.send_response(201) # Respond OK straight away.
             self.send_header('Content-type', 'text/plain')
-            ## self.send_header('Content-length', str(len(content))) # No need to reflect submitted content back.
+            self.send_header('Content-length', '0') # No need to reflect submitted content back.
             self.end_headers()
             ## self.wfile.write(bytes(content, "utf-8"))
         except Exception as e: # Something went wrong, send description back.
             self.send_error(500, 'Server error: ' + repr(e))
         return
 
+    def content_length(self):
+        """
+        Return the Content-Length of the request, 0 if not given. Raises ValueError if it is not a whole number.
+        """
+        length = (self.headers['content-length'] or '0').strip()
+        if not length.isdecimal():
+            raise ValueError('Content-Length must be a whole number')
+        return int(length)
+
+    def post_bulk(self):
+        """
+        Accept many messages in one POST to /api/v1/messages/bulk and append them to the spool with a single write per partition.
+        The body is text/plain with one url-encoded message per line, exactly as would be POSTed individually.
+        Lines end with a newline, or a carriage return and newline. No other character ends a line.
+        The body may be gzip compressed with Content-Encoding: gzip.
+        All messages are validated before any are spooled, invalid messages are reported and skipped.
+        Responds 201 with JSON {"accepted": n, "rejected": [{"record": line_index, "error": description}, ...]},
+        or 400 with the same JSON if no messages could be accepted.
+
+        POST equivalent:
+        printf 'name=facility_name&levelno=40&msg=one\nname=facility_name&levelno=30&msg=two\n' | curl -i -H 'Content-Type: text/plain' --data-binary @- http://localhost:8080/api/v1/messages/bulk
+        """
+        if self.headers.get_content_type() != 'text/plain': # Newline-delimited url-encoded messages.
+            return self.send_error(400, 'Bad Request (Requires text/plain)')
+        try: length = self.content_length()
+        except ValueError as e: # Body of unknown length, so the connection is closed by send_error().
+            return self.send_error(400, 'Bad Request ({0})'.format(e))
+        if length > max_bulk_bytes:
+            return self.send_error(413, 'Payload Too Large (Limit {0} bytes)'.format(max_bulk_bytes))
+        try:
+            content = self.rfile.read(length)
+            if self.headers.get('content-encoding', '').lower() == 'gzip':
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) # Gzip header and trailer.
+                content = decompressor.decompress(content, max_bulk_bytes)
+                if decompressor.unconsumed_tail: # Decompressed beyond the limit.
+                    return self.send_error(413, 'Payload Too Large (Limit {0} bytes)'.format(max_bulk_bytes))
+            lines = [line[:-1] if line.endswith('\r') else line for line in content.decode().split('\n')] # Not splitlines(), which splits on \x0b, \x85, \u2028 and others.
+        except Exception as e: # Corrupt compression or encoding.
+            return self.send_error(400, 'Bad Request ({0!r})'.format(e))
+        try:
+            (accepted, rejected) = self.log_batch(lines) # Append all valid messages with a single write per partition.
+        except Exception as e:
+            return self.send_error(500, 'Server error: ' + repr(e))
+        content = bytes(json.dumps({ 'accepted': accepted, 'rejected': rejected }), 'utf-8')
+        self.send_response(accepted and 201 or 400)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
     def do_GET(self):
         """
         Respond to GET requests to return messages, counts and ranges of values available.
-        Only counts implemented so far.
-        Filter parameters are supplied in the resource path. URL parameters are not used.
+        Filter parameters are supplied in the resource path. URL parameters are only used for paging messages.
         URLs are of the form /api/v1/<resource>/<since>/<until>/<levels>/<facility_name>/<facility_name>/...
         Where <since> and <until> are date/times of the form "YYYYMMDD-HHMMSS". Microsecond resolution is not supported.
         Where <levels> are expressed as double digit numbers either an individual level "LL" or a range "LL-MM".
         Values omitted are taken to mean "including all".
         Refer to logger_resource.py.
+        GET /api/v1/stats returns hit and miss statistics of the query result cache.
+        Queries are refused with 503 when all query slots are busy rather than queueing up behind slow queries.
+        Filters and options that can not be understood are refused with 400 before any of the response is sent.
+        GET /api/v1/metrics returns metrics of the server and collector processes, see send_metrics(), and takes no query slot.
         """
+        if route_of(self.path) == 'metrics': # Always answered, however busy.
+            return self.send_metrics()
+        if not self.query_slots.acquire(blocking=False): # Leave remaining workers for POST ingest.
+            self.send_error(503, 'Service Unavailable (All query slots busy, retry shortly)')
+            return
         try:
             filtered = GetFilter(self.path) # Initialises filter, parsing GET request, in logger_resource.py.
-            if filtered.resource == 'messages': # Return a number of actual messages as stored.
-                return self.send_error(501, 'Response for messages resource not yet implemented')
-            if filtered.resource == 'ranges': # Return a list of potential values for particular parameters.
-                return self.send_error(501, 'Response for ranges resource not yet implemented')
+            if filtered.resource == 'messages': # Stream a page of actual messages as stored.
+                return self.send_stream(filtered.get_messages(), 'application/x-ndjson')
+            if filtered.resource == 'ranges': # Return distinct values of each parameter with occurrence counts.
+                return self.send_json(filtered.get_ranges()) # From catalogs, no log file is read.
             if filtered.resource == 'counts': # Count the number of messages in the provided range.
                 filtered.get_counts() # Count all log lines specified in filter.
-                content = json.dumps(filtered.counts) # Return counts object.
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Content-length', str(len(content)))
-                self.send_header('Access-Control-Allow-Origin', '*') # Allow cross requests for everyone.
-                self.end_headers()
-                self.wfile.write(bytes(content, "utf-8"))
-                return
+                return self.send_json(filtered.counts) # Return counts object.
+            if filtered.resource == 'stats': # Query cache statistics.
+                return self.send_json({ 'query_cache': query_cache.stats() })
             return self.send_error(501, 'Unknown resource type ' + filtered.resource)
+        except ValueError as e: # Filter or options not understood.
+            self.send_error(400, 'Bad Request ({0})'.format(e))
         except:
             self.send_error(500)
+        finally:
+            self.query_slots.release()
         return
 
+    def send_json(self, content, status=200):
+        """
+        Send content as a JSON response.
+        """
+        content = bytes(json.dumps(content), 'utf-8')
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-length', str(len(content)))
+        self.send_header('Access-Control-Allow-Origin', '*') # Allow cross requests for everyone.
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_text(self, content, content_type='text/plain; charset=utf-8'):
+        """
+        Send content (str) as a text response.
+        """
+        content = bytes(content, 'utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_metrics(self):
+        """
+        Respond to GET /api/v1/metrics with counters, histograms and gauges as JSON, or with ?format=prometheus in Prometheus text format.
+        ?format=profile returns the stacks sampled by processes started with --profile-interval, in folded format.
+        """
+        form = parse_qs(self.path.partition('?')[2]).get('format', ['json'])[0]
+        try:
+            if form == 'json':
+                return self.send_json(logger_metrics.metrics_json())
+            if form == 'prometheus':
+                return self.send_text(logger_metrics.metrics_prometheus(), 'text/plain; version=0.0.4; charset=utf-8')
+            if form == 'profile':
+                return self.send_text(logger_metrics.profiles())
+        except Exception as e:
+            return self.send_error(500, 'Server error: ' + repr(e))
+        self.send_error(400, 'Bad Request (format must be json, prometheus or profile)')
+
+    def send_stream(self, rows, content_type, chunk_bytes=65536):
+        """
+        Send rows (an iterable of bytes) as the response body as they are generated, using chunked transfer encoding,
+        in chunks of about chunk_bytes. HTTP/1.0 clients get the body unchunked and the connection is then closed.
+        """
+        chunked = self.request_version == 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-type', content_type)
+        self.send_header('Access-Control-Allow-Origin', '*') # Allow cross requests for everyone.
+        if chunked: self.send_header('Transfer-Encoding', 'chunked')
+        else: self.close_connection = True # End of body is marked by closing.
+        self.end_headers()
+        buffered = []
+        size = 0
+        try:
+            for row in rows:
+                buffered.append(row)
+                size += len(row)
+                if size >= chunk_bytes:
+                    self.write_chunk(b''.join(buffered), chunked)
+                    (buffered, size) = ([], 0)
+            if buffered:
+                self.write_chunk(b''.join(buffered), chunked)
+            if chunked: self.wfile.write(b'0\r\n\r\n') # Last chunk.
+        except Exception as e: # Too late for an error response, the client sees the body cut short.
+            self.log_error('Stream failed: %r', e)
+            self.close_connection = True
+
+    def write_chunk(self, data, chunked):
+        if chunked: self.wfile.write(bytes('{0:x}\r\n'.format(len(data)), 'ascii') + data + b'\r\n')
+        else: self.wfile.write(data)
+
     def do_DELETE(self):
         """
-        REST DELETE could be used to flush messages, in addition to the automated expiry.
-        Could also move archived records off-line for potential restore, space allowing.
+        Flush messages early, in addition to the automated expiry: DELETE /api/v1/messages//<until> requests removal of
+        all log files of days up to and including until (YYYYMMDD), which must be before today.
+        Log files are removed by logger_collector.py at its next housekeeping, so responds 202 with the latest day requested.
         """
-        self.send_error(501) # Not yet implemented.
+        try: filtered = GetFilter(self.path)
+        except ValueError as e: # Filter not understood.
+            return self.send_error(400, 'Bad Request ({0})'.format(e))
+        except Exception as e:
+            return self.send_error(500, 'Server error: ' + repr(e))
+        today = '{0:%Y%m%d}'.format(datetime.datetime.now(datetime.timezone.utc))
+        if filtered.resource != 'messages':
+            return self.send_error(501, 'Unknown resource type ' + filtered.resource)
+        if not re.match(r'\d{8}\Z', filtered.until) or filtered.since or filtered.stop_time or filtered.start_level or filtered.facilities or filtered.predicates or filtered.searches:
+            return self.send_error(400, 'Bad Request (Only whole days up to a day can be deleted: /api/v1/messages//YYYYMMDD)')
+        if filtered.until >= today:
+            return self.send_error(400, 'Bad Request (Only days before today can be deleted)')
+        self.send_json({ 'expire_through': request_expiry(filtered.until) }, status=202)
 
     def log(self, content):
         """
-        Log single message as a single file to the primary cache directory and return to complete log request quickly.
+        Log single message to the spool and return to complete log request quickly.
         content contains the url-encoded utf-8 string defining all content for the message.
-        Messages are logged as individual files named YYYYMMDD-HHMMSS.uuuuuu-level-facility to the cache directory in self.cache_path.
-        Separately managed logger_collector.py process then appends the individual messages onto log files organised for easy retrieval.
+        Messages are appended as a line YYYYMMDD-HHMMSS.uuuuuu-level-facility:msg:content to the spool in self.spool.
+        Separately managed logger_collector.py process then appends the messages onto log files organised for easy retrieval.
         (This avoids managing sub-processes in this server and provides reliable logging even when processes get killed.
-        Queues deliver messages out of order, and can become corrupted if processes fail while using the queue.)
-        TODO: Replace newlines with spaces in content string. Newlines will be damaging if included, just disallow by converting to spaces.
+        The spool is on disk so survives either process being restarted, and the collector resumes from its committed position.)
         TODO: Default to UTC now() if created timestamp is missing.
-        TODO: Catch exceptions and report sensibly.
         """
-        # Decode url-encoded pairs.
-        pairs = parse_qs(content, keep_blank_values=True) # Extract from url-encoded string into lists of values.
-        (created, levelno, facility, message) = [pairs.get(key, '') for key in ('created', 'levelno', 'name', 'msg')] # Extracts as lists.
-        
-        # Check and process supplied parameters.
-        created = created and float(created[0]) or 0.0 # Take first list element and convert to float timestamp.
-        created = datetime.datetime.fromtimestamp(created, tz=datetime.timezone.utc) # Convert epoch stamp to UTC datetime.
-        created = '{0:%Y%m%d-%H%M%S}.{1:0<6d}'.format(created, created.microsecond) # And convert to string format required for storing.
-        if len(created) != 22: # Expecting YYYYMMDD-HHMMSS.uuuuuu.
-            return self.send_error(400, 'Bad Request (created must be timestamp ssssssssss.uuuuuu)')
+        with logger_metrics.timed('parse_seconds'):
+            (filename, logline) = parse_message(content) # Raises ValueError for bad messages.
+        with logger_metrics.timed('spool_write_seconds'):
+            self.spool.append([logline]) # Single append to the current spool segment.
+        logger_metrics.count('messages_total')
+
+    def log_batch(self, lines):
+        """
+        Log many messages to the spool with a single write per spool partition.
+        lines contains one url-encoded message per entry, blank lines are ignored.
+        Returns (accepted, rejected) where rejected lists the line index and problem for each message not logged.
+        """
+        (loglines, rejected) = ([], [])
+        with logger_metrics.timed('parse_seconds'):
+            for (index, content) in enumerate(lines):
+                if not content: continue
+                try: loglines.append(parse_message(content)[1])
+                except ValueError as e: rejected.append({ 'record': index, 'error': str(e) })
+        if loglines:
+            with logger_metrics.timed('spool_write_seconds'):
+                self.spool.append(loglines)
+        logger_metrics.observe('bulk_messages', len(loglines), buckets=logger_metrics.size_buckets)
+        logger_metrics.count('messages_total', len(loglines))
+        logger_metrics.count('messages_rejected_total', len(rejected))
+        return (len(loglines), rejected)
+
+
+class PoolHTTPServer(HTTPServer):
+    """
+    HTTPServer handling each connection on a bounded pool of worker threads.
+    Keep-alive connections hold a worker until closed or idle for restHandler.timeout seconds,
+    so workers should comfortably exceed the number of concurrently connected clients.
+    """
+
+    request_queue_size = 128 # Listen backlog, connections wait here for a free worker.
 
-        levelno = levelno and levelno[0] or '00' # Take first item in list or generate default: 00=LOG_UNSPECIFIED. Retain as string.
-        if len(levelno) != 2 or not levelno.isdigit(): # 70=LOG_EMERG, 60=LOG_ALERT, 50=LOG_CRIT, 40=LOG_ERR, 30=LOG_WARNING 25=LOG_NOTICE, 20=LOG_INFO, 10=LOG_DEBUG.
-            return self.send_error(400, 'Bad Request (levelno must be double digit numeric)')
+    def __init__(self, server_address, RequestHandlerClass, workers=32, bind_and_activate=True):
+        HTTPServer.__init__(self, server_address, RequestHandlerClass, bind_and_activate)
+        self.pool = ThreadPoolExecutor(max_workers=workers) # No threads start until first used so safe to fork after creation.
 
-        facility = facility and facility[0] or 'no_facility' # Convert from a list of values, possibly undefined, to a reliable scalar.
-        message = message and message[0] or 'no_message' # Choosing not to complain if really useful parameters are not supplied.
+    def process_request(self, request, client_address):
+        """
+        Hand the connection to the worker pool and return to accept the next connection.
+        """
+        self.pool.submit(self.process_request_thread, request, client_address)
 
-        # Construct cached message name and internal information.
-        filename ='{created}-{levelno}-{facility}'.format(created=created, levelno=levelno, facility=facility)
-        logline ='{filename}:{message}:{content}\n'.format(filename=filename, message=message, content=content)
+    def process_request_thread(self, request, client_address):
+        """
+        Serve all requests on one connection in a worker thread.
+        """
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.pool.shutdown(wait=False)
+
+
+def serve_forked(server, processes, profile_interval=0):
+    """
+    Pre-fork a number of processes all accepting connections on the listening socket of the server already bound.
+    Each child serves connections on its own pool of worker threads, and records metrics as httpd-<pid>.
+    Children that die are replaced, backing off while they keep dying, see logger_supervise.py.
+    Returns when interrupted or terminated with SIGTERM, after terminating the children.
+    """
+    children = dict() # Process ID to slot.
+    backoff = Backoff()
+    def fork_child(slot):
+        pid = os.fork()
+        if pid: # Parent keeps track of the child.
+            children[pid] = slot
+            backoff.start(slot)
+            return
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # Parent handles interrupts and terminates the children.
+        def serve(): # Any failure is reported and exits the child, see logger_supervise.py.
+            logger_metrics.start('httpd-{0}'.format(os.getpid()), profile_interval)
+            server.serve_forever()
+        run_child(serve)
+    terminate = signal.signal(signal.SIGTERM, signal.default_int_handler) # Terminated as when interrupted, so children are not left behind.
+    try:
+        for slot in range(processes):
+            fork_child(slot)
+        while True: # Supervise children until interrupted.
+            (pid, status) = os.wait()
+            slot = children.pop(pid)
+            delay = backoff.delay(slot)
+            print('Process {0} exited with status {1}, restarting in {2:g}s.'.format(pid, status, delay), flush=True)
+            time.sleep(delay)
+            fork_child(slot) # Replace the child that died.
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, terminate)
+        for pid in children:
+            try: os.kill(pid, signal.SIGTERM)
+            except OSError: pass
+        for pid in children:
+            try: os.waitpid(pid, 0)
+            except OSError: pass
+
+
+class AsyncHTTPServer():
+    """
+    Serve restHandler on an asyncio event loop.
+    Each request is read from the connection and replayed through a restHandler instance without a socket.
+    POSTs only append to the spool so are handled directly on the loop.
+    GETs are handed to a separate pool of query threads so the loop is never blocked by a slow query.
+    """
 
-        # Write the message to the temporary cache.
-        with open(os.path.join(self.cache_path, filename), mode='a', encoding='utf-8') as outfile:
-            outfile.write(logline) # Append rather than write protects against rare collisions and should work, retaining both messages.
+    def __init__(self, server_address, RequestHandlerClass, workers=4):
+        self.server_address = server_address # Port 0 is replaced by the port bound once serving.
+        self.RequestHandlerClass = RequestHandlerClass
+        self.pool = ThreadPoolExecutor(max_workers=workers) # Query threads.
+        self.serving = threading.Event() # Set once listening.
+        (self.loop, self.server) = (None, None)
+
+    def __str__(self):
+        return '<{0} {1}:{2}>'.format(type(self).__name__, *self.server_address)
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+    def shutdown(self):
+        """
+        Stop serve_forever() running in another thread.
+        """
+        self.loop.call_soon_threadsafe(self.server.close)
+
+    def server_close(self):
+        self.pool.shutdown(wait=False)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle_connection, *self.server_address, backlog=128)
+        self.server_address = self.server.sockets[0].getsockname()[:2]
+        self.serving.set()
+        async with self.server:
+            try: await self.server.serve_forever()
+            except asyncio.CancelledError: pass # Closed by shutdown().
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serve keep-alive requests on one connection until either side closes it.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try: # Read request line and headers, then the body if any.
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.RequestHandlerClass.timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    break # Closed, oversized or idle connection.
+                length = 0
+                for line in head.split(b'\r\n'):
+                    if line[:15].lower() == b'content-length:':
+                        value = line[15:].strip()
+                        length = int(value) if value.isdigit() else 0 # Anything else is refused by the handler, closing the connection.
+                body = length and await reader.readexactly(length) or b''
+                handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass) # Handler without a socket.
+                handler.server = self
+                handler.client_address = writer.get_extra_info('peername') or ('', 0)
+                handler.rfile = io.BytesIO(head + body)
+                handler.wfile = AsyncWriteFile(loop, writer)
+                handler.close_connection = True
+                if head.startswith(b'GET'): # Queries run off the loop.
+                    await loop.run_in_executor(self.pool, handler.handle_one_request)
+                else: # Ingest is quick enough to run on the loop.
+                    handler.handle_one_request()
+                await asyncio.sleep(0) # Let writes queued from the handler run.
+                await writer.drain()
+                if handler.close_connection:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+class AsyncWriteFile():
+    """
+    File-like wfile for restHandler that writes onto an asyncio stream, safe to call from any thread.
+    Writes from a query thread wait until the stream has drained below its limit, so a large response is sent
+    as it is written rather than buffered whole. Writes on the loop itself, small responses to POSTs, are only queued.
+    """
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+        self.thread = threading.get_ident() # Of the loop, where this is created.
+
+    def write(self, data):
+        if threading.get_ident() == self.thread:
+            self.writer.write(bytes(data))
+        else: # Raises ConnectionError if the client has gone.
+            asyncio.run_coroutine_threadsafe(self.send(bytes(data)), self.loop).result()
+        return len(data)
+
+    async def send(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def flush(self):
+        pass
 
 
 if __name__ == '__main__': # Run python logger_httpd.py in addition to python logger_collector.py.
-    httpd = HTTPServer(('', 8080), restHandler) # httpd.timeout = 10 # Simple attempt to force timeout fails.
+    parser = argparse.ArgumentParser(description='Remote logging server.')
+    parser.add_argument('--mode', choices=('thread', 'fork', 'asyncio'), default='thread', help='Concurrent serving mode.')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on.')
+    parser.add_argument('--workers', type=int, default=32, help='Worker threads per process, or query threads for asyncio.')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Processes to pre-fork in fork mode.')
+    parser.add_argument('--query-slots', type=int, default=4, help='Concurrent GET queries allowed per process.')
+    parser.add_argument('--profile-interval', type=float, default=0, help='Seconds between stack samples for the profiler, 0 does not profile.')
+    args = parser.parse_args()
+    restHandler.query_slots = threading.BoundedSemaphore(args.query_slots)
+
+    if args.mode == 'asyncio':
+        httpd = AsyncHTTPServer(('', args.port), restHandler, workers=max(args.workers, args.query_slots))
+    else:
+        httpd = PoolHTTPServer(('', args.port), restHandler, workers=args.workers)
     print(str(httpd))
-    try: httpd.serve_forever()
+    try:
+        if args.mode == 'fork': serve_forked(httpd, args.processes, args.profile_interval)
+        else:
+            logger_metrics.start('httpd', args.profile_interval)
+            httpd.serve_forever()
     except KeyboardInterrupt: pass
     httpd.server_close()
 
@@ -159,17 +597,3 @@ if __name__ == '__main__': # Run python logger_httpd.py in addition to python lo
     ## httpd = HTTPServer(('localhost', 4443), SimpleHTTPRequestHandler)
     ## httpd.socket = ssl.wrap_socket (httpd.socket, keyfile="path/to/key.pem", certfile='path/to/cert.pem', server_side=True)
     ## httpd.serve_forever()
-
-    ## Forking recipe:
-    ## class ForkingHTTPServer(socketserver.ForkingMixIn, HTTPServer):
-    ##     def finish_request(self, request, client_address):
-    ##         request.settimeout(30)
-    ##         HTTPServer.finish_request(self, request, client_address)
-    ## 
-    ## if __name__ == '__main__':
-    ##     httpd = ForkingHTTPServer(('', 8080), restHandler)
-    ##     print(str(httpd))
-    ##     try: httpd.serve_forever()
-    ##     except KeyboardInterrupt: pass
-    ##     httpd.socket.close()
-
@@ -0,0 +1,436 @@
+#!/usr/bin/env python
+# Python 3.6.3
+# logger_index.py
+
+"""
+logger_index.py:
+Sidecar index files maintained by logger_collector.py as it appends to log files, and read by logger_resource.py to answer queries.
+Index files are kept in /srv/logger/index/ named after their log file, so the log directory only holds log files.
+
+Rollups /srv/logger/index/YYYYMMDD-LL-facility.rollup:
+Counts of log lines per minute and per hour for one log file, as JSON {"size": bytes, "minutes": {"HHMM": n}, "hours": {"HH": n}}.
+size is the length of the log file the counts cover. Lines appended beyond size are not yet counted,
+and a rollup with size beyond the end of its log file is out of date and rebuilt.
+The rollup also keeps the state needed to extend the offset index: the latest time seen,
+lines since the last offset entry, and lag, the most seconds any line was behind the latest time before it.
+
+Offset indexes /srv/logger/index/YYYYMMDD-LL-facility.offsets:
+Sparse index of byte offsets into one log file, appended as fixed width entries "HHMMSS OOOOOOOOOOOO\n".
+An entry is added at the first line of each new minute, and every index_every lines within a minute.
+Each entry holds the latest time of any line up to and including the line at the offset, so entries are in order
+even when lines arrive out of order, and can be binary searched through mmap.
+Every line before an entry's offset is no later than the entry's time, so queries skip straight to the since position.
+Every line after an entry's offset is no earlier than the entry's time less lag, so queries stop reading soon after until.
+
+Catalogs /srv/logger/index/YYYYMMDD-PP.catalog:
+Distinct values with occurrence counts for one day, one file per spool partition PP so each has only one collector writing it.
+As JSON {"LL-facility": {"size": bytes, "count": n, "msg": {msg: n}, "keys": {key: {value: n}}, "capped": {key: n}}}
+with an entry for each log file of the day. Extra keys are every name in the url-encoded content other than name, levelno, msg and created.
+A key with more than value_cap distinct values in a log file is capped: its values are dropped and only its occurrences counted.
+msg strings are capped in the same way at msg_cap. size is the length of the log file covered, as for rollups.
+
+Postings /srv/logger/index/YYYYMMDD-PP.postings/BB.post:
+Inverted index of the lines of one day and spool partition, by msg and by the value of every extra key,
+those not among the standard attributes of a Python LogRecord. Each posting is a line "term\tLL-facility\tHHMMSS\toffset\n"
+where term is key=value url-encoded, e.g. msg=Disk%20full or userid=xyz, and offset is where the line starts in its log file.
+Postings are appended to one of posting_buckets bucket files BB by hash of the term, so finding the lines for a term
+reads only one bucket per day and partition. Postings are appended along with the catalog, which records how far they cover.
+A batch collected again after a crash may post the same lines twice, readers ignore duplicates.
+
+Anil Gulati
+01/09/2018
+"""
+
+import os
+import json
+import mmap
+import zlib
+import bisect
+import logging
+from urllib.parse import parse_qsl, quote
+
+from logger_spool import facility_partition
+from logger_archive import open_log, log_size
+
+log_path = '/srv/logger'
+log_directory = os.path.join(log_path, 'logs') # Log files indexed.
+index_directory = os.path.join(log_path, 'index') # Index files.
+index_every = 1000 # Lines between offset index entries within the same minute.
+entry_bytes = 20 # Length of each offset index entry "HHMMSS OOOOOOOOOOOO\n".
+value_cap = 100 # Most distinct values catalogued for an extra key in one log file.
+msg_cap = 1000 # Most distinct msg strings catalogued in one log file.
+posting_buckets = 256 # Bucket files of postings for each day and partition.
+record_attributes = frozenset(logging.makeLogRecord({}).__dict__) | { 'message', 'asctime' } # Not posted or catalogued as extra keys, msg is from the line.
+
+def index_path(log_name, kind):
+    """
+    Return the path of the index file of type kind (e.g. 'rollup') for log file log_name.
+    """
+    return os.path.join(index_directory, log_name + '.' + kind)
+
+def save_json(path, content):
+    """
+    Replace the file at path with content as JSON, atomically so readers never see a partial file.
+    """
+    temporary = path + '.tmp'
+    with open(temporary, mode='w') as outfile:
+        json.dump(content, outfile, separators=(',', ':'))
+    os.replace(temporary, path)
+
+def read_lines(path, start=0, stop=None):
+    """
+    Return the lines (bytes, with trailing newline) of the file at path from byte offset start up to stop, or the end of the file.
+    A partial last line, still being written, is left out. Archived log files are read from their archive.
+    """
+    with open_log(path) as infile:
+        infile.seek(start)
+        data = infile.read(-1 if stop is None else stop - start)
+    return [line + b'\n' for line in data.split(b'\n')[:-1]]
+
+def iter_lines(path, start=0, stop=None, chunk_bytes=1024 * 1024):
+    """
+    Generate (offset, line) for the lines (bytes, with trailing newline) of the file at path from byte offset start up to stop,
+    or the end of the file, reading chunk_bytes at a time. A partial last line, still being written, is left out.
+    Archived log files are read from their archive.
+    """
+    stop = log_size(path) if stop is None else stop
+    with open_log(path) as infile:
+        infile.seek(start)
+        remainder = b''
+        while start < stop:
+            data = infile.read(min(chunk_bytes, stop - start))
+            if not data: break
+            start += len(data)
+            lines = (remainder + data).split(b'\n')
+            remainder = lines.pop() # Incomplete line, continued in the next chunk.
+            offset = start - len(remainder) - sum(len(line) + 1 for line in lines)
+            for line in lines:
+                yield (offset, line + b'\n')
+                offset += len(line) + 1
+
+def seconds_of(stamp):
+    """
+    Return seconds since midnight for a time string HHMMSS.
+    """
+    return int(stamp[0:2]) * 3600 + int(stamp[2:4]) * 60 + int(stamp[4:6] or 0)
+
+def stamp_of(seconds):
+    """
+    Return the time string HHMMSS for seconds since midnight.
+    """
+    return '{0:02d}{1:02d}{2:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+def posting_term(key, value):
+    """
+    Return the posting term key=value (str) for key and value, url-encoded so it holds no tabs or newlines.
+    """
+    return quote(key, safe='') + '=' + quote(value, safe='')
+
+def posting_path(name, term):
+    """
+    Return the path of the bucket file holding postings for term in the catalog named name (YYYYMMDD-PP).
+    """
+    return os.path.join(index_directory, name + '.postings', '{0:02x}.post'.format(zlib.crc32(term.encode()) % posting_buckets))
+
+def read_postings(name, term):
+    """
+    Return the set of (LL-facility, HHMMSS, offset) for lines posted under term in the catalog named name (YYYYMMDD-PP).
+    """
+    prefix = term + '\t'
+    postings = set()
+    try:
+        with open(posting_path(name, term), mode='r') as infile:
+            for posting in infile:
+                if not posting.startswith(prefix) or not posting.endswith('\n'): continue # Other terms, or still being written.
+                (term, entry, stamp, offset) = posting.split('\t')
+                postings.add((entry, stamp, int(offset)))
+    except FileNotFoundError:
+        pass
+    return postings
+
+def load_json(path):
+    """
+    Return the content of JSON file at path, or None if there is no such file.
+    """
+    try:
+        with open(path, mode='r') as infile:
+            return json.load(infile)
+    except FileNotFoundError:
+        return None
+
+
+class Rollup():
+    """
+    Counts of lines per minute and per hour for one log file, covering the first size bytes.
+    Also the state of the offset index for the same bytes.
+    """
+
+    def __init__(self, size=0, minutes=None, hours=None, latest='', unindexed=0, lag=0):
+        self.size = size
+        self.minutes = minutes or dict() # 'HHMM' to count.
+        self.hours = hours or dict() # 'HH' to count.
+        self.latest = latest # Latest time HHMMSS of any line.
+        self.unindexed = unindexed # Lines since the last offset index entry.
+        self.lag = lag # Most seconds any line was earlier than the latest line before it.
+
+    @classmethod
+    def load(cls, log_name):
+        """
+        Return the saved rollup for log_name, or None if there isn't one.
+        """
+        content = load_json(index_path(log_name, 'rollup'))
+        return content and cls(**content)
+
+    def save(self, log_name):
+        save_json(index_path(log_name, 'rollup'), self.__dict__)
+
+    def add_lines(self, lines):
+        """
+        Count loglines (bytes lines YYYYMMDD-HHMMSS.uuuuuu-...) appended to the log file.
+        Returns the offset index entries (time HHMMSS, offset) due for these lines.
+        """
+        entries = []
+        for line in lines:
+            stamp = line[9:15].decode()
+            minute = stamp[:4]
+            self.minutes[minute] = self.minutes.get(minute, 0) + 1
+            self.hours[minute[:2]] = self.hours.get(minute[:2], 0) + 1
+            new_minute = minute > self.latest[:4]
+            if stamp > self.latest:
+                self.latest = stamp
+            elif stamp < self.latest: # Out of order line.
+                self.lag = max(self.lag, seconds_of(self.latest) - seconds_of(stamp))
+            if new_minute or self.unindexed >= index_every:
+                entries.append((self.latest, self.size))
+                self.unindexed = 0
+            self.unindexed += 1
+            self.size += len(line)
+        return entries
+
+    def count(self, start_time='', stop_time=''):
+        """
+        Return (count, edges) for lines with times HHMMSS from start_time to stop_time inclusive, either of which may be empty.
+        count covers every whole minute in the range.
+        edges lists the (start_time, stop_time) second ranges of partial minutes at the ends of the range, still to be counted from log lines.
+        """
+        if not start_time and not stop_time: # Whole day.
+            return (sum(self.hours.values()), [])
+        if start_time and stop_time and start_time > stop_time: # Empty range.
+            return (0, [])
+        (first, last) = (start_time[:4] or '0000', stop_time[:4] or '2359') # Minutes touched by the range.
+        edges = []
+        if start_time[4:] > '00': # Range starts part way through a minute.
+            edges.append((start_time, first == last and stop_time or first + '59'))
+        if stop_time and stop_time[4:] < '59' and (first != last or not edges): # Range stops part way through a minute.
+            edges.append((first == last and start_time or last + '00', stop_time))
+        whole = [edge[0][:4] for edge in edges] # Minutes counted from log lines instead.
+        count = sum(n for (minute, n) in self.minutes.items() if first <= minute <= last and minute not in whole)
+        return (count, edges)
+
+
+class OffsetIndex():
+    """
+    Read only view of the offset index of log file log_name through mmap, as a sequence of entry times for binary search.
+    """
+
+    def __init__(self, log_name):
+        self.map = None
+        try:
+            with open(index_path(log_name, 'offsets'), mode='rb') as infile:
+                if os.fstat(infile.fileno()).st_size >= entry_bytes:
+                    self.map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError: # Log file not indexed yet.
+            pass
+        self.entries = self.map and len(self.map) // entry_bytes or 0 # Ignore any partial entry being appended.
+
+    def __len__(self):
+        return self.entries
+
+    def __getitem__(self, entry):
+        return self.map[entry * entry_bytes:entry * entry_bytes + 6].decode()
+
+    def offset(self, entry):
+        return int(self.map[entry * entry_bytes + 7:entry * entry_bytes + 19])
+
+    def range(self, start_time, stop_time, rollup):
+        """
+        Return (start, stop) byte offsets of the log file, within the rollup.size bytes indexed,
+        outside which there are no lines with times HHMMSS from start_time to stop_time, either of which may be empty.
+        """
+        start = 0
+        if start_time:
+            entry = bisect.bisect_left(self, start_time) - 1 # Last entry earlier than start_time, all lines before it are earlier too.
+            start = entry >= 0 and self.offset(entry) or 0
+        stop = rollup.size
+        if stop_time and seconds_of(stop_time) + rollup.lag < 86400:
+            entry = bisect.bisect_right(self, stamp_of(seconds_of(stop_time) + rollup.lag)) # First entry after which no line is in range.
+            if entry < self.entries:
+                stop = min(stop, self.offset(entry))
+        return (start, max(start, stop))
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+
+
+def catalog_name(log_name):
+    """
+    Return the catalog name YYYYMMDD-PP for log file log_name YYYYMMDD-LL-facility.
+    """
+    (day, level, facility) = log_name.split('-')
+    return '{0}-{1:02d}'.format(day, facility_partition(facility))
+
+
+class Catalog():
+    """
+    Distinct values with occurrence counts for the log files of one day and spool partition.
+    """
+
+    def __init__(self, entries=None):
+        self.entries = entries or dict() # 'LL-facility' to entry.
+
+    @classmethod
+    def load(cls, name):
+        """
+        Return the saved catalog named name (YYYYMMDD-PP), or an empty catalog.
+        """
+        return cls(load_json(index_path(name, 'catalog')))
+
+    def save(self, name):
+        save_json(index_path(name, 'catalog'), self.entries)
+
+    def entry(self, log_name):
+        """
+        Return the entry for log file log_name, creating an empty one if needed.
+        """
+        return self.entries.setdefault(log_name[9:], { 'size': 0, 'count': 0, 'msg': {}, 'keys': {}, 'capped': {} })
+
+    def reset(self, log_name):
+        self.entries.pop(log_name[9:], None)
+        return self.entry(log_name)
+
+    def add_lines(self, log_name, lines):
+        """
+        Catalog loglines (bytes lines prefix:msg:content) appended to log file log_name.
+        Returns the postings for the lines, as (term, 'LL-facility\tHHMMSS\toffset').
+        """
+        entry = self.entry(log_name)
+        (messages, keys, capped) = (entry['msg'], entry['keys'], entry['capped'])
+        postings = []
+        for line in lines:
+            (prefix, rest) = line.decode().rstrip('\n').split(':', 1)
+            (message, content) = rest.rsplit(':', 1) # Content is url-encoded so contains no colons, msg may.
+            location = '{0}\t{1}\t{2}'.format(log_name[9:], prefix[9:15], entry['size'])
+            postings.append((posting_term('msg', message), location))
+            entry['size'] += len(line)
+            entry['count'] += 1
+            if 'msg' in capped:
+                capped['msg'] += 1
+            elif message in messages or len(messages) < msg_cap:
+                messages[message] = messages.get(message, 0) + 1
+            else: # Too many distinct msg strings.
+                capped['msg'] = sum(messages.values()) + 1
+                messages.clear()
+            for (key, value) in parse_qsl(content, keep_blank_values=True):
+                if key in record_attributes: continue # Standard LogRecord attributes, not extra keys.
+                postings.append((posting_term(key, value), location))
+                if key in capped:
+                    capped[key] += 1
+                    continue
+                values = keys.setdefault(key, {})
+                if value in values or len(values) < value_cap:
+                    values[value] = values.get(value, 0) + 1
+                else: # Too many distinct values, keep the key but stop cataloguing values.
+                    capped[key] = sum(values.values()) + 1
+                    del keys[key]
+        return postings
+
+
+class IndexWriter():
+    """
+    Maintain index files for log files as logger_collector.py appends to them.
+    Index files of recently appended log files are held in memory, up to max_held log files.
+    An index file missing or beyond the end of its log file, as after an interrupted batch is undone, is rebuilt from the log file.
+    """
+
+    max_held = 2000 # Log files with index files held in memory.
+
+    def __init__(self):
+        self.rollups = dict() # Log file name to Rollup.
+        self.catalogs = dict() # Catalog name to Catalog.
+        self.unsaved = set() # Catalogs updated and not yet saved.
+        self.postings = dict() # Bucket file path to postings not yet written.
+
+    def update(self, log_name, lines, size):
+        """
+        Index lines (bytes loglines) just appended at byte offset size of log file log_name, and save the index files.
+        Catalogs and postings are only saved by save().
+        """
+        if log_name not in self.rollups and len(self.rollups) >= self.max_held:
+            self.save()
+            self.rollups.clear() # Reloaded from disk as needed.
+            self.catalogs.clear()
+        rollup = self.rollups.get(log_name)
+        name = catalog_name(log_name)
+        catalog = self.catalogs.get(name) or self.catalogs.setdefault(name, Catalog.load(name))
+        if rollup is None: # First update since this process started.
+            rollup = Rollup.load(log_name)
+            if rollup is None or rollup.size > size or (rollup.size and not rollup.latest): # Never built, out of date or without offsets.
+                rollup = Rollup()
+            self.trim_offsets(log_name, rollup.size) # Drop entries written for an undone batch.
+            if catalog.entry(log_name)['size'] > size: # Out of date.
+                catalog.reset(log_name)
+        postings = []
+        if catalog.entry(log_name)['size'] < size: # Lines not yet catalogued.
+            postings.extend(catalog.add_lines(log_name, read_lines(os.path.join(log_directory, log_name), catalog.entry(log_name)['size'], size)))
+        postings.extend(catalog.add_lines(log_name, lines))
+        for (term, location) in postings:
+            self.postings.setdefault(posting_path(name, term), []).append(term + '\t' + location + '\n')
+        self.unsaved.add(name)
+        entries = []
+        if rollup.size < size: # Lines not yet indexed.
+            entries.extend(rollup.add_lines(read_lines(os.path.join(log_directory, log_name), rollup.size, size)))
+        entries.extend(rollup.add_lines(lines))
+        if entries: # Offset entries first so the rollup never covers lines missing from the offset index.
+            with open(index_path(log_name, 'offsets'), mode='ab') as outfile:
+                outfile.write(b''.join(bytes('{0} {1:012d}\n'.format(stamp, offset), 'ascii') for (stamp, offset) in entries))
+        rollup.save(log_name)
+        self.rollups[log_name] = rollup
+
+    def save(self):
+        """
+        Append postings then save catalogs updated since last saved, once per batch rather than once per log file.
+        Postings come first so a catalog never covers lines missing from the postings.
+        """
+        for (path, postings) in self.postings.items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, mode='a') as outfile:
+                outfile.write(''.join(postings))
+        self.postings.clear()
+        for name in self.unsaved:
+            self.catalogs[name].save(name)
+        self.unsaved.clear()
+
+    def reset(self):
+        """
+        Save, then forget everything held, so index files are loaded again when next needed, as after files are removed.
+        """
+        self.save()
+        self.rollups.clear()
+        self.catalogs.clear()
+
+    def trim_offsets(self, log_name, size):
+        """
+        Remove offset index entries at or beyond size bytes of the log file, which are not covered by the rollup.
+        """
+        path = index_path(log_name, 'offsets')
+        try:
+            with open(path, mode='rb') as infile:
+                data = infile.read()
+        except FileNotFoundError:
+            return
+        keep = len(data) // entry_bytes
+        while keep and int(data[(keep - 1) * entry_bytes + 7:keep * entry_bytes - 1]) >= size:
+            keep -= 1
+        if keep * entry_bytes != len(data):
+            os.truncate(path, keep * entry_bytes)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# Python 3.6.3
+# logger_metrics.py
+
+"""
+logger_metrics.py:
+Counters and latency histograms kept in memory by each process of logger_httpd.py and logger_collector.py,
+served by logger_httpd.py on /api/v1/metrics as JSON, or in Prometheus text format with ?format=prometheus.
+
+Recording is a dict update under a lock, cheap enough for every request and batch.
+Each process started with start() saves a snapshot of its metrics to /srv/logger/metrics/<process>.json every snapshot_interval seconds,
+so the process answering /api/v1/metrics reports every collector worker and forked server process alongside its own, labelled by process.
+Snapshots not updated for stale_after seconds are from processes that have stopped, and are removed.
+Gauges of the spool backlog, bytes not yet collected and the age of the oldest message waiting in each partition,
+and of message files waiting in the former cache directory, are measured when metrics are requested.
+
+An optional sampling profiler, started with start(process, profile_interval), records the stack of every other thread
+each profile_interval seconds. Stacks are saved with the snapshot as /srv/logger/metrics/<process>.profile in folded format,
+one line "frame;frame;frame count" per distinct stack, outermost frame first, as read by flamegraph tools,
+and served on /api/v1/metrics?format=profile.
+
+Usage:
+import logger_metrics
+logger_metrics.count('responses_total', method='POST', status='201')
+with logger_metrics.timed('parse_seconds'):
+    parse()
+logger_metrics.observe('collect_batch_messages', len(records), buckets=logger_metrics.size_buckets)
+
+Anil Gulati
+01/09/2018
+"""
+
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+import collections
+
+import logger_spool
+
+log_path = '/srv/logger'
+metrics_directory = os.path.join(log_path, 'metrics') # Snapshots and profiles of each process.
+cache_directory = os.path.join(log_path, 'cache') # Former primary cache, drained by logger_collector.py.
+snapshot_interval = 5 # Seconds between snapshots saved by each process.
+stale_after = 120 # Seconds after which a snapshot not updated is from a stopped process.
+latency_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0) # Seconds.
+size_buckets = (1, 10, 100, 1000, 10000, 100000, 1000000) # Messages or bytes.
+
+
+class Registry():
+    """
+    Counters and histograms of one process, keyed by name and labels. Shared by all threads in the process.
+    """
+
+    def __init__(self, process='process'):
+        self.lock = threading.Lock()
+        self.reset(process)
+
+    def reset(self, process):
+        """
+        Forget everything recorded, as in a new process named process.
+        """
+        with self.lock:
+            self.process = process
+            self.counters = dict() # (name, labels) to value.
+            self.histograms = dict() # (name, labels) to [buckets, counts per bucket and +Inf, sum, count].
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=latency_buckets, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [buckets, [0] * (len(buckets) + 1), 0.0, 0]
+            histogram[1][bisect.bisect_left(histogram[0], value)] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    def snapshot(self):
+        """
+        Return everything recorded as a JSON serialisable dict.
+        """
+        with self.lock:
+            return { 'process': self.process, 'time': time.time(),
+                     'counters': [{ 'name': name, 'labels': dict(labels), 'value': value } for ((name, labels), value) in sorted(self.counters.items())],
+                     'histograms': [{ 'name': name, 'labels': dict(labels), 'buckets': list(buckets), 'counts': list(counts), 'sum': total, 'count': number }
+                                    for ((name, labels), (buckets, counts, total, number)) in sorted(self.histograms.items())] }
+
+
+class Timer():
+    """
+    Context manager observing the seconds spent within it in histogram name.
+    """
+
+    def __init__(self, name, labels):
+        (self.name, self.labels) = (name, labels)
+
+    def __enter__(self):
+        self.began = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        registry.observe(self.name, time.perf_counter() - self.began, **self.labels)
+
+
+class Profiler():
+    """
+    Sampling profiler: a thread recording the stacks of every other thread in the process each interval seconds,
+    except the threads of this module.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = collections.Counter() # Folded stack to samples.
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name='Profiler', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            samples = []
+            own = set(thread.ident for thread in threading.enumerate() if thread.name in ('Profiler', 'Metrics')) # Not worth profiling.
+            for (ident, frame) in sys._current_frames().items():
+                if ident in own: continue
+                frames = []
+                while frame is not None:
+                    frames.append('{0}:{1}'.format(os.path.basename(frame.f_code.co_filename).rsplit('.', 1)[0], frame.f_code.co_name))
+                    frame = frame.f_back
+                samples.append(';'.join(reversed(frames)))
+            with self.lock:
+                self.stacks.update(samples)
+
+    def folded(self):
+        """
+        Return the stacks sampled in folded format, most sampled first.
+        """
+        with self.lock:
+            return ''.join('{0} {1}\n'.format(stack, samples) for (stack, samples) in self.stacks.most_common())
+
+
+registry = Registry() # Metrics of this process.
+profiler = None # Profiler of this process, if started.
+
+def count(name, value=1, **labels):
+    """
+    Add value to counter name with labels.
+    """
+    registry.count(name, value, **labels)
+
+def observe(name, value, buckets=latency_buckets, **labels):
+    """
+    Record value in histogram name with labels, by default a latency in seconds.
+    """
+    registry.observe(name, value, buckets, **labels)
+
+def timed(name, **labels):
+    """
+    Return a context manager recording the seconds spent within it in histogram name with labels.
+    """
+    return Timer(name, labels)
+
+def start(process, profile_interval=0):
+    """
+    Start recording as process named process, saving snapshots from a background thread, and sampling stacks every profile_interval seconds if given.
+    Called in each process after it is forked, as neither the metrics nor the threads of a parent carry over.
+    """
+    global profiler
+    registry.lock = threading.Lock() # Any lock held by another thread of the parent when forked would never be released.
+    registry.reset(process)
+    profiler = profile_interval and Profiler(profile_interval) or None
+    threading.Thread(target=save_snapshots, name='Metrics', daemon=True).start()
+
+def save_snapshots():
+    while True:
+        time.sleep(snapshot_interval)
+        try: save_snapshot()
+        except OSError: pass # Metrics never stop the process, try again next time.
+
+def save_snapshot():
+    """
+    Replace the snapshot and profile of this process in the metrics directory.
+    """
+    os.makedirs(metrics_directory, exist_ok=True)
+    snapshot = registry.snapshot()
+    contents = [('.json', json.dumps(snapshot, separators=(',', ':')))]
+    if profiler is not None:
+        contents.append(('.profile', profiler.folded()))
+    for (extension, content) in contents:
+        path = os.path.join(metrics_directory, snapshot['process'] + extension)
+        temporary = path + '.{0}.tmp'.format(os.getpid())
+        with open(temporary, mode='w') as outfile:
+            outfile.write(content)
+        os.replace(temporary, path)
+
+def snapshots():
+    """
+    Return the snapshots of every process, this process's taken now, others from their latest saved snapshots. Stale snapshots are removed.
+    """
+    current = registry.snapshot()
+    result = [current]
+    try: names = sorted(name for name in os.listdir(metrics_directory) if name.endswith('.json'))
+    except FileNotFoundError: names = []
+    for name in names:
+        if name[:-5] == current['process']: continue
+        path = os.path.join(metrics_directory, name)
+        try:
+            with open(path, mode='r') as infile:
+                snapshot = json.load(infile)
+        except (FileNotFoundError, ValueError): # Removed, or replaced while being read.
+            continue
+        if current['time'] - snapshot['time'] > stale_after: # Process has stopped.
+            for extension in ('.json', '.profile'):
+                try: os.remove(path[:-5] + extension)
+                except FileNotFoundError: pass
+            continue
+        result.append(snapshot)
+    return result
+
+def gauges():
+    """
+    Return the current spool backlog and former cache depth as a list of { 'name', 'labels', 'value' }.
+    Spool bytes waiting and the age in seconds of the oldest message waiting are measured for each partition.
+    """
+    now = time.time()
+    result = []
+    for partition in range(logger_spool.spool_partitions):
+        (waiting, oldest) = logger_spool.spool_backlog(logger_spool.partition_directory(partition, logger_spool.spool_directory))
+        labels = { 'partition': '{0:02d}'.format(partition) }
+        result.append({ 'name': 'spool_backlog_bytes', 'labels': labels, 'value': waiting })
+        result.append({ 'name': 'spool_oldest_age_seconds', 'labels': labels, 'value': oldest and round(max(0.0, now - oldest), 6) or 0 })
+    try: files = sum(1 for name in os.listdir(cache_directory) if not name.startswith('.'))
+    except FileNotFoundError: files = 0
+    result.append({ 'name': 'cache_files', 'labels': {}, 'value': files })
+    return result
+
+def metrics_json():
+    """
+    Return all metrics as a dict: { 'processes': [snapshot, ...], 'gauges': [...] }.
+    """
+    return { 'processes': snapshots(), 'gauges': gauges() }
+
+def label_text(labels):
+    if not labels:
+        return ''
+    escaped = ('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for (name, value) in sorted(labels.items()))
+    return '{' + ','.join(escaped) + '}'
+
+def number_text(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def metrics_prometheus():
+    """
+    Return all metrics in Prometheus text exposition format, each named logger_<name>, with a process label for counters and histograms.
+    """
+    content = metrics_json()
+    families = collections.OrderedDict() # Metric name to (type, lines).
+    for snapshot in content['processes']:
+        process = { 'process': snapshot['process'] }
+        for counter in snapshot['counters']:
+            lines = families.setdefault('logger_' + counter['name'], ('counter', []))[1]
+            lines.append('logger_{0}{1} {2}'.format(counter['name'], label_text(dict(counter['labels'], **process)), number_text(counter['value'])))
+        for histogram in snapshot['histograms']:
+            (name, labels) = ('logger_' + histogram['name'], dict(histogram['labels'], **process))
+            lines = families.setdefault(name, ('histogram', []))[1]
+            cumulative = 0
+            for (bound, samples) in zip([number_text(bound) for bound in histogram['buckets']] + ['+Inf'], histogram['counts']):
+                cumulative += samples
+                lines.append('{0}_bucket{1} {2}'.format(name, label_text(dict(labels, le=bound)), cumulative))
+            lines.append('{0}_sum{1} {2}'.format(name, label_text(labels), number_text(histogram['sum'])))
+            lines.append('{0}_count{1} {2}'.format(name, label_text(labels), histogram['count']))
+    for gauge in content['gauges']:
+        lines = families.setdefault('logger_' + gauge['name'], ('gauge', []))[1]
+        lines.append('logger_{0}{1} {2}'.format(gauge['name'], label_text(gauge['labels']), number_text(gauge['value'])))
+    text = []
+    for (name, (kind, lines)) in families.items():
+        text.append('# TYPE {0} {1}\n'.format(name, kind))
+        text.extend(line + '\n' for line in lines)
+    return ''.join(text)
+
+def profiles():
+    """
+    Return the folded stacks sampled by every process profiled, each stack starting with the process name.
+    """
+    folded = dict()
+    try: names = sorted(name for name in os.listdir(metrics_directory) if name.endswith('.profile'))
+    except FileNotFoundError: names = []
+    for name in names:
+        try:
+            with open(os.path.join(metrics_directory, name), mode='r') as infile:
+                folded[name[:-8]] = infile.read()
+        except FileNotFoundError:
+            continue
+    if profiler is not None: # This process as it is now.
+        folded[registry.process] = profiler.folded()
+    return ''.join(''.join(process + ';' + line + '\n' for line in content.splitlines()) for (process, content) in sorted(folded.items()))
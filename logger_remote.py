@@ -10,9 +10,19 @@ Logging to the remote server is supported using a standard Python library loggin
 Run python logger_remote.py to generate a stream of random test messages.
 Authentication can be by basic auth over SSL.
 
+get_logger(facility, batching=True) attaches a BatchingHandler instead of the stock HTTPHandler.
+logger.log() then only queues the record in memory and a background thread sends queued records
+in batches to /api/v1/messages/bulk over a single persistent connection.
+
+get_logger(facility, spool=directory) attaches a SpoolingHandler instead, so logger.log() only appends the record
+to a durable spool of segment files on local disk (see logger_spool.py), with no network at all.
+A separate forwarder process, python logger_remote.py --forward directory, drains the spool in large batches,
+retrying with backoff while the server is down, and resuming from its committed position after a restart.
+With forward=True get_logger() starts the forwarder if one is not already running for the spool.
+
 Usage:
 import logger_remote
-logger = logger_remote.get_logger(__name__)
+logger = logger_remote.get_logger(__name__) # Or get_logger(__name__, batching=True) to avoid waiting on the network.
 record = { 'key': 'value' }
 logger.log(level, 'error message', extra=record)
 logger_remote.shutdown()
@@ -30,37 +40,435 @@ TODO: Consider reporting server responses in general in case of error.
 """
 
 import logging, logging.handlers
+import http.client
+import subprocess
+import argparse
+import fcntl
+import threading
+import collections
+import urllib.parse
 import datetime
+import json
+import gzip
+import time
 import sys
 import os
 import random
 
+from logger_spool import SpoolWriter, SpoolReader, spool_backlog, split_record
+from logger_watch import get_watcher
+
 host = 'localhost:8080'
 route = '/api/v1/messages'
+bulk_route = '/api/v1/messages/bulk'
+batching_handlers = [] # BatchingHandlers created by get_logger, flushed by shutdown().
+forwarders_started = set() # Spool directories this process has started a forwarder for.
 
-def get_logger(facility):
+def get_logger(facility, batching=False, spool=None, forward=False, **options):
     """
     Return logger object used to send messages to remote logging server.
     This call only wraps four lines of logging library calls to set up a logger in a single call.
+    With batching=True records are queued and sent in the background by a BatchingHandler, configured by options.
+    With spool, a directory, records are appended to a durable spool there by a SpoolingHandler, configured by options,
+    and with forward=True a forwarder process is started to send them if none is running.
     """
     logger = logging.getLogger(facility) # Set up standard library logger named with the facility name.
-    http_handler = logging.handlers.HTTPHandler(host, route, method='POST') # secure=True, context=ssl.SSLContext, credentials=(userid, password)
+    if spool:
+        http_handler = SpoolingHandler(spool, **options)
+        if forward and spool not in forwarders_started:
+            start_forwarder(spool)
+            forwarders_started.add(spool)
+    elif batching:
+        http_handler = BatchingHandler(host, bulk_route, **options)
+        batching_handlers.append(http_handler)
+    else:
+        http_handler = logging.handlers.HTTPHandler(host, route, method='POST') # secure=True, context=ssl.SSLContext, credentials=(userid, password)
     # http_handler.setLevel(logging.INFO) # Level defaults to INFO, DEBUG or 0 will not be sent.
     http_handler.raiseExceptions = False # Suppress exceptions in use.
     logger.addHandler(http_handler) # Log everything through this handler without filtering.
     return logger # Pass back the logger object.
 
-def shutdown():
+def shutdown(timeout=5.0):
     """
     Orderly shutdown for application exit.
+    Batching handlers are given up to timeout seconds to send records still queued.
     """
+    for handler in batching_handlers:
+        handler.shutdown_timeout = timeout
     return logging.shutdown()
 
+def start_forwarder(directory, server=None):
+    """
+    Start a forwarder process for the spool in directory, sending to server (host:port, by default host), detached from this process.
+    A forwarder already running for the spool holds its lock, so the new one exits straight away.
+    """
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--forward', directory, '--host', server or host],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+class BulkSender():
+    """
+    POST batches of url-encoded records one per line to /api/v1/messages/bulk, gzip compressed,
+    over one persistent HTTP/1.1 connection that is reopened when lost.
+    """
+
+    def __init__(self, host, url, timeout=10.0):
+        (self.host, self.url, self.timeout) = (host, url, timeout)
+        self.connection = None
+
+    def post(self, lines):
+        """
+        POST a batch of lines, reusing the connection. Returns (accepted, rejected) once the server has responded to the batch,
+        or None if it could not be sent or the server could not take it.
+        A connection found closed by the server is reopened and the batch tried once more.
+        """
+        body = gzip.compress('\n'.join(lines).encode(), compresslevel=1)
+        headers = { 'Content-Type': 'text/plain', 'Content-Encoding': 'gzip' }
+        for attempt in (1, 2):
+            try:
+                if self.connection is None:
+                    self.connection = http.client.HTTPConnection(self.host, timeout=self.timeout)
+                self.connection.request('POST', self.url, body, headers)
+                response = self.connection.getresponse()
+                content = response.read()
+                if response.will_close:
+                    self.close()
+                if response.status in (201, 400) and response.getheader('Content-Type') == 'application/json':
+                    result = json.loads(content.decode())
+                    return (result['accepted'], len(result['rejected']))
+                return None # Server error or busy, try later.
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                self.close() # Idle connection closed by server, retry once on a new one.
+                if attempt == 1: continue
+            except Exception:
+                self.close()
+            return None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class BatchingHandler(logging.Handler):
+    """
+    Queue records in memory and send them in batches from a background thread, so logging never waits on the network.
+    Records are url-encoded exactly as HTTPHandler would POST them and sent one per line to /api/v1/messages/bulk,
+    gzip compressed, over one persistent HTTP/1.1 connection that is reconnected when lost.
+    A batch is sent when batch_size records are queued or interval seconds have passed since the last send.
+    The queue holds at most capacity records, counting those being sent. When full the overflow policy applies:
+    drop-oldest:      Discard the oldest queued record.
+    drop-debug-first: Discard the oldest queued DEBUG record, otherwise the oldest record. A new DEBUG record is discarded instead.
+    block:            Wait in logger.log() until there is room.
+    Counters: sent (accepted by server), rejected (refused by server as invalid), dropped (overflow or shutdown), errors (failed sends).
+    Batches that fail to send are returned to the head of the queue and retried after retry_delay seconds.
+    DEBUG records are queued apart from the rest so the oldest can be discarded at once, each numbered in sequence to send them in order.
+    """
+
+    policies = ('drop-oldest', 'drop-debug-first', 'block')
+
+    def __init__(self, host, url, capacity=10000, batch_size=500, interval=1.0, overflow='drop-oldest', timeout=10.0, retry_delay=1.0):
+        if overflow not in self.policies:
+            raise ValueError('overflow must be one of ' + ', '.join(self.policies))
+        logging.Handler.__init__(self)
+        (self.host, self.url, self.timeout) = (host, url, timeout)
+        (self.capacity, self.batch_size, self.interval) = (capacity, batch_size, interval)
+        (self.overflow, self.retry_delay) = (overflow, retry_delay)
+        (self.sent, self.rejected, self.dropped, self.errors) = (0, 0, 0, 0)
+        self.queue = collections.deque() # (sequence, levelno, url-encoded record) above DEBUG, oldest first.
+        self.debug = collections.deque() # The same for DEBUG records and below.
+        self.sequence = 0 # Of the next record queued.
+        self.in_flight = 0 # Records taken from the queue and not yet sent, still held for retry.
+        self.ready = threading.Condition() # Guards the queue and counters, signalled whenever either changes.
+        self.stopping = False
+        self.flushing = 0 # Callers waiting in flush(), sender does not wait for a full batch meanwhile.
+        self.shutdown_timeout = 5.0 # Seconds allowed on close to send records still queued.
+        self.sender = BulkSender(host, url, timeout)
+        self.thread = threading.Thread(target=self.run, name='BatchingHandler', daemon=True)
+        self.thread.start()
+
+    def mapLogRecord(self, record):
+        """
+        Same mapping as HTTPHandler: every attribute of the record is sent.
+        """
+        return record.__dict__
+
+    def emit(self, record):
+        """
+        Queue the url-encoded record, applying the overflow policy if the queue is full.
+        """
+        try:
+            line = urllib.parse.urlencode(self.mapLogRecord(record))
+            with self.ready:
+                if self.held() >= self.capacity and not self.make_room(record.levelno):
+                    self.dropped += 1 # New record is the one discarded.
+                    return
+                (self.debug if record.levelno <= logging.DEBUG else self.queue).append((self.sequence, record.levelno, line))
+                self.sequence += 1
+                if len(self.queue) + len(self.debug) >= self.batch_size:
+                    self.ready.notify_all() # Wake sender for a full batch.
+        except Exception:
+            self.handleError(record)
+
+    def held(self):
+        """
+        Return the number of records queued or being sent. Called holding self.ready.
+        """
+        return len(self.queue) + len(self.debug) + self.in_flight
+
+    def take(self, count):
+        """
+        Remove and return up to count of the oldest records queued, in order. Called holding self.ready.
+        """
+        batch = []
+        while len(batch) < count and (self.queue or self.debug):
+            oldest = self.debug if not self.queue or self.debug and self.debug[0][0] < self.queue[0][0] else self.queue
+            batch.append(oldest.popleft())
+        return batch
+
+    def make_room(self, levelno):
+        """
+        Apply the overflow policy to a full queue. Called holding self.ready.
+        Returns False if the new record at levelno should be discarded instead.
+        """
+        if self.overflow == 'block':
+            while self.held() >= self.capacity and not self.stopping:
+                self.ready.wait()
+            return not self.stopping
+        if self.overflow == 'drop-debug-first':
+            if self.debug: # Oldest debug record goes first.
+                self.debug.popleft()
+                self.dropped += 1
+                return True
+            if levelno <= logging.DEBUG: # Nothing less important queued than the new record.
+                return False
+        if not self.take(1): # Everything held is being sent.
+            return False
+        self.dropped += 1
+        return True
+
+    def run(self):
+        """
+        Background sender: wait for a full batch or the interval to pass, then send.
+        """
+        while True:
+            with self.ready:
+                deadline = time.monotonic() + self.interval
+                while len(self.queue) + len(self.debug) < self.batch_size and not (self.stopping or self.flushing):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0: break
+                    self.ready.wait(remaining)
+                if self.stopping and not (self.queue or self.debug):
+                    break
+                batch = self.take(self.batch_size)
+                self.in_flight = len(batch) # Still counted against capacity until sent.
+            if batch and not self.send(batch):
+                with self.ready: # Put back for retry, oldest first, into the room held for it.
+                    for entry in reversed(batch):
+                        (self.debug if entry[1] <= logging.DEBUG else self.queue).appendleft(entry)
+                    self.in_flight = 0
+                    self.ready.wait(self.retry_delay) # Back off, unless told to stop.
+                    if self.stopping: break
+            with self.ready:
+                self.in_flight = 0
+                self.ready.notify_all() # Room for blocked loggers, and wake flush() waiting for an empty queue.
+        with self.ready:
+            self.dropped += len(self.queue) + len(self.debug) # Not sent before the shutdown deadline.
+            self.queue.clear()
+            self.debug.clear()
+            self.ready.notify_all()
+
+    def send(self, batch):
+        """
+        POST a batch of records. Returns True once the server has responded to the batch.
+        """
+        result = self.sender.post([line for (sequence, levelno, line) in batch])
+        with self.ready:
+            if result is None:
+                self.errors += 1
+                return False
+            self.sent += result[0]
+            self.rejected += result[1]
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Wake the sender and wait until everything queued has been sent or timeout seconds pass.
+        """
+        deadline = time.monotonic() + (self.shutdown_timeout if timeout is None else timeout)
+        with self.ready:
+            self.flushing += 1
+            self.ready.notify_all()
+            while (self.queue or self.debug or self.in_flight) and self.thread.is_alive():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                self.ready.wait(remaining)
+            self.flushing -= 1
+
+    def close(self):
+        """
+        Send what is queued within shutdown_timeout seconds, then stop the sender. Anything left is counted as dropped.
+        """
+        deadline = time.monotonic() + self.shutdown_timeout
+        self.flush()
+        with self.ready:
+            self.stopping = True
+            self.ready.notify_all()
+        self.thread.join(max(0.0, deadline - time.monotonic()))
+        self.sender.close()
+        logging.Handler.close(self)
+
+
+class SpoolingHandler(logging.Handler):
+    """
+    Append each record to a durable spool in directory on local disk and return, leaving a forwarder process to send it, see Forwarder.
+    Records are url-encoded exactly as HTTPHandler would POST them, one per line in the segment files of the spool (see logger_spool.py),
+    each with a single append, so any number of processes can share a spool, and records survive their exit, a crash or the server being down.
+    The spool is bounded to capacity bytes not yet forwarded. As it fills, records of lower levels are dropped by drop_policy,
+    a list of (fraction full, level): once the spool is more than fraction full, records at or below level are dropped.
+    How full the spool is, is measured at most every check_interval seconds, counting records appended by this process meanwhile.
+    Counters: spooled, dropped.
+    """
+
+    default_policy = ((0.5, logging.DEBUG), (0.8, logging.INFO), (0.95, logging.WARNING), (1.0, sys.maxsize)) # Everything once full.
+
+    def __init__(self, directory, capacity=256 * 1024 * 1024, drop_policy=default_policy, check_interval=1.0, segment_bytes=8 * 1024 * 1024):
+        logging.Handler.__init__(self)
+        self.directory = directory
+        (self.capacity, self.drop_policy, self.check_interval) = (capacity, sorted(drop_policy), check_interval)
+        self.writer = SpoolWriter(directory, segment_bytes)
+        (self.spooled, self.dropped) = (0, 0)
+        (self.fill, self.next_check) = (0.0, 0.0) # Fraction of capacity used, and when to measure it again.
+
+    def mapLogRecord(self, record):
+        """
+        Same mapping as HTTPHandler: every attribute of the record is sent.
+        """
+        return record.__dict__
+
+    def drop_level(self):
+        """
+        Return the highest level dropped at the current fill, or -1 if none are.
+        """
+        return max([level for (fraction, level) in self.drop_policy if self.fill >= fraction] or [-1])
+
+    def emit(self, record):
+        """
+        Append the url-encoded record to the spool, unless the drop policy applies. Called holding the handler lock.
+        """
+        try:
+            now = time.monotonic()
+            if now >= self.next_check:
+                self.fill = spool_backlog(self.directory)[0] / self.capacity
+                self.next_check = now + self.check_interval
+            if record.levelno <= self.drop_level():
+                self.dropped += 1
+                return
+            line = urllib.parse.urlencode(self.mapLogRecord(record)) + '\n'
+            self.writer.append([line])
+            self.spooled += 1
+            self.fill += len(line) / self.capacity # Until next measured.
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.writer.close()
+        logging.Handler.close(self)
+
+
+class Forwarder():
+    """
+    Drain the spool in directory written by SpoolingHandler, sending records in batches of up to batch_bytes to /api/v1/messages/bulk at host.
+    Only one forwarder drains a spool, holding the lock file in its directory.
+    The position read is committed to the spool checkpoint once the server has responded to each batch, so after a restart
+    forwarding resumes from where it left off. A record is only sent twice if the forwarder stops between sending and committing.
+    Failed sends are retried after a delay doubling from min_delay up to max_delay seconds, with jitter so clients do not all return at once.
+    Records rejected by the server as invalid are not retried.
+    Counters: sent, rejected, errors.
+    """
+
+    def __init__(self, directory, host=host, url=bulk_route, batch_bytes=1024 * 1024, min_delay=0.5, max_delay=60.0, timeout=10.0):
+        self.directory = directory
+        self.reader = SpoolReader(directory) # Resumes from the committed position.
+        self.sender = BulkSender(host, url, timeout)
+        (self.batch_bytes, self.min_delay, self.max_delay) = (batch_bytes, min_delay, max_delay)
+        (self.sent, self.rejected, self.errors) = (0, 0, 0)
+        self.delay = min_delay # Before retrying after a failed send.
+        self.lock_file = None
+
+    def lock(self):
+        """
+        Take the lock of the spool. Returns False if another forwarder holds it.
+        """
+        self.lock_file = open(os.path.join(self.directory, 'forwarder.lock'), mode='w')
+        try: fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.close()
+            return False
+        return True
+
+    def forward(self):
+        """
+        Send the next batch of records and commit the position. Returns the number of records sent, 0 if there were none, None if sending failed.
+        """
+        (records, position) = self.reader.read(self.batch_bytes)
+        if not records:
+            return 0
+        result = self.sender.post([split_record(record)[1].decode().rstrip('\n') for record in records])
+        if result is None:
+            self.errors += 1
+            return None
+        self.reader.commit(position)
+        (self.sent, self.rejected) = (self.sent + result[0], self.rejected + result[1])
+        return len(records)
+
+    def run(self, stop=None, idle_wait=5.0):
+        """
+        Forward records until stop (a threading.Event) is set, or forever. Waits for new records when the spool is drained,
+        and backs off while sending fails.
+        """
+        watcher = get_watcher([self.directory])
+        down = False
+        while not (stop and stop.is_set()):
+            forwarded = self.forward()
+            if forwarded is None: # Server down or busy.
+                if not down:
+                    print('{0:%Y%m%d-%H%M%S} forwarding to {1} failed, retrying'.format(datetime.datetime.now(datetime.timezone.utc), self.sender.host), flush=True)
+                down = True
+                pause = self.delay * random.uniform(0.5, 1.0)
+                self.delay = min(self.delay * 2, self.max_delay)
+                if stop: stop.wait(pause)
+                else: time.sleep(pause)
+                continue
+            if down:
+                print('{0:%Y%m%d-%H%M%S} forwarding to {1} resumed'.format(datetime.datetime.now(datetime.timezone.utc), self.sender.host), flush=True)
+            (down, self.delay) = (False, self.min_delay)
+            if forwarded:
+                watcher.activity()
+            else:
+                watcher.wait(idle_wait if stop is None else min(idle_wait, 0.1))
+        self.sender.close()
+
 # Generate random test messages and send to remote logging server.
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Send random test messages to the remote logging server, or forward a spool to it.')
+    parser.add_argument('--host', default=host, help='Server host:port.')
+    parser.add_argument('--batching', action='store_true', help='Send test messages through BatchingHandler.')
+    parser.add_argument('--spool', help='Send test messages through a SpoolingHandler to the spool in this directory, and start its forwarder.')
+    parser.add_argument('--forward', metavar='DIRECTORY', help='Forward the spool in DIRECTORY until interrupted, instead of sending test messages.')
+    args = parser.parse_args()
+    host = args.host
+
+    if args.forward: # Run as the forwarder process.
+        forwarder = Forwarder(args.forward, host)
+        if not forwarder.lock():
+            sys.exit(0) # Another forwarder is already draining the spool.
+        try: forwarder.run()
+        except KeyboardInterrupt: pass
+        sys.exit(0)
 
     # Prepare 3 test loggers with different facility names to generate messages.
-    loggers = list(get_logger(facility) for facility in ('facility_one', 'facility_two', 'facility_three')) # Generate 3 test loggers.
+    loggers = list(get_logger(facility, batching=args.batching, spool=args.spool, forward=True) for facility in ('facility_one', 'facility_two', 'facility_three')) # Generate 3 test loggers.
     message_limit = 1000 # Log a number of test messages and then quit.
     try:
         messages = ['Something went wrong message.', 'Houston has a problem message.', 'Something else in the red message.']
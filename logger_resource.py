@@ -7,14 +7,63 @@ logger_resource.py:
 Read and respond to GET requests.
 Called by logger_httpd.py.
 
+Counts are taken from the per-minute and per-hour rollups maintained by logger_collector.py (see logger_index.py),
+so only lines in partial minutes at the ends of the time range, and lines appended since the rollup was saved, are read.
+Lines in partial minutes are found through the offset index of the log file, so reading starts at the since position
+and stops soon after until rather than covering the whole file.
+
+Messages are streamed from a pipeline of generators: the lines of each log file in range, found through its offset index,
+put in time order, merged across log files by timestamp, then formatted as NDJSON rows. Only a window of each log file is held in memory.
+Pages are resumed from an opaque cursor, the position of the last row sent.
+
+Count results are held in query_cache, an LRU cache keyed by the filter parameters, along with the size of each log file counted.
+Log files are only appended to, so a repeated query only reads lines appended to each log file since it was last counted.
+
+Path segments holding key=value predicates select lines by msg or extra key values through the postings
+maintained by logger_collector.py, so only the matching lines are read, and counting them reads no log file at all.
+
+Path segments msg~<pattern> and ~<pattern> search msg, or the raw line, by regular expression.
+Searches are fanned out over a pool of processes in chunks of log file, see logger_search.py.
+
+Log files of closed days are read from their archives, decompressing only the blocks holding the lines wanted, see logger_archive.py.
+
+Where the collector keeps column stores (see logger_columns.py), counts are taken from the columns of each day,
+mapped into memory, and only lines appended since the store was saved are read.
+Counts can be broken down by minute or hour with ?histogram=minute|hour.
+
+Log files in range are looked up in log_catalog, an in memory catalog of the log files by day, level and facility,
+listed again only when the log or archive directory changes.
+
+Ranges of values are merged from the per-day catalogs maintained by logger_collector.py, so no log file is read.
+
 Anil Gulati
 01/09/2018
 """
 
 import os
+import re
+import json
+import heapq
+import time
+import base64
+import bisect
+import datetime
+import itertools
+import threading
+import collections
+from urllib.parse import parse_qs, parse_qsl, unquote
+
+import logger_index
+import logger_search
+import logger_archive
+import logger_columns
+import logger_metrics
 
 log_path = '/srv/logger'
 log_directory = os.path.join(log_path, 'logs') # Available logs.
+default_limit = 1000 # Messages returned per page unless a limit is given.
+max_limit = 100000 # Most messages returned per page.
+histogram_widths = { 'minute': 13, 'hour': 11 } # Histogram intervals, by length of the time stamp prefix YYYYMMDD-HHMM naming each.
 
 def split_min(req, sep='/', minvals=4):
     """
@@ -27,63 +76,514 @@ def split_min(req, sep='/', minvals=4):
         minvals -= 1
         yield ''
 
+def count_lines(path, start, stop, ranges, histogram=None, width=13):
+    """
+    Count loglines in the file at path between byte offsets start and stop, with times HHMMSS within any of ranges.
+    ranges is a list of (start_time, stop_time) pairs, inclusive, either of which may be empty for no limit.
+    Lines counted are also counted in histogram, if given, a Counter by the first width characters of their time stamps.
+    Returns (count, end) where end is the offset after the last complete line read.
+    """
+    ranges = [(bytes(start_time, 'ascii'), bytes(stop_time or '999999', 'ascii')) for (start_time, stop_time) in ranges]
+    (count, began) = (0, start)
+    for log_line in logger_index.read_lines(path, start, stop):
+        start += len(log_line)
+        stamp = log_line[9:15] # Time HHMMSS from YYYYMMDD-HHMMSS.uuuuuu-...
+        for (start_time, stop_time) in ranges:
+            if start_time <= stamp <= stop_time:
+                count += 1
+                if histogram is not None: histogram[log_line[:width].decode()] += 1
+                break
+    logger_metrics.count('query_bytes_read_total', start - began)
+    return (count, start)
+
+def count_log(log_name, start_time='', stop_time=''):
+    """
+    Count lines in log file log_name with times HHMMSS from start_time to stop_time inclusive, either of which may be empty.
+    Whole minutes are counted from the rollup, lines in partial minutes and lines appended since the rollup was saved are read.
+    Returns (count, end) where end is the offset after the last complete line counted.
+    """
+    path = os.path.join(log_directory, log_name)
+    size = logger_archive.log_size(path)
+    rollup = logger_index.Rollup.load(log_name)
+    if rollup is None or rollup.size > size: # No rollup yet, or out of date, so count every line.
+        rollup = logger_index.Rollup()
+    (count, edges) = rollup.count(start_time, stop_time)
+    if edges: # Partial minutes within the rollup, read from the offsets where they can be found.
+        offsets = logger_index.OffsetIndex(log_name)
+        for edge in edges:
+            (start, stop) = offsets.range(edge[0], edge[1], rollup)
+            count += count_lines(path, start, stop, [edge])[0]
+        offsets.close()
+    if rollup.size < size: # Lines appended since the rollup was saved.
+        (tail, end) = count_lines(path, rollup.size, size, [(start_time, stop_time)])
+        return (count + tail, end)
+    return (count, rollup.size)
+
+
+def time_window(day, start_time='', stop_time=''):
+    """
+    Return (start, stop) in microseconds since the epoch, inclusive, for times HHMMSS from start_time to stop_time on day,
+    either None if the time is empty. Times compare as strings elsewhere, so a shorter stop_time such as HHMM stops before it.
+    """
+    base = logger_columns.day_base(day)
+    start = start_time and base + logger_index.seconds_of(start_time.ljust(6, '0')) * 1000000 or None
+    stop = stop_time and base + (logger_index.seconds_of(stop_time.ljust(6, '0')) + (len(stop_time) == 6)) * 1000000 - 1 or None
+    return (start, stop)
+
+def log_ranges(log_name, start_time='', stop_time=''):
+    """
+    Return (rollup, ranges) where ranges are the (start, stop) byte offsets of log file log_name holding every line
+    with time HHMMSS from start_time to stop_time inclusive: the range found through the offset index, then lines not yet indexed.
+    """
+    size = logger_archive.log_size(os.path.join(log_directory, log_name))
+    rollup = logger_index.Rollup.load(log_name)
+    if rollup is None or rollup.size > size: # No index, read everything.
+        rollup = logger_index.Rollup()
+    offsets = logger_index.OffsetIndex(log_name)
+    (start, stop) = offsets.range(start_time, stop_time, rollup)
+    offsets.close()
+    return (rollup, [(start, stop), (rollup.size, size)])
+
+def log_lines(log_name, start_time='', stop_time=''):
+    """
+    Generate (stamp, offset, line) for lines in log file log_name with times HHMMSS from start_time to stop_time inclusive,
+    in time order, where stamp is YYYYMMDD-HHMMSS.uuuuuu (bytes).
+    Only the part of the log file covering the range is read, found through the offset index.
+    Lines arriving out of order by up to the lag recorded in the rollup are put back in order through a small heap.
+    """
+    path = os.path.join(log_directory, log_name)
+    (rollup, ranges) = log_ranges(log_name, start_time, stop_time)
+    (low, high) = (bytes(start_time, 'ascii'), bytes(stop_time or '999999', 'ascii'))
+    (heap, read) = ([], 0)
+    try:
+        for (start, stop) in ranges:
+            for (offset, line) in logger_index.iter_lines(path, start, stop):
+                read += len(line)
+                if not low <= line[9:15] <= high: continue
+                heapq.heappush(heap, (line[:22], offset, line))
+                horizon = logger_index.seconds_of(line[9:15]) - rollup.lag # No later line is earlier than this.
+                while logger_index.seconds_of(heap[0][0][9:15]) < horizon:
+                    yield heapq.heappop(heap)
+        while heap:
+            yield heapq.heappop(heap)
+    finally: # Also when a page is complete before the range.
+        logger_metrics.count('query_bytes_read_total', read)
+
+def matched_lines(log_name, matches):
+    """
+    Generate (stamp, offset, line) for the lines of log file log_name at matches, a set of (HHMMSS, offset), in time order.
+    Lines are read a second at a time and put in order within the second.
+    """
+    with logger_archive.open_log(os.path.join(log_directory, log_name)) as infile:
+        for (second, group) in itertools.groupby(sorted(matches), key=lambda match: match[0]):
+            lines = []
+            for (second, offset) in group:
+                infile.seek(offset)
+                line = infile.readline()
+                logger_metrics.count('query_bytes_read_total', len(line))
+                lines.append((line[:22], offset, line))
+            yield from sorted(lines)
+
+def message_row(log_name, line, full=False):
+    """
+    Return the dict for a logline: facility, level, time and msg, plus all recorded name/values if full.
+    """
+    (prefix, rest) = line.decode().rstrip('\n').split(':', 1)
+    (message, content) = rest.rsplit(':', 1) # Content is url-encoded so contains no colons, msg may.
+    row = { 'facility': prefix[26:], 'level': prefix[23:25], 'time': prefix[:22], 'msg': message }
+    if full:
+        row['record'] = dict(parse_qsl(content, keep_blank_values=True))
+    return row
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(bytes(json.dumps(position), 'utf-8')).decode()
+
+def decode_cursor(cursor):
+    """
+    Return the position [stamp, log_name, offset] encoded in cursor by encode_cursor(). Raises ValueError if it is not a cursor.
+    """
+    try: position = json.loads(base64.urlsafe_b64decode(bytes(cursor, 'ascii')).decode())
+    except ValueError: position = None # Not base64, utf-8 or JSON.
+    if not (isinstance(position, list) and len(position) == 3 and all(isinstance(value, str) for value in position[:2])
+            and len(position[0]) == 22 and isinstance(position[2], int)):
+        raise ValueError('cursor must be as returned by the previous page')
+    return position
+
+
+class QueryCache():
+    """
+    LRU cache of query results, each a dict of log file name to (end, result) where end is the offset counted up to.
+    Counts hits (no log file changed), partial hits (only appended lines read) and misses.
+    Shared by all threads in the server process.
+    """
+
+    def __init__(self, capacity=128):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        (self.hits, self.partial, self.misses) = (0, 0, 0)
+
+    def get(self, key):
+        """
+        Return the cached result for key, or an empty dict.
+        """
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return dict()
+            self.entries.move_to_end(key) # Most recently used.
+            return result
+
+    def put(self, key, result, partial=False):
+        """
+        Store result for key, evicting the least recently used result if full. partial counts a hit that read appended lines.
+        """
+        with self.lock:
+            if key in self.entries:
+                if partial: self.partial += 1
+                else: self.hits += 1
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return { 'entries': len(self.entries), 'capacity': self.capacity, 'hits': self.hits, 'partial': self.partial, 'misses': self.misses }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+query_cache = QueryCache() # Count results shared by all queries in this process.
+
+
+class LogCatalog():
+    """
+    In memory catalog of the log files available, open or archived, indexed by day, then level, then facility,
+    so queries look up the log files in range rather than listing and splitting every name in the log directory.
+    The directories are only listed again when the modification time of either has changed since last listed,
+    or was too recent to be sure that no file was added in the same clock tick.
+    Shared by all threads in the server process.
+    """
+
+    racy = 2.0 # Seconds after a directory changes within which its modification time is not trusted.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stamp = None # (directories, modification times) as last listed.
+        (self.days, self.logs) = ([], dict()) # Sorted days, and day to {level: {facility: log_name}} with keys in order.
+
+    def refresh(self):
+        """
+        List the log and archive directories again if either has changed since last listed.
+        """
+        directories = (log_directory, logger_archive.archive_directory)
+        stamp = (directories, tuple(self.mtime(directory) for directory in directories))
+        with self.lock:
+            if stamp == self.stamp:
+                return
+            logs = dict()
+            for log_name in sorted(set(os.listdir(log_directory)) | set(logger_archive.list_archives())): # Once each while moving, in order.
+                (day, level, facility) = log_name.split('-', 2) # Log file name describes it's content.
+                logs.setdefault(day, dict()).setdefault(level, dict())[facility] = log_name
+            (self.days, self.logs) = (sorted(logs), logs)
+            recent = time.time() - self.racy
+            self.stamp = stamp if all(mtime < recent for mtime in stamp[1]) else None # Otherwise list again next time.
+
+    @staticmethod
+    def mtime(directory):
+        try: return os.stat(directory).st_mtime
+        except FileNotFoundError: return 0
+
+    def select(self, since='', until='', start_level='', stop_level='', facilities=()):
+        """
+        Generate (log_name, day, level, facility) in order for each log file from day since to until, levels start_level to stop_level
+        and any of facilities, where an empty value is no limit.
+        """
+        self.refresh()
+        with self.lock:
+            (days, logs) = (self.days, self.logs)
+        for day in days[bisect.bisect_left(days, since) if since else 0:bisect.bisect_right(days, until) if until else len(days)]:
+            levels = logs[day]
+            for level in levels:
+                if start_level and level < start_level: continue # Filter out unselected levels.
+                if stop_level and level > stop_level: break # /LL/ should be the same as /LL-LL/.
+                names = levels[level]
+                for facility in (sorted(set(facilities)) if facilities else names): # Any number of facility names can be included.
+                    if facility not in names: continue
+                    yield (names[facility], day, level, facility)
+
+    def clear(self):
+        with self.lock:
+            self.stamp = None
+
+log_catalog = LogCatalog() # Log files available to all queries in this process.
+
 
 class GetFilter():
     """
     Respond to GET requests to return messages, counts and ranges of values available.
-    Only counts implemented so far.
     When creating new instance supply url /api/v1/<resource>/<since>/<until>/<levels>/<facility_name>/<facility_name>/...
     Where <since> and <until> are date/times of the form "YYYYMMDD-HHMMSS".
     Where <levels> are expressed as double digit numbers either an individual level "LL" or a range "LL-MM".
     Values omitted are taken to mean "including all".
     E.g. '/api/v1/counts/20171205-130000/20171205-135959/30-40/facility_one'
+    Segments holding '=' are predicates key=value (url-encoded) on msg or an extra key, which must all be met,
+    each segment may give alternatives separated by '|', any of which meets it.
+    E.g. '/api/v1/messages/20171204/20171210/40-50/userid=xyz/msg=Disk%20full|msg=Disk%20error'
+    Segments msg~<pattern> and ~<pattern> are searches by regular expression (url-encoded) on msg or the raw line, which must all match.
+    E.g. '/api/v1/counts/20171101/20171130//msg~timed%20out%20after%20%5Cd%2Bs'
+    URL parameters only control paging of messages: ?limit=<rows>&mode=<summary|full>&cursor=<cursor>,
+    and histograms of counts: ?histogram=<minute|hour>.
 
     TODO: Strip superfluous empty strings in facilities list generated from trailing slash in URL.
-    TODO: GET Ranges.
-    TODO: GET Messages.
     """
 
     def __init__(self, url='/api/v1/counts'):
         """
         Break down URL into component parameters and assign to useful class attributes.
         """
+        (url, mark, query) = url.partition('?') # URL parameters are kept apart from the filter.
+        self.options = dict((name, values[0]) for (name, values) in parse_qs(query).items()) # Paging options.
         url = url[8:] # Chop of invariant URL leader '/api/v1/'. URL now starts at resource.
         (self.resource, since, until, levels, *facilities) = split_min(url, sep='/', minvals=4) # Split out the URL.
         (self.since, self.start_time) = split_min(since, sep='-', minvals=2) # Split start day and time.
         (self.until, self.stop_time) = split_min(until, sep='-', minvals=2) # Split out end day and time.
         (self.start_level, self.stop_level) = split_min(levels, sep='-', minvals=2) # Look for range of levels.
-        self.facilities = facilities # Assigning to *facilities forces facilities to a list.
+        self.searches = [(field, unquote(pattern)) for (field, mark, pattern) in (segment.partition('~') for segment in facilities)
+                         if mark and field in ('msg', '')] # (field, pattern) where field is 'msg' or '' for the raw line.
+        facilities = [segment for segment in facilities if not segment.startswith(('~', 'msg~'))]
+        for (field, pattern) in self.searches: # Fail before searching.
+            try: re.compile(pattern)
+            except re.error as e: raise ValueError('Bad pattern {0!r} ({1})'.format(pattern, e))
+        self.facilities = [facility for facility in facilities if '=' not in facility] # Assigning to *facilities forces facilities to a list.
+        self.predicates = [[self.posting_term(alternative) for alternative in segment.split('|')]
+                           for segment in facilities if '=' in segment] # Posting terms, any of each list and all lists.
+
+    @staticmethod
+    def posting_term(alternative):
+        """
+        Return the posting term for one alternative key=value (url-encoded) of a predicate. Raises ValueError if it is not one.
+        """
+        (key, mark, value) = alternative.partition('=')
+        if not (key and mark):
+            raise ValueError('Bad predicate {0!r} (Each alternative must be key=value)'.format(unquote(alternative)))
+        return logger_index.posting_term(unquote(key), unquote(value))
 
     def get_counts(self):
         """
-        Read all logs matching the filter and count matching lines.
+        Count lines in all logs matching the filter, from their rollups where possible.
         Uses self.since, self.start_time, self.until, self.stop_time,
         self.start_level, self.stop_level, self.facilities.
+        With predicates, lines are counted from postings instead, and with searches lines are searched, neither is cached.
+        Otherwise lines are counted from column stores where they exist.
+        With option histogram, counts['histogram'] also counts lines by minute or hour, {'YYYYMMDD-HHMM': n}.
         """
         self.counts = { 'all':0 } # Initialise counts.
-        message_count = 0 # Count matching lines / messages.
-        log_list = os.listdir(log_directory) # List of log file names.
-        for log_name in log_list: # Check each log file for inclusion.
-            (day, level, facility) = log_name.split('-') # Log file name describes it's content.
-            if self.since and day < self.since: continue # If self.since defined, do not include earlier messages.
-            if self.until and day > self.until: break # If self.until not defined, include all messages.
-            if self.start_level and level < self.start_level: continue # Filter out unselected levels.
-            if self.stop_level and level > self.stop_level: continue # /LL/ should be the same as /LL-LL/.
-            if self.facilities and facility not in self.facilities: continue # Any number of facility names can be included.
-            start_time = day == self.since and self.start_time or '' # Start time only applies on the first day in the range.
-            stop_time = day == self.until and self.stop_time or '' # End time only applies on the last day in the range.
+        key = ('counts', self.since, self.start_time, self.until, self.stop_time, self.start_level, self.stop_level, tuple(sorted(set(self.facilities))))
+        histogram = self.options.get('histogram')
+        if histogram and histogram not in histogram_widths:
+            raise ValueError('Unknown histogram interval ' + histogram)
+        filtered = self.predicates or self.searches
+        cached = query_cache.get(key) if not (filtered or histogram) else dict() # Counts per log file from the last time this query was made.
+        (result, partial, stores) = (dict(), False, dict())
+        lines = collections.Counter() if histogram and not filtered else None # Histogram of lines counted.
+        logs = list(self.select_logs())
+        matches = self.match_lines(logs) if self.predicates else None
+        if self.searches:
+            matches = self.search_lines(logs, matches, count_only=True)
+        for (log_name, day, level, facility, start_time, stop_time) in logs:
             self.counts.setdefault(day, 0) # Initialise breakdown counts.
             self.counts.setdefault(level, 0) # Day, level and facility do not vary within each file.
             self.counts.setdefault(facility, 0)
-            with open(os.path.join(log_directory, log_name), mode='r') as log_file:
-                for log_line in log_file: # Check every line in every selected log file.
-                    stamp = log_line.split('.')[0].split('-')[1]
-                    if start_time and stamp < start_time: continue
-                    if stop_time and stamp > stop_time: continue
-                    self.counts['all'] += 1 # Count all lines meeting the filter criteria.
-                    self.counts[day] += 1 # Count lines by day.
-                    self.counts[level] += 1 # Count lines by level.
-                    self.counts[facility] += 1 # Count lines by facility.
+            (end, count) = cached.get(log_name, (0, 0))
+            size = logger_archive.log_size(os.path.join(log_directory, log_name))
+            column = not filtered and self.column_count(stores, log_name, start_time, stop_time, histogram, lines)
+            if self.searches: # Lines matching the searches.
+                count = matches[log_name]
+            elif self.predicates: # Lines meeting the predicates, as posted.
+                count = len(matches.get(log_name, ()))
+            elif column: # Lines stored in columns, then lines appended since.
+                (count, covered) = column
+                (appended, end) = count_lines(os.path.join(log_directory, log_name), covered, size, [(start_time, stop_time)], lines, histogram_widths.get(histogram))
+                count += appended
+            elif histogram: # Every line in range is read.
+                (count, end) = (0, 0)
+                for (start, stop) in log_ranges(log_name, start_time, stop_time)[1]:
+                    (count, end) = (count + count_lines(os.path.join(log_directory, log_name), start, stop, [(start_time, stop_time)], lines, histogram_widths[histogram])[0], stop)
+            elif end > size or not end: # Not counted before, or log file truncated since.
+                (count, end) = count_log(log_name, start_time, stop_time) # Count lines meeting the filter criteria, mostly from rollups.
+            elif end < size: # Only count lines appended since.
+                (appended, end) = count_lines(os.path.join(log_directory, log_name), end, size, [(start_time, stop_time)])
+                (count, partial) = (count + appended, True)
+            result[log_name] = (end, count)
+            self.counts['all'] += count # Count all lines meeting the filter criteria.
+            self.counts[day] += count # Count lines by day.
+            self.counts[level] += count # Count lines by level.
+            self.counts[facility] += count # Count lines by facility.
+        if lines is not None:
+            self.counts['histogram'] = dict(sorted(lines.items()))
+        if not (filtered or histogram):
+            query_cache.put(key, result, partial)
+
+    def column_count(self, stores, log_name, start_time, stop_time, histogram, lines):
+        """
+        Return (count, covered) for lines of log file log_name with times from start_time to stop_time, from its column store,
+        where covered is the length of the log file stored, or None if the store holds none of it.
+        Lines counted are added to lines by histogram interval if histogram is given.
+        Each store is read once for each time range, the counts kept in stores.
+        """
+        name = logger_index.catalog_name(log_name)
+        if (name, start_time, stop_time) not in stores:
+            store = logger_columns.ColumnStore(name)
+            (start, stop) = time_window(log_name[:8], start_time, stop_time)
+            bucket = { 'minute': 60000000, 'hour': 3600000000 }.get(histogram)
+            rows = dict() # (level, facility) to Counter by histogram interval, or {None: n}.
+            for ((level, facility, *interval), count) in store.count(start, stop, bucket).items():
+                interval = interval and '{0:%Y%m%d-%H%M}'.format(datetime.datetime.utcfromtimestamp(interval[0] * bucket / 1000000))[:histogram_widths[histogram]] or None
+                rows.setdefault((level, facility), collections.Counter())[interval] += count
+            stores[(name, start_time, stop_time)] = (store, rows)
+        (store, rows) = stores[(name, start_time, stop_time)]
+        covered = store.size(log_name)
+        if not covered:
+            return None
+        counts = rows.get((int(log_name[9:11]), log_name[12:]), collections.Counter())
+        if histogram: lines.update(counts)
+        return (sum(counts.values()), covered)
+
+    def search_lines(self, logs, matches=None, count_only=False):
+        """
+        Search the lines of logs, as generated by select_logs(), with self.searches.
+        Only lines in matches are searched if given, as returned by match_lines(), otherwise every line in range
+        is searched through the search pool.
+        Returns a Counter of lines matching by log file name if count_only,
+        otherwise a list of streams each generating (stamp, log_name, offset, line) in timestamp order.
+        """
+        regexes = [(field, re.compile(pattern.encode())) for (field, pattern) in self.searches]
+        if matches is not None: # Few lines, searched here.
+            streams = [((stamp, log_name, offset, line) for (stamp, offset, line) in matched_lines(log_name, lines) if logger_search.matched(line, regexes))
+                       for (log_name, lines) in matches.items()]
+            if not count_only: return streams
+            return collections.Counter(log_name for stream in streams for (stamp, log_name, offset, line) in stream)
+        days = dict() # Day to [(log_name, task)].
+        for (log_name, day, level, facility, start_time, stop_time) in logs:
+            path = os.path.join(log_directory, log_name)
+            for (start, stop) in log_ranges(log_name, start_time, stop_time)[1]:
+                for task in logger_search.chunk_tasks(path, start, stop, self.searches, start_time, stop_time, count_only):
+                    days.setdefault(day, []).append((log_name, task))
+        if count_only:
+            return logger_search.count([task for day in days.values() for task in day])
+        return [logger_search.lines([days[day] for day in sorted(days)])]
+
+    def match_lines(self, logs):
+        """
+        Return {log_name: set of (HHMMSS, offset)} for the lines of logs, as generated by select_logs(), meeting every predicate.
+        Postings for each term are read once per day and partition, then intersected, so no log file is read.
+        """
+        names = dict() # Catalog name to {'LL-facility': (log_name, start_time, stop_time)}.
+        for (log_name, day, level, facility, start_time, stop_time) in logs:
+            names.setdefault(logger_index.catalog_name(log_name), dict())[log_name[9:]] = (log_name, start_time, stop_time)
+        matches = dict()
+        for (name, entries) in names.items():
+            found = None
+            for alternatives in self.predicates:
+                postings = set().union(*(logger_index.read_postings(name, term) for term in alternatives))
+                found = postings if found is None else found & postings
+                if not found: break # No line meets every predicate.
+            for (entry, stamp, offset) in found or ():
+                if entry not in entries: continue # Log file not selected.
+                (log_name, start_time, stop_time) = entries[entry]
+                if start_time and stamp < start_time or stop_time and stamp > stop_time: continue
+                matches.setdefault(log_name, set()).add((stamp, offset))
+        return matches
+
+    def select_logs(self, since=None, start_time=None):
+        """
+        Generate (log_name, day, level, facility, start_time, stop_time) for each log file matching the filter,
+        with the range of times HHMMSS to include from that log file.
+        since and start_time override self.since and self.start_time, as when resuming from a cursor.
+        """
+        if since is None:
+            (since, start_time) = (self.since, self.start_time)
+        for (log_name, day, level, facility) in log_catalog.select(since, self.until, self.start_level, self.stop_level, self.facilities):
+            yield (log_name, day, level, facility,
+                day == since and start_time or '', # Start time only applies on the first day in the range.
+                day == self.until and self.stop_time or '') # End time only applies on the last day in the range.
+
+    def get_ranges(self):
+        """
+        Return the distinct values found in all logs matching the filter, with occurrence counts, merged from catalogs:
+        { 'levels': {LL: n}, 'facilities': {facility: n}, 'msg': {msg: n}, 'keys': {key: {value: n}}, 'capped': {key: n} }
+        Keys in capped had too many distinct values to catalog, only their occurrences are counted.
+        Catalogs cover whole days so times within since and until are ignored.
+        """
+        ranges = { 'levels': {}, 'facilities': {}, 'msg': {}, 'keys': {}, 'capped': {} }
+        catalogs = dict() # Catalog name to Catalog, each loaded once.
+        for (log_name, day, level, facility, start_time, stop_time) in self.select_logs():
+            name = logger_index.catalog_name(log_name)
+            catalog = catalogs.get(name) or catalogs.setdefault(name, logger_index.Catalog.load(name))
+            entry = catalog.entries.get(log_name[9:])
+            if entry is None: continue # Not yet catalogued.
+            ranges['levels'][level] = ranges['levels'].get(level, 0) + entry['count']
+            ranges['facilities'][facility] = ranges['facilities'].get(facility, 0) + entry['count']
+            for (message, count) in entry['msg'].items():
+                ranges['msg'][message] = ranges['msg'].get(message, 0) + count
+            for (key, values) in entry['keys'].items():
+                merged = ranges['keys'].setdefault(key, {})
+                for (value, count) in values.items():
+                    merged[value] = merged.get(value, 0) + count
+            for (key, count) in entry['capped'].items():
+                ranges['capped'][key] = ranges['capped'].get(key, 0) + count
+        for key in ranges['capped']: # Capped in any log file, values from other log files would be incomplete.
+            values = ranges['msg'] if key == 'msg' else ranges['keys'].pop(key, {})
+            ranges['capped'][key] += sum(values.values())
+            if key == 'msg': ranges['msg'] = {}
+        return ranges
+
+    def get_messages(self):
+        """
+        Generate NDJSON rows (bytes lines) for messages in all logs matching the filter, in timestamp order.
+        Rows are merged from each log file as they are read, so the whole result is never held in memory.
+        Options: limit rows per page (default_limit, from 1 to max_limit), mode 'summary' (facility, level, time, msg) or 'full' (also all name/values),
+        cursor from the previous page. The last row is {"cursor": <cursor>} if there are more rows, otherwise {"cursor": null}.
+        Options are checked before any row is generated, raising ValueError, so a bad request is refused before the response starts.
+        """
+        try: limit = max(1, min(int(self.options.get('limit', default_limit)), max_limit))
+        except ValueError: raise ValueError('limit must be a whole number of rows')
+        full = self.options.get('mode', 'summary') == 'full'
+        after = self.options.get('cursor') and tuple(decode_cursor(self.options['cursor'])) or None # (stamp, log_name, offset)
+        return self.message_rows(limit, full, after)
+
+    def message_rows(self, limit, full, after=None):
+        """
+        Generate the rows of get_messages(), at most limit rows of messages after position after if given.
+        """
+        (since, start_time) = (None, None)
+        if after: # Resume after the last row sent, from its day and second.
+            (since, start_time) = (after[0][:8], after[0][9:15])
+            if self.since > since: (since, start_time) = (self.since, self.start_time)
+            elif self.since == since: start_time = max(start_time, self.start_time)
+        logs = list(self.select_logs(since, start_time))
+        if self.searches: # Lines meeting any predicates, then matching the searches.
+            streams = self.search_lines(logs, self.match_lines(logs) if self.predicates else None)
+        elif self.predicates: # Only lines meeting the predicates are read.
+            matches = self.match_lines(logs)
+            streams = [((stamp, log_name, offset, line) for (stamp, offset, line) in matched_lines(log_name, lines)) for (log_name, lines) in matches.items()]
+        else:
+            streams = [((stamp, log_name, offset, line) for (stamp, offset, line) in log_lines(log_name, start, stop))
+                       for (log_name, day, level, facility, start, stop) in logs]
+        rows = 0
+        for (stamp, log_name, offset, line) in heapq.merge(*streams):
+            position = [stamp.decode(), log_name, offset]
+            if after and tuple(position) <= after: continue # Already sent on an earlier page.
+            if rows == limit: # More rows remain.
+                yield bytes(json.dumps({ 'cursor': encode_cursor(last) }) + '\n', 'utf-8')
+                return
+            yield bytes(json.dumps(message_row(log_name, line, full)) + '\n', 'utf-8')
+            (rows, last) = (rows + 1, position)
+        yield b'{"cursor": null}\n'
 
 
 if __name__ == '__main__': # Just for testing.
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# Python 3.6.3
+# logger_search.py
+
+"""
+logger_search.py:
+Parallel regular expression and substring search of log files, used by logger_resource.py for counts and messages.
+
+The byte ranges of the log files to search are cut into chunks of chunk_bytes, aligned to lines by the worker reading each,
+and fanned out over a pool of search_workers processes, so a long search uses every core.
+Each worker reads its chunk through mmap, or decompresses just the blocks holding it from an archive. Where the patterns require a literal string, the worker finds each occurrence
+of the literal with a plain substring scan and only runs the regular expressions over the lines holding it.
+A pattern with no special characters is just a substring search.
+
+Patterns apply either to the msg of each line or to the raw line as stored, with its url-encoded content.
+Results from chunks are merged by logger_resource.py: counts are summed, lines are merged in timestamp order a day at a time,
+keeping only a bounded number of chunks in progress so a page of messages stops the search early.
+
+The pool is started in each server process on its first search.
+
+Anil Gulati
+01/09/2018
+"""
+
+import re
+import mmap
+import heapq
+import threading
+import collections
+import multiprocessing
+
+import logger_archive
+import logger_metrics
+
+chunk_bytes = 16 * 1024 * 1024 # Bytes of log file searched by each task.
+search_workers = multiprocessing.cpu_count() # Processes in the search pool.
+special = frozenset('.^$*+?{}[]\\|()') # Characters with meaning in a regular expression.
+
+pool = None # Search pool of this process, started by get_pool().
+pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Return the search pool of this process, starting it if needed.
+    """
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = multiprocessing.Pool(search_workers)
+        return pool
+
+def required_literal(pattern):
+    """
+    Return the longest literal string (str) that any match of regular expression pattern must contain, or ''.
+    Conservative: only runs of ordinary characters outside any group, class or alternation are considered.
+    """
+    if '|' in pattern or pattern.startswith('(?'): # Alternatives or flags, no literal is certain.
+        return ''
+    (runs, run, depth, index) = ([], '', 0, 0)
+    while index < len(pattern):
+        char = pattern[index]
+        if char in '?*{' and run: # Last character is optional.
+            run = run[:-1]
+        if char not in special:
+            if depth == 0: run += char
+            index += 1
+            continue
+        (runs, run) = (runs + [run], '')
+        if char == '\\': # Skip the escaped character.
+            index += 1
+        elif char in '[{': # Skip the class or repeat count.
+            close = ']' if char == '[' else '}'
+            index += 1
+            if char == '[' and pattern[index:index + 1] == '^': index += 1
+            if char == '[' and pattern[index:index + 1] == ']': index += 1 # Leading ] is part of the class.
+            while index < len(pattern) and pattern[index] != close:
+                if pattern[index] == '\\': index += 1
+                index += 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        index += 1
+    return max(runs + [run], key=len)
+
+def chunk_tasks(path, start, stop, searches, start_time='', stop_time='', count_only=False):
+    """
+    Return the tasks for search_chunk() covering lines starting between byte offsets start and stop of the log file at path.
+    searches is a list of (field, pattern), field 'msg' or '' for the raw line, all of which must match.
+    """
+    return [(path, offset, min(offset + chunk_bytes, stop), searches, start_time, stop_time, count_only) for offset in range(start, stop, chunk_bytes)]
+
+def search_chunk(task):
+    """
+    Search the lines starting between byte offsets start and stop of the log file at path, with times HHMMSS from start_time
+    to stop_time inclusive, either of which may be empty. Run in a pool process.
+    Returns the number of lines matching if count_only, otherwise a sorted list of (stamp, offset, line) for the lines matching.
+    """
+    (path, start, stop, searches, start_time, stop_time, count_only) = task
+    regexes = [(field, re.compile(pattern.encode())) for (field, pattern) in searches]
+    literal = max((required_literal(pattern) for (field, pattern) in searches), key=len).encode()
+    (low, high) = (start_time.encode(), (stop_time or '999999').encode())
+    try:
+        with open(path, mode='rb') as infile:
+            with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                matches = search_data(data, 0, start, stop, regexes, literal, low, high)
+    except FileNotFoundError: # Archived, only the blocks holding the chunk are decompressed.
+        with logger_archive.open_log(path) as archive:
+            base = archive.seek(max(start - 1, 0))
+            data = archive.read(stop - base) + archive.readline() # Up to the end of the line running past stop.
+        matches = search_data(data, base, start, stop, regexes, literal, low, high)
+    return len(matches) if count_only else sorted(matches)
+
+def search_data(data, base, start, stop, regexes, literal, low, high):
+    """
+    Return (stamp, offset, line) for lines of data (bytes or mmap) matching, where data begins at byte offset base of its log file.
+    """
+    matches = []
+    position = data.find(b'\n', start - 1 - base) + 1 if start else 0 # First line starting at or after start.
+    end = data.find(b'\n', stop - 1 - base) + 1 or data.rfind(b'\n', 0, stop - base) + 1 # After the last complete line starting before stop.
+    if start and not position: # Within a partial last line.
+        position = end
+    while position < end:
+        if literal: # Skip to the next line holding the literal.
+            found = data.find(literal, position, end)
+            if found < 0: break
+            position = data.rfind(b'\n', position, found) + 1 or position
+        line_end = data.find(b'\n', position, end) + 1
+        line = data[position:line_end]
+        if low <= line[9:15] <= high and matched(line, regexes):
+            matches.append((line[:22], base + position, line))
+        position = line_end
+    return matches
+
+def matched(line, regexes):
+    """
+    True if every regular expression in regexes, a list of (field, compiled pattern), matches its field of line (bytes logline).
+    """
+    for (field, regex) in regexes:
+        if field == 'msg': # Between the first colon after the prefix and the last colon, as content is url-encoded.
+            text = line[line.index(b':', 26) + 1:line.rindex(b':')]
+        else:
+            text = line[:-1]
+        if not regex.search(text):
+            return False
+    return True
+
+def count(tasks):
+    """
+    Return a Counter of lines matching by log file name, for tasks a list of (log_name, task) with tasks from chunk_tasks(..., count_only=True).
+    All tasks are handed to the pool together, so many small log files are searched in parallel as well as large ones.
+    """
+    logger_metrics.count('query_bytes_searched_total', sum(task[2] - task[1] for (log_name, task) in tasks))
+    if len(tasks) < 2: # Not worth handing to the pool.
+        counts = [search_chunk(task) for (log_name, task) in tasks]
+    else:
+        counts = get_pool().map(search_chunk, [task for (log_name, task) in tasks])
+    result = collections.Counter()
+    for ((log_name, task), lines) in zip(tasks, counts):
+        result[log_name] += lines
+    return result
+
+def lines(days):
+    """
+    Generate (stamp, log_name, offset, line) for lines matching, in timestamp order.
+    days is a list of lists of (log_name, task), one list for each day in order, as the days of log files do not overlap.
+    At most twice search_workers tasks are in progress ahead of the lines being generated.
+    """
+    tasks = collections.deque((index, log_name, task) for (index, day) in enumerate(days) for (log_name, task) in day)
+    pending = collections.deque() # (day index, log_name, AsyncResult) in order submitted.
+    def submit():
+        while tasks and len(pending) < 2 * search_workers:
+            (day, log_name, task) = tasks.popleft()
+            logger_metrics.count('query_bytes_searched_total', task[2] - task[1])
+            pending.append((day, log_name, get_pool().apply_async(search_chunk, (task,))))
+    for index in range(len(days)):
+        results = []
+        submit()
+        while pending and pending[0][0] == index:
+            (day, log_name, result) = pending.popleft()
+            results.append([(stamp, log_name, offset, line) for (stamp, offset, line) in result.get()])
+            submit()
+        yield from heapq.merge(*results)
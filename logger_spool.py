@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# Python 3.6.3
+# logger_spool.py
+
+"""
+logger_spool.py:
+Segmented append-only spool carrying messages from logger_httpd.py to logger_collector.py.
+Replaces the primary cache of one file per message.
+
+The spool is divided into spool_partitions partitions by hash of facility name, so each can be collected by a separate process
+while every log file, being named by facility, is only ever written by the one process collecting its partition.
+Each partition is a directory of segment files /srv/logger/spool/PP/NNNNNNNNNNNN.seg, numbered in order.
+logger_httpd.py appends records to the latest segment, each batch of records with a single write.
+A new segment is started when the latest reaches segment_bytes.
+Each record is one line: the receipt time as epoch seconds, a space, then the logline exactly as it will be stored in the log file.
+logger_collector.py reads records from the committed position in the checkpoint file, appends them to the log files,
+then commits the new position. Segments are removed once they have been read completely and a later segment exists.
+A record not of this form, such as the tail of a logline split by a newline before newlines were escaped, can not be collected
+and is moved to the file quarantine in the spool directory instead.
+
+The number of partitions must not be changed while any partition still holds messages.
+Appends from separate processes are safe as every write is a single O_APPEND write.
+Writers move to the newest segment before writing to a full segment, and re-append records
+in the rare case their segment was removed while they were writing to it.
+
+Anil Gulati
+01/09/2018
+"""
+
+import os
+import re
+import zlib
+import json
+import time
+import threading
+
+log_path = '/srv/logger'
+spool_directory = os.path.join(log_path, 'spool') # Segment files, checkpoint and journal.
+segment_bytes = 64 * 1024 * 1024 # Segment size at which writers start a new segment.
+segment_grace = 1.0 # Seconds a finished segment must be unmodified before it is removed.
+spool_partitions = 8 # Partitions by facility, the most collector processes that can share the work.
+record_pattern = re.compile(rb'\d+\.\d+ \d{8}-\d{6}\.\d{6}-\d\d-[\w.]+:') # Receipt time then YYYYMMDD-HHMMSS.uuuuuu-LL-facility:
+
+def partition_of(logline):
+    """
+    Return the partition for a logline (str) starting YYYYMMDD-HHMMSS.uuuuuu-LL-facility:, by hash of the facility name.
+    """
+    return facility_partition(logline[26:logline.index(':', 26)])
+
+def facility_partition(facility):
+    """
+    Return the partition for facility name facility.
+    """
+    return zlib.crc32(facility.encode()) % spool_partitions
+
+def partition_directory(partition, directory=spool_directory):
+    """
+    Return the directory holding the segments of partition number partition.
+    """
+    return os.path.join(directory, '{0:02d}'.format(partition))
+
+def segment_name(segment):
+    """
+    Return the file name for segment number segment.
+    """
+    return '{0:012d}.seg'.format(segment)
+
+def list_segments(directory):
+    """
+    Return the sorted list of segment numbers present in directory.
+    """
+    try: return sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith('.seg'))
+    except FileNotFoundError: return []
+
+def spool_backlog(directory):
+    """
+    Return (bytes, received) for the records of the spool directory not yet committed by its reader,
+    where received is the receipt time of the oldest of them, or None if there are none.
+    """
+    try:
+        with open(os.path.join(directory, 'checkpoint'), mode='r') as checkpoint:
+            (segment, offset) = json.load(checkpoint)['position']
+    except (FileNotFoundError, ValueError): # Nothing committed yet, or replaced while being read.
+        (segment, offset) = (0, 0)
+    (waiting, received) = (0, None)
+    for number in list_segments(directory):
+        if number < segment: continue
+        start = offset if number == segment else 0
+        try:
+            with open(os.path.join(directory, segment_name(number)), mode='rb') as segment_file:
+                waiting += max(0, os.fstat(segment_file.fileno()).st_size - start)
+                if received is None:
+                    segment_file.seek(start)
+                    record = segment_file.readline()
+                    if record.endswith(b'\n'):
+                        received = split_record(record)[0]
+        except FileNotFoundError: # Consumed meanwhile.
+            continue
+    return (waiting, received)
+
+def valid_record(record):
+    """
+    True if record (bytes line) is a receipt time and a logline that can be collected.
+    """
+    return bool(record_pattern.match(record))
+
+def split_record(record):
+    """
+    Split a spool record (bytes line) into (receipt time, logline).
+    """
+    (received, logline) = record.split(b' ', 1)
+    return (float(received), logline)
+
+
+class SpoolWriter():
+    """
+    Append records to the latest segment in the spool directory. One writer is shared by all threads in a process.
+    Nothing is opened until the first append, so a writer can be created before forking.
+    """
+
+    def __init__(self, directory=spool_directory, segment_bytes=segment_bytes):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock() # Serialises writes and segment changes between threads.
+        (self.fd, self.segment) = (None, None)
+
+    def append(self, loglines):
+        """
+        Append loglines (str, each with trailing newline) as spool records, all stamped with the current time, in a single write.
+        """
+        received = '{0:.6f} '.format(time.time())
+        data = ''.join(received + logline for logline in loglines).encode()
+        with self.lock:
+            if self.fd is None or os.fstat(self.fd).st_size >= self.segment_bytes: # Another process may have filled this segment.
+                self.rotate()
+            self.write(data)
+            status = os.fstat(self.fd)
+            if status.st_nlink == 0: # Segment was consumed and removed during the write, records would be lost.
+                self.open_latest()
+                self.write(data)
+            elif status.st_size >= self.segment_bytes:
+                self.rotate()
+
+    def write(self, data):
+        if os.write(self.fd, data) != len(data): # Partial writes only happen when the disk is full.
+            raise OSError('Short write to spool segment ' + segment_name(self.segment))
+
+    def rotate(self):
+        """
+        Start the segment after the current one, unless another process already has, and move to the newest segment.
+        """
+        if self.fd is not None:
+            try: os.close(os.open(os.path.join(self.directory, segment_name(self.segment + 1)), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+            except FileExistsError: pass
+        self.open_latest()
+
+    def open_latest(self):
+        """
+        Open the newest segment for appending, creating the first segment in an empty spool.
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+        os.makedirs(self.directory, exist_ok=True)
+        segments = list_segments(self.directory)
+        self.segment = segments and segments[-1] or 1
+        self.fd = os.open(os.path.join(self.directory, segment_name(self.segment)), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+            (self.fd, self.segment) = (None, None)
+
+
+class PartitionedSpoolWriter():
+    """
+    Append records to the partitions of the spool, each logline to the partition for its facility.
+    Each partition receives a single write per append.
+    """
+
+    def __init__(self, directory=spool_directory, segment_bytes=segment_bytes):
+        self.writers = [SpoolWriter(partition_directory(partition, directory), segment_bytes) for partition in range(spool_partitions)]
+
+    def append(self, loglines):
+        """
+        Append loglines (str, each with trailing newline) as spool records to their partitions.
+        """
+        partitioned = dict()
+        for logline in loglines:
+            partitioned.setdefault(partition_of(logline), []).append(logline)
+        for (partition, partition_lines) in partitioned.items():
+            self.writers[partition].append(partition_lines)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+
+class SpoolReader():
+    """
+    Read records from the spool directory from the committed position onwards. Only one reader may consume a spool directory.
+    The position is (segment, offset) and is persisted in the checkpoint file by commit().
+    A journal file can record what a consumer is about to do with records read, so work interrupted by a crash can be undone,
+    see begin() and pending().
+    """
+
+    def __init__(self, directory=spool_directory):
+        self.directory = directory
+        self.checkpoint_path = os.path.join(directory, 'checkpoint')
+        self.journal_path = os.path.join(directory, 'journal')
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self.checkpoint_path, mode='r') as checkpoint:
+                self.position = tuple(json.load(checkpoint)['position'])
+        except FileNotFoundError: # Starting a new spool.
+            self.position = (0, 0)
+
+    def read(self, max_bytes=4 * 1024 * 1024):
+        """
+        Return (records, position) for up to max_bytes of complete records after the committed position,
+        where position is where reading should continue after these records are committed.
+        Moves past, and removes, finished segments. Returns an empty list if no new records have been written.
+        """
+        (segment, offset) = self.position
+        while True:
+            segments = [number for number in list_segments(self.directory) if number >= segment]
+            if not segments: # Nothing written yet.
+                return ([], (segment, offset))
+            if segments[0] != segment: # Committed segment removed, continue from the start of the next.
+                (segment, offset) = (segments[0], 0)
+            path = os.path.join(self.directory, segment_name(segment))
+            with open(path, mode='rb') as segment_file:
+                segment_file.seek(offset)
+                data = segment_file.read(max_bytes)
+            end = data.rfind(b'\n') + 1 # Only complete records, a writer may be part way through.
+            if not end and len(data) == max_bytes: # Single record larger than max_bytes.
+                max_bytes *= 2
+                continue
+            if end:
+                return ([record + b'\n' for record in data[:end - 1].split(b'\n')], (segment, offset + end))
+            if len(segments) == 1 or not self.finished(path, offset): # Latest segment or may still be written.
+                return ([], (segment, offset))
+            self.position = (segment, offset) = (segments[1], 0) # Finished segment, nothing more to read in it.
+            os.remove(path)
+
+    def finished(self, path, offset):
+        """
+        True if the segment at path has been read to the end and not written to for segment_grace seconds.
+        """
+        status = os.stat(path)
+        return status.st_size <= offset and time.time() - status.st_mtime > segment_grace
+
+    def pending(self):
+        """
+        Return the state recorded by begin() for work that was never committed, or None.
+        """
+        try:
+            with open(self.journal_path, mode='r') as journal:
+                return json.load(journal)['state']
+        except FileNotFoundError:
+            return None
+
+    def begin(self, state):
+        """
+        Record state (a JSON serialisable object) describing work about to be done with records read, before doing it.
+        """
+        self.save(self.journal_path, { 'position': self.position, 'state': state })
+
+    def commit(self, position):
+        """
+        Persist position as the committed read position and clear the journal.
+        """
+        self.save(self.checkpoint_path, { 'position': position })
+        self.position = tuple(position)
+        try: os.remove(self.journal_path)
+        except FileNotFoundError: pass
+
+    def rollback(self):
+        """
+        Abandon work recorded in the journal, reading continues from the committed position.
+        """
+        try: os.remove(self.journal_path)
+        except FileNotFoundError: pass
+
+    def quarantine(self, records):
+        """
+        Append records that can not be collected to the quarantine file in the spool directory, kept for inspection.
+        """
+        with open(os.path.join(self.directory, 'quarantine'), mode='ab') as quarantine:
+            quarantine.write(b''.join(records))
+
+    def save(self, path, content):
+        """
+        Replace the file at path with content as JSON, atomically.
+        """
+        temporary = path + '.tmp'
+        with open(temporary, mode='w') as outfile:
+            json.dump(content, outfile)
+        os.replace(temporary, path)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Python 3.6.3
+# logger_supervise.py
+
+"""
+logger_supervise.py:
+Restart delays for processes forked and supervised by logger_httpd.py in fork mode, and later by logger_collector.py,
+and running the forked processes themselves.
+
+A process that dies is restarted after restart_delay seconds. If it dies again soon after, the delay doubles each time,
+up to max_restart_delay, so a process failing on start up does not restart in a tight loop.
+A process that ran for max_restart_delay seconds or more before dying starts again from restart_delay.
+
+A forked process runs through run_child(), which never returns into the supervisor's code. A process that fails
+writes its traceback to stderr and exits with status 1, so the supervisor reports why it died.
+
+Usage:
+backoff = logger_supervise.Backoff()
+backoff.start(slot) # Each time the process in slot is forked.
+time.sleep(backoff.delay(slot)) # When it has died, before forking it again.
+run_child(target, *args) # In the forked process.
+
+Anil Gulati
+01/09/2018
+"""
+
+import os
+import sys
+import time
+import traceback
+
+restart_delay = 1.0 # Seconds before restarting a process that died.
+max_restart_delay = 60.0 # Most seconds between restarts, and how long a process must run for the delay to start over.
+
+
+class Backoff():
+    """
+    Restart delays for supervised processes, each identified by a key such as its worker number.
+    """
+
+    def __init__(self):
+        self.started = dict() # Key to time last started.
+        self.delays = dict() # Key to delay before the next restart.
+
+    def start(self, key):
+        """
+        Note that the process for key has just been started.
+        """
+        self.started[key] = time.monotonic()
+
+    def delay(self, key):
+        """
+        Return the seconds to wait before restarting the process for key, which has died, and double the delay after it.
+        """
+        if time.monotonic() - self.started.get(key, 0) >= max_restart_delay: # Ran a good while, so not failing repeatedly.
+            self.delays[key] = restart_delay
+        delay = self.delays.get(key, restart_delay)
+        self.delays[key] = min(delay * 2, max_restart_delay)
+        return delay
+
+
+def run_child(target, *args):
+    """
+    Run target(*args) in a forked process, then exit without returning into the supervisor's code.
+    Exits with status 0 when target returns or the process is terminated with sys.exit(0), as by a SIGTERM handler.
+    Any other exception is written to stderr with its traceback and exits with status 1.
+    """
+    status = 1
+    try:
+        target(*args)
+        status = 0
+    except SystemExit as e: # Terminated, or exiting with its own status.
+        if e.code is None or isinstance(e.code, int): status = e.code or 0
+        else: print(e.code, file=sys.stderr)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(status) # Never return into the supervisor's code.
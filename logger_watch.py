@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# Python 3.6.3
+# logger_watch.py
+
+"""
+logger_watch.py:
+Wait for changes to directories, used by logger_collector.py to wake as soon as new messages arrive.
+
+On Linux inotify is used, through ctypes, so waiting returns within milliseconds of a file being created or written.
+Elsewhere, or if inotify is unavailable, waiting falls back to polling with adaptive backoff:
+the delay starts short after activity and doubles while idle, up to the timeout given.
+
+Usage:
+watcher = logger_watch.get_watcher(['/srv/logger/spool'])
+while True:
+    if not do_work(): watcher.wait(5) # Returns early when something changes.
+    else: watcher.activity()
+
+Anil Gulati
+01/09/2018
+"""
+
+import os
+import sys
+import time
+import select
+import ctypes
+import ctypes.util
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+watch_mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE # Any new or appended file.
+
+def get_watcher(paths, min_delay=0.01):
+    """
+    Return an InotifyWatcher for the directories in paths if inotify is available, otherwise a PollWatcher.
+    """
+    if sys.platform.startswith('linux'):
+        try: return InotifyWatcher(paths)
+        except OSError: pass # No inotify support, or out of watches.
+    return PollWatcher(min_delay)
+
+
+class InotifyWatcher():
+    """
+    Wait for files to be created, written or moved into any of the watched directories.
+    """
+
+    def __init__(self, paths):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        for path in paths:
+            os.makedirs(path, exist_ok=True)
+            if libc.inotify_add_watch(self.fd, os.fsencode(path), watch_mask) < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch failed for ' + path)
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds for a change. Returns True if something changed.
+        All pending events are consumed, as the caller rescans anyway.
+        """
+        (readable, writable, errors) = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self.fd, 65536): pass # Drain events until it would block.
+        except BlockingIOError:
+            pass
+        return True
+
+    def activity(self):
+        pass # Events are delivered promptly whether busy or idle.
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollWatcher():
+    """
+    Poll with adaptive backoff: each wait sleeps twice as long as the last, from min_delay after activity up to the timeout.
+    """
+
+    def __init__(self, min_delay=0.01):
+        self.min_delay = self.delay = min_delay
+
+    def wait(self, timeout):
+        """
+        Sleep for the current delay, at most timeout seconds, then double the delay. Always returns True as changes are unknown.
+        """
+        time.sleep(min(self.delay, timeout))
+        self.delay = max(self.min_delay, min(self.delay * 2, timeout))
+        return True
+
+    def activity(self):
+        """
+        Work was found, so poll quickly again.
+        """
+        self.delay = self.min_delay
+
+    def close(self):
+        pass
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Test logger_archive.py, and compaction and expiry in logger_collector.py.
+"""
+
+import os
+import json
+import logger_archive
+import logger_collector
+import logger_index
+import logger_resource
+
+def write_day(tmp_path, monkeypatch, log_name='20171205-40-facility_one'):
+    """
+    Write and index a log file with a line every few seconds, in log, archive and index directories under tmp_path.
+    """
+    for (module, name, directory) in ((logger_archive, 'log_directory', 'logs'), (logger_archive, 'archive_directory', 'archive'),
+                                      (logger_archive, 'expiry_path', 'expire'), (logger_collector, 'log_directory', 'logs'),
+                                      (logger_index, 'log_directory', 'logs'), (logger_index, 'index_directory', 'index'),
+                                      (logger_resource, 'log_directory', 'logs')):
+        monkeypatch.setattr(module, name, str(tmp_path / directory))
+    (tmp_path / 'logs').mkdir()
+    (tmp_path / 'index').mkdir()
+    lines = [bytes('{0}-{1:02d}{2:02d}{3:02d}.000000-40-facility_one:request {4} done:userid=u{5}\n'.format(log_name[:8], second // 3600, second // 60 % 60, second % 60, second, second % 5), 'ascii')
+             for second in range(0, 7200, 3)]
+    with open(str(tmp_path / 'logs' / log_name), mode='wb') as log_file:
+        log_file.write(b''.join(lines))
+    writer = logger_index.IndexWriter()
+    writer.update(log_name, lines, 0)
+    writer.save()
+    return lines
+
+def query(url):
+    filtered = logger_resource.GetFilter(url)
+    if filtered.resource == 'counts':
+        filtered.get_counts()
+        return filtered.counts
+    return [json.loads(row.decode()) for row in filtered.get_messages()]
+
+def test_archive_read_transparently(tmp_path, monkeypatch):
+    lines = write_day(tmp_path, monkeypatch)
+    monkeypatch.setattr(logger_archive, 'block_bytes', 2000)
+    urls = ('/api/v1/counts/20171205-003012/20171205-014545', '/api/v1/counts/20171205-003000/20171205-003001/40/userid=u0',
+            '/api/v1/counts/20171205///msg~request%20%5Cd%2B5%20done', '/api/v1/messages/20171205-010000/20171205-011000?limit=50&mode=full')
+    before = [query(url) for url in urls]
+    for codec in ('lzma', 'zlib'):
+        logger_archive.archive_log('20171205-40-facility_one', codec)
+        assert not os.path.exists(str(tmp_path / 'logs' / '20171205-40-facility_one'))
+        assert logger_archive.log_size(str(tmp_path / 'logs' / '20171205-40-facility_one')) == sum(len(line) for line in lines)
+        assert [query(url) for url in urls] == before
+        logger_archive.restore_log('20171205-40-facility_one')
+        assert open(str(tmp_path / 'logs' / '20171205-40-facility_one'), mode='rb').read() == b''.join(lines)
+
+def test_archive_reads_only_blocks_needed(tmp_path, monkeypatch):
+    lines = write_day(tmp_path, monkeypatch)
+    monkeypatch.setattr(logger_archive, 'block_bytes', 2000)
+    logger_archive.archive_log('20171205-40-facility_one')
+    decompressed = []
+    with logger_archive.ArchiveFile(logger_archive.archive_path('20171205-40-facility_one')) as archive:
+        decompress = archive.decompress
+        archive.decompress = lambda data: decompressed.append(data) or decompress(data)
+        offset = sum(len(line) for line in lines[:1000])
+        archive.seek(offset)
+        assert archive.readline() == lines[1000]
+        assert len(decompressed) == 1
+
+def test_collector_restores_and_expires(tmp_path, monkeypatch):
+    write_day(tmp_path, monkeypatch)
+    partitions = list(range(logger_collector.spool_partitions))
+    (closed, expired) = logger_collector.closed_logs(partitions)
+    assert (closed, expired) == (['20171205-40-facility_one'], []) # Long closed.
+    logger_archive.archive_log(closed[0])
+    assert logger_collector.log_sizes(closed)[closed[0]] > 0 # Late message, restored to append.
+    assert os.path.exists(str(tmp_path / 'logs' / '20171205-40-facility_one'))
+    assert logger_archive.request_expiry('20171205') == '20171205'
+    assert logger_archive.request_expiry('20171201') == '20171205' # Never brings days back.
+    (closed, expired) = logger_collector.closed_logs(partitions)
+    assert (closed, expired) == ([], ['20171205-40-facility_one'])
+    logger_collector.expire_logs(expired)
+    assert os.listdir(str(tmp_path / 'logs')) == [] and os.listdir(str(tmp_path / 'index')) == []
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Test logger_bench.py.
+"""
+
+import threading
+import logger_bench
+import logger_httpd
+import logger_spool
+
+def keep_paths(monkeypatch):
+    """
+    Restore the directories of each module after the test, as use_root() replaces them.
+    """
+    for module in (logger_bench.logger_index, logger_bench.logger_archive, logger_bench.logger_columns, logger_bench.logger_resource):
+        for name in ('log_path', 'log_directory', 'index_directory', 'archive_directory', 'column_directory', 'expiry_path'):
+            if hasattr(module, name):
+                monkeypatch.setattr(module, name, getattr(module, name))
+
+def test_generate_and_query(tmp_path, monkeypatch):
+    keep_paths(monkeypatch)
+    summary = logger_bench.generate(str(tmp_path), days=2, facilities=3, per_day=2000)
+    assert summary['lines'] == 4000
+    results = logger_bench.query(str(tmp_path), repeat=2)
+    assert results['counts_all']['result'] == 4000
+    assert results['counts_day']['result'] == 2000
+    assert 0 < results['counts_predicate']['result'] < 2000
+    assert results['messages_page']['result'] > 0 and results['ranges_day']['result'] == 3
+    assert set(results['counts_hour']['seconds']) == {'first', 'min', 'median', 'max'}
+
+def test_ingest_localhost(tmp_path, monkeypatch):
+    monkeypatch.setattr(logger_httpd.restHandler, 'spool', logger_spool.SpoolWriter(str(tmp_path)))
+    monkeypatch.setattr(logger_httpd.restHandler, 'log_message', lambda *args: None)
+    server = logger_httpd.PoolHTTPServer(('localhost', 0), logger_httpd.restHandler, workers=4)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host = 'localhost:{0}'.format(server.server_address[1])
+        single = logger_bench.ingest(host, clients=2, rate=100, duration=0.5)
+        bulk = logger_bench.ingest(host, clients=2, duration=0.3, bulk=20)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert single['errors'] == 0 and 30 <= single['messages'] <= 50 # Held to the rate.
+    assert bulk['errors'] == 0 and bulk['messages'] == 20 * bulk['requests']
+    assert single['latency_ms']['p50'] <= single['latency_ms']['max']
+    (records, position) = logger_spool.SpoolReader(str(tmp_path)).read()
+    assert len(records) == single['messages'] + bulk['messages']
+
+def test_compare():
+    baseline = { 'results': { 'messages_per_second': 1000.0, 'latency_ms': { 'p99': 10.0 }, 'counts_all': { 'result': 5, 'seconds': { 'median': 0.1 } } } }
+    result = { 'results': { 'messages_per_second': 700.0, 'latency_ms': { 'p99': 11.0 }, 'counts_all': { 'result': 9, 'seconds': { 'median': 0.2 } } } }
+    assert logger_bench.compare(baseline, result, 0.2) == [('counts_all/seconds/median', 0.1, 0.2), ('messages_per_second', 1000.0, 700.0)]
+    assert logger_bench.percentiles([5, 1, 3, 2, 4]) == { 'p50': 3, 'p90': 5, 'p99': 5, 'p999': 5, 'max': 5, 'mean': 3.0 }
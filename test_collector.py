@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Test supervision of workers by logger_collector.py.
+"""
+
+import os
+import sys
+import time
+import fcntl
+import signal
+import subprocess
+
+supervisor = """
+import os, sys, time, logger_collector, logger_supervise
+root = sys.argv[1]
+for (name, directory) in (('spool_directory', 'spool'), ('index_directory', 'index'), ('cache_directory', 'cache'), ('pids_path', 'pids')):
+    setattr(logger_collector, name, os.path.join(root, directory))
+logger_supervise.restart_delay = 0.2
+def run_worker(worker, workers): # Records each start, then runs until terminated or dies straight away.
+    with open(os.path.join(root, 'started'), mode='a') as started:
+        started.write('{0} {1}\\n'.format(worker, os.getpid()))
+    if sys.argv[2] == 'run': time.sleep(60)
+logger_collector.run_worker = run_worker
+logger_collector.supervise(2)
+"""
+
+def start_supervisor(tmp_path, behaviour):
+    process = subprocess.Popen([sys.executable, '-c', supervisor, str(tmp_path), behaviour], stdout=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__)))
+    time.sleep(1)
+    return process
+
+def started(tmp_path):
+    return [line.split() for line in (tmp_path / 'started').read_text().splitlines()]
+
+def locked(tmp_path):
+    with open(str(tmp_path / 'spool' / 'lock'), mode='w') as lock:
+        try: fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError: return True
+        return False
+
+def alive(pid):
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    return True
+
+def test_terminate_stops_workers(tmp_path):
+    process = start_supervisor(tmp_path, 'run')
+    workers = [int(pid) for (worker, pid) in started(tmp_path)]
+    assert len(workers) == 2 and locked(tmp_path)
+    process.send_signal(signal.SIGTERM)
+    assert process.wait(5) == 0
+    assert not any(alive(pid) for pid in workers) and not locked(tmp_path)
+
+def test_workers_do_not_hold_lock(tmp_path):
+    process = start_supervisor(tmp_path, 'run')
+    process.kill() # No chance to clean up.
+    process.wait(5)
+    workers = [int(pid) for (worker, pid) in started(tmp_path)]
+    try: assert not locked(tmp_path) # A new collector can start.
+    finally:
+        for pid in workers: os.kill(pid, signal.SIGTERM)
+
+def test_restarts_back_off(tmp_path):
+    process = start_supervisor(tmp_path, 'die')
+    process.send_signal(signal.SIGTERM)
+    process.wait(5)
+    starts = [worker for (worker, pid) in started(tmp_path)]
+    assert 4 <= len(starts) and max(starts.count('0'), starts.count('1')) <= 4 # Started, then after 0.2s and 0.4s more, not in a tight loop.
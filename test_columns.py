@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Test logger_columns.py, and counts from column stores in logger_resource.py.
+"""
+
+import os
+import array
+from urllib.parse import parse_qsl
+import logger_archive
+import logger_columns
+import logger_index
+import logger_resource
+import logger_httpd
+
+def write_logs(tmp_path, monkeypatch):
+    """
+    Write two log files of one day and partition, with lines every few seconds, some out of order, and return their lines.
+    """
+    for (module, name, directory) in ((logger_archive, 'log_directory', 'logs'), (logger_archive, 'archive_directory', 'archive'),
+                                      (logger_columns, 'log_directory', 'logs'), (logger_columns, 'column_directory', 'columns'),
+                                      (logger_index, 'log_directory', 'logs'), (logger_index, 'index_directory', 'index'),
+                                      (logger_resource, 'log_directory', 'logs')):
+        monkeypatch.setattr(module, name, str(tmp_path / directory))
+    (tmp_path / 'logs').mkdir()
+    (tmp_path / 'index').mkdir()
+    logs = dict()
+    for level in ('20', '40'):
+        seconds = list(range(0, 7200, 3 if level == '20' else 7))
+        seconds[100:110] = [second - 90 for second in seconds[100:110]] # Late arrivals.
+        lines = [bytes('20171205-{0}.{1:06d}-{2}-facility_one:message {3}:userid=u{4}\n'.format(logger_index.stamp_of(second), second % 1000000, level, second % 3, second % 5), 'ascii')
+                 for second in seconds]
+        with open(str(tmp_path / 'logs' / ('20171205-' + level + '-facility_one')), mode='wb') as log_file:
+            log_file.write(b''.join(lines))
+        logs['20171205-' + level + '-facility_one'] = lines
+    return logs
+
+def counts(url):
+    filtered = logger_resource.GetFilter(url)
+    filtered.get_counts()
+    return filtered.counts
+
+def test_counts_from_columns_match_lines(tmp_path, monkeypatch):
+    logs = write_logs(tmp_path, monkeypatch)
+    urls = ['/api/v1/counts/20171205/20171205', '/api/v1/counts/20171205-003012/20171205-014545/40', '/api/v1/counts/20171205-0030/20171205-0130',
+            '/api/v1/counts/20171205-010203/20171205-010207?histogram=minute', '/api/v1/counts/20171205///facility_one?histogram=hour']
+    expected = [counts(url) for url in urls] # From the log files, no column store yet.
+    columns = logger_columns.ColumnIndex()
+    for (log_name, lines) in logs.items():
+        columns.update(log_name, lines[:-50], 0) # Store behind the log files.
+    columns.save()
+    monkeypatch.setattr(logger_resource, 'count_log', None) # Neither rollups nor ranges of log files are read.
+    monkeypatch.setattr(logger_resource, 'log_ranges', None)
+    assert [counts(url) for url in urls] == expected
+    assert expected[3]['histogram'] == { '20171205-0102': expected[3]['all'] }
+    assert sum(expected[4]['histogram'].values()) == expected[4]['all'] == sum(len(lines) for lines in logs.values())
+
+def test_column_store_undoes_interrupted_batch(tmp_path, monkeypatch):
+    logs = write_logs(tmp_path, monkeypatch)
+    (log_name, lines) = ('20171205-20-facility_one', logs['20171205-20-facility_one'])
+    writer = logger_columns.ColumnWriter(logger_index.catalog_name(log_name))
+    writer.add_lines(log_name, lines[:1000])
+    writer.save()
+    writer.add_lines(log_name, lines[1000:])
+    writer.save()
+    size = sum(len(line) for line in lines[:1000])
+    os.truncate(str(tmp_path / 'logs' / log_name), size) # Batch undone by the collector.
+    writer = logger_columns.ColumnWriter(logger_index.catalog_name(log_name))
+    assert (writer.size(log_name), writer.state['rows']) == (size, 1000)
+    assert os.path.getsize(logger_columns.column_path(writer.name, 'time')) == 8000
+    assert logger_columns.ColumnStore(writer.name).count()[(20, 'facility_one')] == 1000
+
+def test_columns_of_values_with_colons(tmp_path, monkeypatch):
+    write_logs(tmp_path, monkeypatch)
+    lines = [logger_httpd.parse_message('name=facility_two&levelno=40&msg=Disk full: /var&url=http://x/{0}&created={1}'.format(number, 1512432000 + number))[1].encode() for number in range(3)]
+    writer = logger_columns.ColumnWriter('20171205-00')
+    writer.add_lines('20171205-40-facility_two', lines)
+    writer.save()
+    assert logger_columns.read_dictionary(writer.name, 'msgs', writer.state['lengths']['msgs']) == ['Disk full: /var']
+    with open(logger_columns.column_path(writer.name, 'extra'), mode='rb') as infile:
+        ends = array.array('Q', infile.read())
+    with open(logger_columns.column_path(writer.name, 'extra.blob'), mode='rb') as infile:
+        blob = infile.read()
+    extras = [dict(parse_qsl(blob[start:end].decode())) for (start, end) in zip([0] + list(ends[:-1]), ends)]
+    assert [extra['url'] for extra in extras] == ['http://x/0', 'http://x/1', 'http://x/2']
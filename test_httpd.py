@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+Test logger_httpd.py.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import asyncio
+import threading
+import subprocess
+import http.client
+import pytest
+import logger_httpd
+import logger_spool
+import logger_resource
+import logger_archive
+import logger_collector
+import logger_index
+
+def use_spool(tmp_path, monkeypatch):
+    monkeypatch.setattr(logger_httpd.restHandler, 'spool', logger_spool.SpoolWriter(str(tmp_path / 'spool')))
+    monkeypatch.setattr(logger_httpd.restHandler, 'log_message', lambda *args: None)
+    monkeypatch.setattr(logger_resource, 'log_directory', str(tmp_path / 'logs'))
+    monkeypatch.setattr(logger_archive, 'archive_directory', str(tmp_path / 'archive'))
+    monkeypatch.setattr(logger_archive, 'expiry_path', str(tmp_path / 'expire'))
+    (tmp_path / 'logs').mkdir()
+
+def exchange(port):
+    """
+    Make requests of each kind over one kept alive connection, returning the responses (status, body).
+    """
+    connection = http.client.HTTPConnection('localhost', port, timeout=5)
+    requests = [('POST', '/api/v1/messages', b'name=f&levelno=40&msg=m&created=1512386686.5', 'application/x-www-form-urlencoded'),
+                ('POST', '/api/v1/messages/bulk', b'name=f&levelno=30&msg=a\x0bb&created=1512386687.5\r\nname=f&levelno=x\n', 'text/plain'),
+                ('GET', '/api/v1/messages/20171204', None, None),
+                ('GET', '/api/v1/counts/20171204', None, None)]
+    responses = []
+    for (method, path, body, content_type) in requests:
+        connection.request(method, path, body, content_type and { 'Content-Type': content_type } or {})
+        response = connection.getresponse()
+        responses.append((response.status, response.read()))
+    connection.close()
+    return responses
+
+def check_exchange(responses, tmp_path):
+    assert [status for (status, content) in responses] == [201, 201, 200, 200]
+    assert json.loads(responses[1][1].decode()) == { 'accepted': 1, 'rejected': [{ 'record': 1, 'error': 'levelno must be double digit numeric' }] }
+    assert responses[2][1] == b'{"cursor": null}\n' # Streamed, chunked.
+    assert json.loads(responses[3][1].decode()) == { 'all': 0 }
+    (records, position) = logger_spool.SpoolReader(str(tmp_path / 'spool')).read()
+    assert [logger_spool.split_record(record)[1].split(b':')[:2] for record in records] == [[b'20171204-112446.500000-40-f', b'm'], [b'20171204-112447.500000-30-f', b'a\x0bb']]
+
+def refused_content_length(port):
+    """
+    POST with a Content-Length that is not a number, returning the raw response up to the connection closing.
+    """
+    with socket.create_connection(('localhost', port), timeout=5) as client:
+        client.sendall(b'POST /api/v1/messages/bulk HTTP/1.1\r\nHost: localhost\r\nContent-Type: text/plain\r\nContent-Length: 1e3\r\n\r\nname=f&levelno=40')
+        response = b''
+        while True:
+            data = client.recv(4096)
+            if not data:
+                return response
+            response += data
+
+def test_thread_pool_mode(tmp_path, monkeypatch):
+    use_spool(tmp_path, monkeypatch)
+    server = logger_httpd.PoolHTTPServer(('localhost', 0), logger_httpd.restHandler, workers=2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try: responses = exchange(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+    check_exchange(responses, tmp_path)
+
+def test_asyncio_mode(tmp_path, monkeypatch):
+    use_spool(tmp_path, monkeypatch)
+    server = logger_httpd.AsyncHTTPServer(('localhost', 0), logger_httpd.restHandler, workers=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    assert server.serving.wait(5)
+    try: responses = exchange(server.server_address[1])
+    finally:
+        server.shutdown()
+        thread.join(5)
+        server.server_close()
+    assert not thread.is_alive()
+    check_exchange(responses, tmp_path)
+
+def test_bad_content_length_refused(tmp_path, monkeypatch):
+    use_spool(tmp_path, monkeypatch)
+    server = logger_httpd.PoolHTTPServer(('localhost', 0), logger_httpd.restHandler, workers=2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try: assert refused_content_length(server.server_address[1]).startswith(b'HTTP/1.1 400 ')
+    finally:
+        server.shutdown()
+        server.server_close()
+    server = logger_httpd.AsyncHTTPServer(('localhost', 0), logger_httpd.restHandler, workers=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    assert server.serving.wait(5)
+    try: assert refused_content_length(server.server_address[1]).startswith(b'HTTP/1.1 400 ')
+    finally:
+        server.shutdown()
+        thread.join(5)
+        server.server_close()
+    assert not os.path.exists(str(tmp_path / 'spool')) or logger_spool.SpoolReader(str(tmp_path / 'spool')).read()[0] == []
+
+def test_async_write_waits_for_drain():
+    class Stream(): # Holds what is written until drained, as a StreamWriter over a slow client.
+        (buffered, most) = (0, 0)
+        def write(self, data):
+            self.buffered += len(data)
+            self.most = max(self.most, self.buffered)
+        async def drain(self):
+            await asyncio.sleep(0.001)
+            self.buffered = 0
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    stream = Stream()
+    async def create(): return logger_httpd.AsyncWriteFile(loop, stream)
+    wfile = asyncio.run_coroutine_threadsafe(create(), loop).result()
+    for chunk in range(50): # From a query thread.
+        wfile.write(b'x' * 1000)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+    assert stream.most == 1000 # Never more than one write waiting.
+
+def test_forked_children_terminated():
+    script = 'import logger_httpd\nserver = logger_httpd.PoolHTTPServer(("localhost", 0), logger_httpd.restHandler)\n' \
+             'print(server.server_address[1], flush=True)\nlogger_httpd.serve_forked(server, 2)\n'
+    process = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+    port = int(process.stdout.readline())
+    time.sleep(0.5) # Children forked.
+    process.send_signal(signal.SIGTERM)
+    assert process.wait(5) == 0
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('localhost', port)) # No child left holding the port.
+    listener.listen()
+    listener.close()
+
+def test_parse_message_standard():
+    (filename, logline) = logger_httpd.parse_message('name=facility_one&levelno=40&msg=error+message&created=1512386686.5')
+    assert filename == '20171204-112446.500000-40-facility_one'
+    assert logline == filename + ':error message:name=facility_one&levelno=40&msg=error+message&created=1512386686.5\n'
+
+def test_parse_message_newline_in_msg():
+    (filename, logline) = logger_httpd.parse_message('name=f&levelno=40&msg=two%0Alines')
+    assert logline.count('\n') == 1
+
+def test_parse_message_newline_in_content():
+    (filename, logline) = logger_httpd.parse_message('name=f&levelno=40&msg=m&extra=a\r\nb')
+    assert logline.endswith(':m:name=f&levelno=40&msg=m&extra=a%0D%0Ab\n') and logline.count('\n') == 1
+
+def test_parse_message_colon_in_content():
+    (filename, logline) = logger_httpd.parse_message('name=f&levelno=40&msg=Disk full: /var&url=http://x/y&created=1512386686.5')
+    assert logline.count(':') == 3 # Only those of the message and around it.
+    row = logger_resource.message_row('20171204-40-f', logline.encode(), full=True)
+    assert (row['msg'], row['record']['url'], row['record']['msg']) == ('Disk full: /var', 'http://x/y', 'Disk full: /var')
+
+def test_parse_message_bad_level():
+    with pytest.raises(ValueError):
+        logger_httpd.parse_message('name=f&levelno=4')
+
+def test_parse_message_bad_facility():
+    with pytest.raises(ValueError):
+        logger_httpd.parse_message('name=../etc&levelno=40')
+
+def test_log_batch_single_write(tmp_path):
+    handler = logger_httpd.restHandler.__new__(logger_httpd.restHandler)
+    handler.spool = logger_spool.SpoolWriter(str(tmp_path))
+    (accepted, rejected) = handler.log_batch(['name=f&levelno=40&created=1512386686.5', '', 'name=f&levelno=x', 'name=g&levelno=30&created=1512386680.5'])
+    assert accepted == 2
+    assert rejected == [{ 'record': 2, 'error': 'levelno must be double digit numeric' }]
+    (records, position) = logger_spool.SpoolReader(str(tmp_path)).read()
+    assert [logger_spool.split_record(record)[1][:22] for record in records] == [b'20171204-112446.500000', b'20171204-112440.500000']
+
+def test_log_batch_rejects_timestamp_out_of_range(tmp_path):
+    handler = logger_httpd.restHandler.__new__(logger_httpd.restHandler)
+    handler.spool = logger_spool.SpoolWriter(str(tmp_path))
+    (accepted, rejected) = handler.log_batch(['name=f&levelno=40&created=inf', 'name=f&levelno=40&created=1e20', 'name=f&levelno=40&created=nan', 'name=f&levelno=40&created=1512386686.5'])
+    assert accepted == 1
+    assert rejected == [{ 'record': record, 'error': 'created must be timestamp ssssssssss.uuuuuu' } for record in (0, 1, 2)]
+
+def test_bad_request_refused_before_streaming(tmp_path, monkeypatch):
+    use_spool(tmp_path, monkeypatch)
+    server = logger_httpd.PoolHTTPServer(('localhost', 0), logger_httpd.restHandler, workers=2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection = http.client.HTTPConnection('localhost', server.server_address[1], timeout=5)
+    statuses = []
+    try:
+        for options in ('cursor=garbage', 'limit=abc', 'limit=0', 'limit=-1'):
+            connection.request('GET', '/api/v1/messages/20171204?' + options)
+            response = connection.getresponse()
+            response.read() # Complete, the connection is still usable.
+            statuses.append(response.status)
+    finally:
+        connection.close()
+        server.shutdown()
+        server.server_close()
+    assert statuses == [400, 400, 200, 200]
+
+def test_bad_filters_refused(tmp_path, monkeypatch):
+    use_spool(tmp_path, monkeypatch)
+    server = logger_httpd.PoolHTTPServer(('localhost', 0), logger_httpd.restHandler, workers=2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection = http.client.HTTPConnection('localhost', server.server_address[1], timeout=5)
+    statuses = []
+    try:
+        for (method, path) in (('GET', '/api/v1/counts////userid=u3|u5'), ('GET', '/api/v1/messages////msg~%28'), ('GET', '/api/v1/counts/20171204?histogram=day'),
+                               ('DELETE', '/api/v1/messages////userid=u3|u5'), ('DELETE', '/api/v1/messages//20171204')):
+            connection.request(method, path)
+            response = connection.getresponse()
+            response.read()
+            statuses.append(response.status)
+    finally:
+        connection.close()
+        server.shutdown()
+        server.server_close()
+    assert statuses == [400, 400, 400, 400, 202] # Connection kept throughout.
+    assert (tmp_path / 'expire').read_text() == '20171204\n'
+
+def test_newline_in_content_collected(tmp_path, monkeypatch):
+    use_spool(tmp_path, monkeypatch)
+    monkeypatch.setattr(logger_collector, 'log_directory', str(tmp_path / 'logs'))
+    monkeypatch.setattr(logger_index, 'log_directory', str(tmp_path / 'logs'))
+    monkeypatch.setattr(logger_index, 'index_directory', str(tmp_path / 'logs'))
+    server = logger_httpd.PoolHTTPServer(('localhost', 0), logger_httpd.restHandler, workers=2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection = http.client.HTTPConnection('localhost', server.server_address[1], timeout=5)
+    statuses = []
+    try:
+        for body in (b'name=f&levelno=40&msg=m&created=1512386686.5&extra=a\nb', b'name=f&levelno=40&msg=n&created=1512386687.5'):
+            connection.request('POST', '/api/v1/messages', body, { 'Content-Type': 'application/x-www-form-urlencoded' })
+            response = connection.getresponse()
+            response.read()
+            statuses.append(response.status)
+    finally:
+        connection.close()
+        server.shutdown()
+        server.server_close()
+    assert statuses == [201, 201]
+    reader = logger_spool.SpoolReader(str(tmp_path / 'spool'))
+    assert logger_collector.collect_spool(reader, logger_index.IndexWriter()) == 2
+    lines = (tmp_path / 'logs' / '20171204-40-f').read_text().splitlines()
+    assert [line.split(':')[1] for line in lines] == ['m', 'n'] and lines[0].endswith('&extra=a%0Ab')
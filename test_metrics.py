@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Test logger_metrics.py, and the metrics recorded by logger_httpd.py.
+"""
+
+import os
+import json
+import time
+import threading
+import http.client
+import logger_metrics
+import logger_httpd
+import logger_spool
+
+def use_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(logger_metrics, 'registry', logger_metrics.Registry('httpd'))
+    monkeypatch.setattr(logger_metrics, 'metrics_directory', str(tmp_path / 'metrics'))
+    monkeypatch.setattr(logger_metrics, 'cache_directory', str(tmp_path / 'cache'))
+    monkeypatch.setattr(logger_spool, 'spool_directory', str(tmp_path / 'spool'))
+
+def test_snapshots_merged_in_prometheus_format(tmp_path, monkeypatch):
+    use_directory(tmp_path, monkeypatch)
+    collector = logger_metrics.Registry('collector-0')
+    collector.observe('collect_batch_seconds', 0.003)
+    collector.observe('collect_batch_seconds', 0.2)
+    collector.count('collect_messages_total', 50)
+    (tmp_path / 'metrics').mkdir()
+    (tmp_path / 'metrics' / 'collector-0.json').write_text(json.dumps(collector.snapshot()))
+    stale = dict(logger_metrics.Registry('httpd-99').snapshot(), time=time.time() - 1000) # Stopped long ago.
+    (tmp_path / 'metrics' / 'httpd-99.json').write_text(json.dumps(stale))
+    logger_metrics.count('responses_total', method='POST', status='201')
+    text = logger_metrics.metrics_prometheus()
+    assert '# TYPE logger_collect_batch_seconds histogram\n' in text
+    assert 'logger_collect_batch_seconds_bucket{le="0.005",process="collector-0"} 1\n' in text
+    assert 'logger_collect_batch_seconds_bucket{le="+Inf",process="collector-0"} 2\n' in text
+    assert 'logger_collect_batch_seconds_count{process="collector-0"} 2\n' in text
+    assert 'logger_collect_messages_total{process="collector-0"} 50\n' in text
+    assert 'logger_responses_total{method="POST",process="httpd",status="201"} 1\n' in text
+    assert 'logger_spool_backlog_bytes{partition="00"} 0\n' in text
+    assert not os.path.exists(str(tmp_path / 'metrics' / 'httpd-99.json')) # Removed as stale.
+
+def test_spool_backlog(tmp_path):
+    writer = logger_spool.SpoolWriter(str(tmp_path))
+    assert logger_spool.spool_backlog(str(tmp_path)) == (0, None)
+    before = time.time()
+    writer.append(['20171205-100000.000000-40-f:one:a=1\n', '20171205-100001.000000-40-f:two:a=2\n'])
+    (waiting, received) = logger_spool.spool_backlog(str(tmp_path))
+    assert waiting == os.path.getsize(str(tmp_path / logger_spool.segment_name(1))) and before - 1 <= received <= time.time()
+    reader = logger_spool.SpoolReader(str(tmp_path))
+    (records, position) = reader.read()
+    reader.commit(position)
+    assert logger_spool.spool_backlog(str(tmp_path)) == (0, None)
+
+def test_metrics_endpoint(tmp_path, monkeypatch):
+    use_directory(tmp_path, monkeypatch)
+    monkeypatch.setattr(logger_httpd.restHandler, 'spool', logger_spool.SpoolWriter(str(tmp_path / 'spool' / '00')))
+    monkeypatch.setattr(logger_httpd.restHandler, 'log_message', lambda *args: None)
+    server = logger_httpd.PoolHTTPServer(('localhost', 0), logger_httpd.restHandler, workers=2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        connection = http.client.HTTPConnection('localhost', server.server_address[1])
+        connection.request('POST', '/api/v1/messages', b'name=f&levelno=40&msg=m&created=1512386686.5', { 'Content-Type': 'application/x-www-form-urlencoded' })
+        assert connection.getresponse().read() == b''
+        connection.request('GET', '/api/v1/metrics')
+        content = json.loads(connection.getresponse().read().decode())
+        connection.request('GET', '/api/v1/metrics?format=prometheus')
+        response = connection.getresponse()
+        text = response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+    counters = dict((counter['name'], counter['value']) for counter in content['processes'][0]['counters'])
+    assert counters['messages_total'] == 1
+    gauges = dict(((gauge['name'], gauge['labels'].get('partition')), gauge['value']) for gauge in content['gauges'])
+    assert gauges[('spool_backlog_bytes', '00')] > 0 and gauges[('spool_oldest_age_seconds', '00')] >= 0
+    assert response.getheader('Content-Type').startswith('text/plain; version=0.0.4')
+    assert 'logger_request_seconds_count{method="POST",process="httpd",route="messages"} 1\n' in text
+    assert 'logger_parse_seconds_count{process="httpd"} 1\n' in text
+
+def test_profiler_samples_other_threads():
+    profiler = logger_metrics.Profiler(0.001)
+    def busy_loop():
+        until = time.monotonic() + 0.2
+        while time.monotonic() < until: pass
+    thread = threading.Thread(target=busy_loop)
+    thread.start()
+    thread.join()
+    assert 'test_metrics:busy_loop' in profiler.folded()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Test the BatchingHandler, client spool and forwarder of logger_remote.py.
+"""
+
+import logging
+import threading
+import logger_remote
+import logger_httpd
+import logger_spool
+
+def record(level, message):
+    return logging.LogRecord('facility_one', level, __file__, 1, message, None, None)
+
+def start_server(tmp_path, monkeypatch, port=0):
+    monkeypatch.setattr(logger_httpd.restHandler, 'spool', logger_spool.SpoolWriter(str(tmp_path / 'server')))
+    monkeypatch.setattr(logger_httpd.restHandler, 'log_message', lambda *args: None)
+    server = logger_httpd.PoolHTTPServer(('localhost', port), logger_httpd.restHandler, workers=2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def stop_server(server):
+    server.shutdown()
+    server.server_close()
+
+def send_to(handler, batches, up=None):
+    """
+    Replace the handler's send with one appending the messages of each batch to batches, failing while up is not set.
+    """
+    def send(batch):
+        with handler.ready:
+            if up is not None and not up.is_set():
+                handler.errors += 1
+                return False
+            batches.append([line.split('&msg=')[1].split('&')[0] for (sequence, levelno, line) in batch])
+            handler.sent += len(batch)
+            return True
+    handler.send = send
+
+def queued(handler):
+    return [line.split('&msg=')[1].split('&')[0] for (sequence, levelno, line) in sorted(handler.queue + handler.debug)]
+
+def test_batching_sends_in_batches():
+    handler = logger_remote.BatchingHandler('localhost:0', logger_remote.bulk_route, batch_size=10, interval=0.05)
+    batches = []
+    send_to(handler, batches)
+    for number in range(25):
+        handler.emit(record(logging.DEBUG if number % 2 else logging.INFO, 'message {0}'.format(number)))
+    handler.close()
+    assert (handler.sent, handler.dropped, handler.errors) == (25, 0, 0)
+    assert max(len(batch) for batch in batches) == 10
+    assert sum(batches, []) == ['message+{0}'.format(number) for number in range(25)] # In order.
+
+def test_batching_overflow_drops():
+    # Nothing is sent, as batches are never full and no interval passes.
+    handler = logger_remote.BatchingHandler('localhost:0', logger_remote.bulk_route, capacity=5, batch_size=100, interval=60)
+    for number in range(8):
+        handler.emit(record(logging.INFO, 'i{0}'.format(number)))
+    assert queued(handler) == ['i3', 'i4', 'i5', 'i6', 'i7'] and handler.dropped == 3
+    handler.shutdown_timeout = 0
+    handler.close()
+    handler = logger_remote.BatchingHandler('localhost:0', logger_remote.bulk_route, capacity=5, batch_size=100, interval=60, overflow='drop-debug-first')
+    for (level, message) in ((logging.DEBUG, 'd1'), (logging.INFO, 'i1'), (logging.DEBUG, 'd2'), (logging.INFO, 'i2'), (logging.INFO, 'i3')):
+        handler.emit(record(level, message))
+    handler.emit(record(logging.INFO, 'i4')) # Oldest debug record dropped.
+    handler.emit(record(logging.INFO, 'i5'))
+    handler.emit(record(logging.DEBUG, 'd3')) # No debug record left, so the new one is dropped.
+    handler.emit(record(logging.WARNING, 'w1')) # Then the oldest record.
+    assert queued(handler) == ['i2', 'i3', 'i4', 'i5', 'w1'] and handler.dropped == 4
+    handler.shutdown_timeout = 0
+    handler.close()
+
+def test_batching_blocks_and_retries():
+    handler = logger_remote.BatchingHandler('localhost:0', logger_remote.bulk_route, capacity=5, batch_size=2, interval=0.01, overflow='block', retry_delay=0.01)
+    (batches, up) = ([], threading.Event())
+    send_to(handler, batches, up)
+    logger = threading.Thread(target=lambda: [handler.emit(record(logging.INFO, 'message {0}'.format(number))) for number in range(20)])
+    logger.start()
+    logger.join(0.5)
+    assert logger.is_alive() and handler.errors > 1 and handler.dropped == 0 # Waiting while the server is down.
+    with handler.ready:
+        assert handler.held() == 5
+    up.set()
+    logger.join(5)
+    handler.close()
+    assert (handler.sent, handler.dropped) == (20, 0)
+    assert sum(batches, []) == ['message+{0}'.format(number) for number in range(20)]
+
+def test_spool_drops_lower_levels_as_it_fills(tmp_path):
+    handler = logger_remote.SpoolingHandler(str(tmp_path), capacity=2000, check_interval=0)
+    handler.emit(record(logging.DEBUG, 'first'))
+    assert handler.spooled == 1
+    while handler.fill < 0.5:
+        handler.emit(record(logging.ERROR, 'filling'))
+    handler.emit(record(logging.DEBUG, 'dropped'))
+    handler.emit(record(logging.INFO, 'kept'))
+    assert handler.dropped == 1
+    while handler.fill < 1.0:
+        handler.emit(record(logging.ERROR, 'filling'))
+    spooled = handler.spooled
+    handler.emit(record(logging.CRITICAL, 'dropped'))
+    assert (handler.spooled, handler.dropped) == (spooled, 2) # Bounded.
+    handler.close()
+    (records, position) = logger_spool.SpoolReader(str(tmp_path)).read()
+    assert len(records) == spooled and b'msg=first' in records[0]
+
+def test_forwarder_resumes_and_retries(tmp_path, monkeypatch):
+    spool = str(tmp_path / 'client')
+    handler = logger_remote.SpoolingHandler(spool)
+    for number in range(10):
+        handler.emit(record(logging.WARNING, 'message {0}'.format(number)))
+    server = start_server(tmp_path, monkeypatch)
+    port = server.server_address[1]
+    try:
+        forwarder = logger_remote.Forwarder(spool, 'localhost:{0}'.format(port), batch_bytes=1)
+        assert forwarder.lock() and not logger_remote.Forwarder(spool).lock() # One forwarder per spool.
+        assert forwarder.forward() == 1 # Batches are at least one record.
+        forwarder.sender.close()
+    finally:
+        stop_server(server)
+    for number in range(10, 15):
+        handler.emit(record(logging.WARNING, 'message {0}'.format(number)))
+    forwarder = logger_remote.Forwarder(spool, 'localhost:{0}'.format(port), min_delay=0.01) # Restarted, server down.
+    stop = threading.Event()
+    thread = threading.Thread(target=forwarder.run, args=(stop,))
+    thread.start()
+    try:
+        while forwarder.errors < 2: stop.wait(0.01)
+        assert forwarder.sent == 0 and forwarder.delay > forwarder.min_delay # Backing off.
+        server = start_server(tmp_path, monkeypatch, port)
+        while forwarder.sent < 14 and thread.is_alive(): stop.wait(0.01)
+    finally:
+        stop.set()
+        thread.join()
+        stop_server(server)
+    assert forwarder.sent == 14 and forwarder.delay == forwarder.min_delay
+    (records, position) = logger_spool.SpoolReader(str(tmp_path / 'server')).read()
+    assert [record.split(b'&msg=')[1].split(b'&')[0] for record in records] == ['message+{0}'.format(number).encode() for number in range(15)] # Once each, in order.
+    assert logger_spool.spool_backlog(spool)[0] == 0
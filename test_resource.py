@@ -7,6 +7,15 @@ Anil Gulati
 """
 
 import logger_resource
+import logger_index
+import logger_search
+import logger_archive
+import logger_httpd
+import json
+import os
+import logging
+import urllib.parse
+import pytest
 
 def test_split_min_empty_default():
     assert list(logger_resource.split_min('')) == ['', '', '', '']
@@ -27,3 +36,222 @@ def test_get_filter_init():
     filtered = logger_resource.GetFilter('/api/v1/counts/20171205-134200/20171205-134223/30-40/facility_one/facility_two/facility_three/')
     assert filtered.facilities == ['facility_one', 'facility_two', 'facility_three', '']
 
+
+def write_log(tmp_path, monkeypatch, log_name='20171205-40-facility_one', seconds=range(0, 7200, 7)):
+    """
+    Write a log file with a line every few seconds from 00:00:00 and return its lines.
+    """
+    monkeypatch.setattr(logger_resource, 'log_directory', str(tmp_path))
+    monkeypatch.setattr(logger_index, 'log_directory', str(tmp_path))
+    monkeypatch.setattr(logger_index, 'index_directory', str(tmp_path))
+    lines = [bytes('20171205-{0:02d}{1:02d}{2:02d}.000000-40-facility_one:message:name=facility_one\n'.format(second // 3600, second // 60 % 60, second % 60), 'ascii') for second in seconds]
+    with open(str(tmp_path / log_name), mode='wb') as log_file:
+        log_file.write(b''.join(lines))
+    return lines
+
+def naive_count(lines, start_time, stop_time):
+    return len([line for line in lines if (not start_time or line[9:15] >= bytes(start_time, 'ascii')) and (not stop_time or line[9:15] <= bytes(stop_time, 'ascii'))])
+
+def test_count_log_rollup_matches_lines(tmp_path, monkeypatch):
+    lines = write_log(tmp_path, monkeypatch)
+    logger_index.IndexWriter().update('20171205-40-facility_one', lines[:-100], 0) # Rollup behind the log file.
+    for (start_time, stop_time) in (('', ''), ('003012', '014545'), ('003000', '013059'), ('010203', '010207'), ('', '005920'), ('011501', '')):
+        assert logger_resource.count_log('20171205-40-facility_one', start_time, stop_time)[0] == naive_count(lines, start_time, stop_time)
+
+def test_count_log_inverted_range(tmp_path, monkeypatch):
+    lines = write_log(tmp_path, monkeypatch)
+    logger_index.IndexWriter().update('20171205-40-facility_one', lines[:-100], 0)
+    for (start_time, stop_time) in (('010230', '010130'), ('010230', '010210'), ('014500', '003000'), ('010259', '010200')):
+        assert logger_index.Rollup.load('20171205-40-facility_one').count(start_time, stop_time) == (0, [])
+        assert logger_resource.count_log('20171205-40-facility_one', start_time, stop_time)[0] == naive_count(lines, start_time, stop_time) == 0
+
+def test_count_log_without_rollup(tmp_path, monkeypatch):
+    lines = write_log(tmp_path, monkeypatch)
+    assert logger_resource.count_log('20171205-40-facility_one', '003012', '014545')[0] == naive_count(lines, '003012', '014545')
+
+def test_offset_index_out_of_order(tmp_path, monkeypatch):
+    seconds = list(range(0, 7200, 3))
+    seconds[100:110] = [second - 90 for second in seconds[100:110]] # Late arrivals.
+    lines = write_log(tmp_path, monkeypatch, seconds=seconds)
+    writer = logger_index.IndexWriter()
+    size = 0
+    for batch in range(0, len(lines), 250): # Index as the collector would, batch by batch.
+        writer.update('20171205-40-facility_one', lines[batch:batch + 250], size)
+        size += sum(len(line) for line in lines[batch:batch + 250])
+    rollup = logger_index.Rollup.load('20171205-40-facility_one')
+    assert rollup.lag == 87
+    (start, stop) = logger_index.OffsetIndex('20171205-40-facility_one').range('010000', '010010', rollup)
+    assert 0 < start < stop < size # Narrow window reads only part of the file.
+    for (start_time, stop_time) in (('000431', '000501'), ('000500', '000559'), ('010001', '010002'), ('', '000459'), ('015959', '')):
+        assert logger_resource.count_log('20171205-40-facility_one', start_time, stop_time)[0] == naive_count(lines, start_time, stop_time)
+
+def test_get_counts_cached_incrementally(tmp_path, monkeypatch):
+    lines = write_log(tmp_path, monkeypatch)
+    monkeypatch.setattr(logger_resource, 'query_cache', logger_resource.QueryCache())
+    url = '/api/v1/counts/20171205-003012/20171205-014545/40/facility_one'
+    filtered = logger_resource.GetFilter(url)
+    filtered.get_counts()
+    assert filtered.counts['all'] == naive_count(lines, '003012', '014545')
+    with open(str(tmp_path / '20171205-40-facility_one'), mode='ab') as log_file: # Append, as the collector would.
+        log_file.write(b'20171205-010000.000000-40-facility_one:message:name=facility_one\n')
+    filtered = logger_resource.GetFilter(url)
+    filtered.get_counts()
+    assert filtered.counts['all'] == naive_count(lines, '003012', '014545') + 1
+    filtered.get_counts()
+    assert logger_resource.query_cache.stats() == { 'entries': 1, 'capacity': 128, 'hits': 1, 'partial': 1, 'misses': 1 }
+
+def test_get_messages_pages_in_order(tmp_path, monkeypatch):
+    seconds = list(range(0, 7200, 3))
+    seconds[100:110] = [second - 90 for second in seconds[100:110]] # Late arrivals.
+    lines = write_log(tmp_path, monkeypatch, seconds=seconds)
+    logger_index.IndexWriter().update('20171205-40-facility_one', lines, 0)
+    (rows, cursor) = ([], '')
+    while cursor is not None:
+        filtered = logger_resource.GetFilter('/api/v1/messages/20171205-000200/20171205-003000?limit=100' + (cursor and '&cursor=' + cursor))
+        page = [json.loads(row.decode()) for row in filtered.get_messages()]
+        (rows, cursor) = (rows + page[:-1], page[-1]['cursor'])
+    assert [row['time'] for row in rows] == sorted(line[:22].decode() for line in lines if b'000200' <= line[9:15] <= b'003000')
+    assert rows[0] == { 'facility': 'facility_one', 'level': '40', 'time': '20171205-000200.000000', 'msg': 'message' }
+
+def test_get_messages_checks_options(tmp_path, monkeypatch):
+    lines = write_log(tmp_path, monkeypatch)
+    url = '/api/v1/messages/20171205-000200/20171205-003000'
+    for limit in ('0', '-1'): # At least one row.
+        rows = [json.loads(row.decode()) for row in logger_resource.GetFilter(url + '?limit=' + limit).get_messages()]
+        assert len(rows) == 2 and rows[0]['time'] == '20171205-000206.000000' and rows[1]['cursor']
+    monkeypatch.setattr(logger_resource, 'max_limit', 10)
+    assert len(list(logger_resource.GetFilter(url + '?limit=100000').get_messages())) == 11
+    for options in ('limit=abc', 'limit=1.5', 'cursor=garbage', 'cursor=' + logger_resource.encode_cursor(['20171205', 'x', 0]), 'cursor=' + logger_resource.encode_cursor({})):
+        filtered = logger_resource.GetFilter(url + '?' + options)
+        with pytest.raises(ValueError): # Before any row is generated.
+            filtered.get_messages()
+
+def test_get_ranges_from_catalog(tmp_path, tmp_path_factory, monkeypatch):
+    monkeypatch.setattr(logger_index, 'value_cap', 3)
+    lines = write_log(tmp_path, monkeypatch, seconds=range(0, 60))
+    monkeypatch.setattr(logger_index, 'index_directory', str(tmp_path_factory.mktemp('index'))) # Kept apart from the logs, as catalogs are not named like log files.
+    lines = [line.replace(b'name=facility_one', bytes('name=facility_one&user=u{0}&host=h{1}'.format(number % 2, number), 'ascii')) for (number, line) in enumerate(lines)]
+    writer = logger_index.IndexWriter()
+    writer.update('20171205-40-facility_one', lines[:10], 0) # Catalog behind the log file is caught up.
+    writer.save()
+    with open(str(tmp_path / '20171205-40-facility_one'), mode='wb') as log_file:
+        log_file.write(b''.join(lines))
+    writer = logger_index.IndexWriter()
+    writer.update('20171205-40-facility_one', lines[50:], sum(len(line) for line in lines[:50]))
+    writer.save()
+    ranges = logger_resource.GetFilter('/api/v1/ranges/20171205/20171205/40').get_ranges()
+    assert ranges == { 'levels': { '40': 60 }, 'facilities': { 'facility_one': 60 }, 'msg': { 'message': 60 },
+                       'keys': { 'user': { 'u0': 30, 'u1': 30 } }, 'capped': { 'host': 60 } }
+    assert logger_resource.GetFilter('/api/v1/ranges/20171206').get_ranges()['levels'] == {}
+
+def test_get_ranges_only_extra_keys(tmp_path, tmp_path_factory, monkeypatch):
+    write_log(tmp_path, monkeypatch, seconds=())
+    monkeypatch.setattr(logger_index, 'index_directory', str(tmp_path_factory.mktemp('index')))
+    lines = []
+    for number in range(3): # As sent by HTTPHandler, with every attribute of the record.
+        record = logging.LogRecord('facility_one', logging.ERROR, __file__, 42, 'message', None, None, func='main')
+        record.userid = 'u{0}'.format(number % 2)
+        lines.append(bytes('20171205-00000{0}.000000-40-facility_one:message:{1}\n'.format(number, urllib.parse.urlencode(record.__dict__)), 'ascii'))
+    with open(str(tmp_path / '20171205-40-facility_one'), mode='wb') as log_file:
+        log_file.write(b''.join(lines))
+    writer = logger_index.IndexWriter()
+    writer.update('20171205-40-facility_one', lines, 0)
+    writer.save()
+    ranges = logger_resource.GetFilter('/api/v1/ranges/20171205').get_ranges()
+    assert ranges['keys'] == { 'userid': { 'u0': 2, 'u1': 1 } } and ranges['capped'] == {}
+
+def write_colon_log(tmp_path, tmp_path_factory, monkeypatch):
+    """
+    Write and index a log file of lines stored by the server from messages with raw colons in msg and url.
+    """
+    write_log(tmp_path, monkeypatch, seconds=())
+    monkeypatch.setattr(logger_index, 'index_directory', str(tmp_path_factory.mktemp('index')))
+    lines = [logger_httpd.parse_message('name=facility_one&levelno=40&msg=Disk full: /var&url=http://x/{0}&created={1}'.format(number % 2, 1512432000 + number))[1].encode() for number in range(3)]
+    with open(str(tmp_path / '20171205-40-facility_one'), mode='wb') as log_file:
+        log_file.write(b''.join(lines))
+    writer = logger_index.IndexWriter()
+    writer.update('20171205-40-facility_one', lines, 0)
+    writer.save()
+
+def test_get_ranges_colon_in_values(tmp_path, tmp_path_factory, monkeypatch):
+    write_colon_log(tmp_path, tmp_path_factory, monkeypatch)
+    ranges = logger_resource.GetFilter('/api/v1/ranges/20171205').get_ranges()
+    assert ranges['msg'] == { 'Disk full: /var': 3 } and ranges['keys'] == { 'url': { 'http://x/0': 2, 'http://x/1': 1 } }
+
+def test_predicates_from_postings(tmp_path, tmp_path_factory, monkeypatch):
+    lines = write_log(tmp_path, monkeypatch, seconds=range(0, 600, 3))
+    monkeypatch.setattr(logger_index, 'index_directory', str(tmp_path_factory.mktemp('index')))
+    lines = [line.replace(b'message:name=facility_one', bytes('message {0}:name=facility_one&userid=u{1}&msecs={2}'.format(number % 3, number % 4, number), 'ascii')) for (number, line) in enumerate(lines)]
+    with open(str(tmp_path / '20171205-40-facility_one'), mode='wb') as log_file:
+        log_file.write(b''.join(lines))
+    writer = logger_index.IndexWriter()
+    writer.update('20171205-40-facility_one', lines, 0)
+    writer.save()
+    expected = [line for line in lines if b'userid=u1' in line and (b'message 0:' in line or b'message 2:' in line) and line[9:15] >= b'000100']
+    filtered = logger_resource.GetFilter('/api/v1/counts/20171205-000100//40/userid=u1/msg=message%200|msg=message%202')
+    filtered.get_counts()
+    assert filtered.counts['all'] == len(expected)
+    filtered = logger_resource.GetFilter('/api/v1/messages/20171205-000100//40/userid=u1/msg=message%200|msg=message%202?limit=10000')
+    rows = [json.loads(row.decode()) for row in filtered.get_messages()]
+    assert [row['time'] for row in rows[:-1]] == [line[:22].decode() for line in expected]
+    filtered = logger_resource.GetFilter('/api/v1/counts////msecs=1')
+    filtered.get_counts()
+    assert filtered.counts['all'] == 0 # Standard LogRecord attributes are not posted.
+
+def test_predicate_on_value_with_colons(tmp_path, tmp_path_factory, monkeypatch):
+    write_colon_log(tmp_path, tmp_path_factory, monkeypatch)
+    for (predicate, count) in (('url=http%3A%2F%2Fx%2F0', 2), ('url=http%3A%2F%2Fx%2F1', 1), ('msg=Disk%20full%3A%20%2Fvar', 3)):
+        filtered = logger_resource.GetFilter('/api/v1/counts/20171205///' + predicate)
+        filtered.get_counts()
+        assert filtered.counts['all'] == count
+    filtered = logger_resource.GetFilter('/api/v1/messages/20171205///url=http%3A%2F%2Fx%2F1')
+    rows = [json.loads(row.decode()) for row in filtered.get_messages()]
+    assert [row['msg'] for row in rows[:-1]] == ['Disk full: /var']
+
+def test_bad_filters_refused():
+    for url in ('/api/v1/counts////userid=u3|u5', '/api/v1/counts////userid=u3|', '/api/v1/counts////=u3', '/api/v1/counts////msg~%28unclosed', '/api/v1/counts////~a**'):
+        with pytest.raises(ValueError):
+            logger_resource.GetFilter(url)
+    with pytest.raises(ValueError):
+        logger_resource.GetFilter('/api/v1/counts/20171205?histogram=day').get_counts()
+
+def test_search_in_chunks(tmp_path, monkeypatch):
+    lines = write_log(tmp_path, monkeypatch, seconds=range(0, 3600, 3))
+    lines = [line.replace(b'message:', bytes('request {0} timed out after {1}s:'.format(number, number % 7), 'ascii')) for (number, line) in enumerate(lines)]
+    with open(str(tmp_path / '20171205-40-facility_one'), mode='wb') as log_file:
+        log_file.write(b''.join(lines))
+    logger_index.IndexWriter().update('20171205-40-facility_one', lines[:1000], 0)
+    monkeypatch.setattr(logger_search, 'chunk_bytes', 4000) # Many chunks, searched by the pool, with lines across chunk boundaries.
+    expected = [line for line in lines if b'after 3s' in line and b'001000' <= line[9:15] <= b'004500']
+    filtered = logger_resource.GetFilter('/api/v1/counts/20171205-001000/20171205-004500//msg~timed%20out%20after%20%5B3%5Ds')
+    filtered.get_counts()
+    assert filtered.counts['all'] == len(expected)
+    filtered = logger_resource.GetFilter('/api/v1/messages/20171205-001000/20171205-004500//~after%203s?limit=10000')
+    rows = [json.loads(row.decode()) for row in filtered.get_messages()]
+    assert [row['time'] for row in rows[:-1]] == [line[:22].decode() for line in expected]
+    filtered = logger_resource.GetFilter('/api/v1/counts/////msg~facility_one')
+    filtered.get_counts()
+    assert filtered.counts['all'] == 0 # Only msg is searched.
+
+def test_required_literal():
+    assert logger_search.required_literal('timed out after \\d+s') == 'timed out after '
+    assert logger_search.required_literal('ab{2}cd') == 'cd'
+    assert logger_search.required_literal('disk|network') == ''
+
+def test_log_catalog_selects_in_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(logger_resource, 'log_directory', str(tmp_path / 'logs'))
+    monkeypatch.setattr(logger_archive, 'archive_directory', str(tmp_path / 'archive'))
+    monkeypatch.setattr(logger_resource.LogCatalog, 'racy', 0)
+    (tmp_path / 'logs').mkdir()
+    for log_name in ('20171206-30-beta', '20171204-40-alpha', '20171205-50-alpha', '20171205-30-gamma', '20171205-30-alpha'):
+        (tmp_path / 'logs' / log_name).write_bytes(b'')
+    catalog = logger_resource.LogCatalog()
+    assert [log[0] for log in catalog.select()] == ['20171204-40-alpha', '20171205-30-alpha', '20171205-30-gamma', '20171205-50-alpha', '20171206-30-beta']
+    assert [log[0] for log in catalog.select('20171205', '20171205', '30', '40', ['gamma', 'alpha'])] == ['20171205-30-alpha', '20171205-30-gamma']
+    listed = []
+    listdir = os.listdir
+    monkeypatch.setattr(logger_resource.os, 'listdir', lambda path: listed.append(path) or listdir(path))
+    assert len(list(catalog.select('20171206'))) == 1 and listed == [] # Unchanged, not listed again.
+    (tmp_path / 'logs' / '20171207-30-beta').write_bytes(b'')
+    os.utime(str(tmp_path / 'logs'), (1, 1)) # Changed, however coarse the clock.
+    assert [log[0] for log in catalog.select('20171206')] == ['20171206-30-beta', '20171207-30-beta'] and listed
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Test logger_spool.py and spool collection in logger_collector.py.
+"""
+
+import os
+import logger_spool
+import logger_collector
+import logger_index
+
+def test_spool_read_commit(tmp_path):
+    writer = logger_spool.SpoolWriter(str(tmp_path))
+    writer.append(['20171205-134200.000000-40-f:one:a\n', '20171205-134201.000000-40-f:two:b\n'])
+    reader = logger_spool.SpoolReader(str(tmp_path))
+    (records, position) = reader.read()
+    assert [logger_spool.split_record(record)[1] for record in records] == [b'20171205-134200.000000-40-f:one:a\n', b'20171205-134201.000000-40-f:two:b\n']
+    reader.commit(position)
+    assert logger_spool.SpoolReader(str(tmp_path)).read()[0] == [] # Resumes after committed records.
+
+def test_spool_rotates_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(logger_spool, 'segment_grace', -1.0)
+    writer = logger_spool.SpoolWriter(str(tmp_path), segment_bytes=50)
+    for index in range(5):
+        writer.append(['20171205-134200.000000-40-f:message {0}:content padding out the record\n'.format(index)])
+    assert len(logger_spool.list_segments(str(tmp_path))) == 6 # Every record fills a segment.
+    reader = logger_spool.SpoolReader(str(tmp_path))
+    messages = []
+    while True:
+        (records, position) = reader.read()
+        if not records: break
+        messages.extend(records)
+        reader.commit(position)
+    assert len(messages) == 5
+    assert len(logger_spool.list_segments(str(tmp_path))) == 1 # Finished segments removed.
+
+def test_collector_recovers_interrupted_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(logger_collector, 'log_directory', str(tmp_path))
+    monkeypatch.setattr(logger_index, 'log_directory', str(tmp_path))
+    monkeypatch.setattr(logger_index, 'index_directory', str(tmp_path))
+    spool = os.path.join(str(tmp_path), 'spool')
+    logger_spool.SpoolWriter(spool).append(['20171205-134200.000000-40-f:one:a\n'])
+    reader = logger_spool.SpoolReader(spool)
+    (records, position) = reader.read()
+    log_lines = logger_collector.group_lines(record[record.index(b' ') + 1:] for record in records)
+    reader.begin(logger_collector.log_sizes(log_lines))
+    logger_collector.append_lines(log_lines) # Killed before commit.
+    reader = logger_spool.SpoolReader(spool)
+    logger_collector.recover(reader)
+    assert logger_collector.collect_spool(reader, logger_index.IndexWriter()) == 1
+    assert open(os.path.join(str(tmp_path), '20171205-40-f')).read() == '20171205-134200.000000-40-f:one:a\n'
+
+def test_partitioned_spool_by_facility(tmp_path):
+    writer = logger_spool.PartitionedSpoolWriter(str(tmp_path))
+    loglines = ['20171205-134200.000000-40-facility_{0}:message:a\n'.format(index % 4) for index in range(20)]
+    writer.append(loglines)
+    for logline in loglines[:4]: # Each facility's messages are all in the partition for that facility.
+        reader = logger_spool.SpoolReader(logger_spool.partition_directory(logger_spool.partition_of(logline), str(tmp_path)))
+        facilities = set(logger_spool.split_record(record)[1][26:].split(b':')[0] for record in reader.read()[0])
+        assert logline[26:].split(':')[0].encode() in facilities
+    total = 0
+    for partition in range(logger_spool.spool_partitions):
+        total += len(logger_spool.SpoolReader(logger_spool.partition_directory(partition, str(tmp_path))).read()[0])
+    assert total == 20
+
+def test_collector_quarantines_malformed_records(tmp_path, monkeypatch):
+    monkeypatch.setattr(logger_collector, 'log_directory', str(tmp_path))
+    monkeypatch.setattr(logger_index, 'log_directory', str(tmp_path))
+    monkeypatch.setattr(logger_index, 'index_directory', str(tmp_path))
+    spool = os.path.join(str(tmp_path), 'spool')
+    logger_spool.SpoolWriter(spool).append(['20171205-134200.000000-40-f:one:a=1\n2\n', '20171205-134201.000000-40-f:two:b\n']) # Split by a newline.
+    reader = logger_spool.SpoolReader(spool)
+    assert logger_collector.collect_spool(reader, logger_index.IndexWriter()) == 3
+    assert logger_collector.collect_spool(reader, logger_index.IndexWriter()) == 0 # Committed, not read again.
+    assert open(os.path.join(str(tmp_path), '20171205-40-f')).read() == '20171205-134200.000000-40-f:one:a=1\n20171205-134201.000000-40-f:two:b\n'
+    assert open(os.path.join(spool, 'quarantine')).read() == '2\n'
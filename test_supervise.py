@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+Test logger_supervise.py.
+"""
+
+import os
+import sys
+import logger_supervise
+
+def test_backoff_doubles_then_starts_over(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(logger_supervise.time, 'monotonic', lambda: now[0])
+    backoff = logger_supervise.Backoff()
+    delays = []
+    for attempt in range(8): # Dying soon after each start.
+        backoff.start(0)
+        now[0] += 0.1
+        delays.append(backoff.delay(0))
+    assert delays == [1, 2, 4, 8, 16, 32, 60, 60]
+    backoff.start(0)
+    now[0] += 60 # Ran a good while.
+    assert backoff.delay(0) == 1
+    assert backoff.delay(1) == 1 # Each key apart.
+
+def child_status(target):
+    pid = os.fork()
+    if not pid:
+        logger_supervise.run_child(target)
+    return os.WEXITSTATUS(os.waitpid(pid, 0)[1])
+
+def test_run_child_exit_status(capfd):
+    assert child_status(lambda: None) == 0
+    assert child_status(lambda: sys.exit(0)) == 0 # Terminated by SIGTERM handler.
+    assert 'Traceback' not in capfd.readouterr().err
+    assert child_status(lambda: 1 / 0) == 1
+    assert 'ZeroDivisionError' in capfd.readouterr().err # Reported, not swallowed.
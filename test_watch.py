@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Test logger_watch.py.
+"""
+
+import time
+import threading
+import pytest
+import logger_watch
+import logger_spool
+
+def inotify_watcher(paths):
+    watcher = logger_watch.get_watcher(paths)
+    if not isinstance(watcher, logger_watch.InotifyWatcher):
+        watcher.close()
+        pytest.skip('inotify is not available')
+    return watcher
+
+def test_inotify_wakes_on_spool_append(tmp_path):
+    watcher = inotify_watcher([str(tmp_path)])
+    writer = logger_spool.SpoolWriter(str(tmp_path))
+    writer.append(['20171205-134200.000000-40-f:one:a\n']) # Segment created.
+    assert watcher.wait(0) and not watcher.wait(0) # Events consumed.
+    timer = threading.Timer(0.2, writer.append, [['20171205-134201.000000-40-f:two:b\n']]) # Appended to the segment.
+    began = time.monotonic()
+    timer.start()
+    assert watcher.wait(5)
+    assert 0.15 <= time.monotonic() - began < 2
+    timer.join()
+    watcher.close()
+
+def test_inotify_times_out(tmp_path):
+    watcher = inotify_watcher([str(tmp_path / 'one'), str(tmp_path / 'two')]) # Directories are created.
+    began = time.monotonic()
+    assert not watcher.wait(0.1)
+    assert time.monotonic() - began >= 0.09
+    (tmp_path / 'two' / 'file').write_bytes(b'x')
+    assert watcher.wait(0)
+    watcher.close()
+
+def test_falls_back_to_polling(tmp_path, monkeypatch):
+    class Libc(): # Without inotify support.
+        def inotify_init1(self, flags): return -1
+    monkeypatch.setattr(logger_watch.ctypes, 'CDLL', lambda *args, **kwargs: Libc())
+    monkeypatch.setattr(logger_watch.sys, 'platform', 'linux')
+    watcher = logger_watch.get_watcher([str(tmp_path)], min_delay=0.01)
+    assert isinstance(watcher, logger_watch.PollWatcher)
+    monkeypatch.setattr(logger_watch.sys, 'platform', 'darwin')
+    assert isinstance(logger_watch.get_watcher([str(tmp_path)]), logger_watch.PollWatcher)
+    sleeps = []
+    monkeypatch.setattr(logger_watch.time, 'sleep', sleeps.append)
+    assert all(watcher.wait(0.05) for attempt in range(4))
+    watcher.activity()
+    watcher.wait(0.05)
+    assert sleeps == [0.01, 0.02, 0.04, 0.05, 0.01] # Backing off while idle, up to the timeout.